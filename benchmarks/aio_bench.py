@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""
+Compares running a typical set of independent hook-time queries (a few
+unit pod lookups plus a Prometheus config fetch) one after the other with
+http.client against running them through adapters.aio.run_concurrently().
+Both go against local stub servers that add a fixed latency per request.
+
+Usage: python3 benchmarks/aio_bench.py [latency in seconds] [units]
+"""
+from http.server import (
+    BaseHTTPRequestHandler,
+    HTTPServer,
+)
+from socketserver import ThreadingMixIn
+import http.client
+import json
+import sys
+import threading
+import time
+
+sys.path.append('lib')
+sys.path.append('src')
+from adapters import aio
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def start_stub_server(latency):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_GET(self):
+            time.sleep(latency)
+            payload = json.dumps({'path': self.path}).encode()
+            self.send_response(200)
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def queries(units):
+    paths = ['/api/v1/namespaces/lma/pods/prometheus-{}'.format(i)
+             for i in range(units)]
+    return [('k8s', path) for path in paths] + \
+        [('prometheus', '/api/v1/status/config')]
+
+
+def run_sequentially(ports, units):
+    for server, path in queries(units):
+        conn = http.client.HTTPConnection('127.0.0.1', ports[server])
+        conn.request('GET', path)
+        json.loads(conn.getresponse().read())
+        conn.close()
+
+
+def run_concurrently(ports, units):
+    clients = {
+        server: aio.AsyncHTTPClient('127.0.0.1', port)
+        for server, port in ports.items()
+    }
+    results = aio.run_concurrently([
+        (lambda client, path: lambda: client.get(path))(clients[s], p)
+        for s, p in queries(units)
+    ])
+    for result in results:
+        if isinstance(result, Exception):
+            raise result
+        result.json()
+
+
+def timed(func, *args, rounds=5):
+    best = None
+    for _ in range(rounds):
+        started = time.perf_counter()
+        func(*args)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    latency = float(sys.argv[1]) if len(sys.argv) > 1 else 0.05
+    units = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+
+    servers = {
+        'k8s': start_stub_server(latency),
+        'prometheus': start_stub_server(latency),
+    }
+    ports = {name: server.server_port for name, server in servers.items()}
+
+    sequential = timed(run_sequentially, ports, units)
+    concurrent = timed(run_concurrently, ports, units)
+
+    print("{} queries, {:.0f}ms latency each, concurrency {}".format(
+        units + 1, latency * 1000, aio.DEFAULT_CONCURRENCY
+    ))
+    print("sequential: {:8.1f}ms".format(sequential * 1000))
+    print("concurrent: {:8.1f}ms".format(concurrent * 1000))
+    print("speedup:    {:8.1f}x".format(sequential / concurrent))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+"""
+Compares dumping and loading a large Prometheus config, the monitor-k8s scrape
+configs repeated as many times as asked, with PyYAML's pure Python SafeDumper
+and SafeLoader against the libyaml ones used by yaml_codec.
+
+Usage: python3 benchmarks/yaml_bench.py [copies of the k8s scrape configs]
+"""
+import sys
+import timeit
+
+sys.path.append('lib')
+sys.path.append('src')
+import yaml
+import domain
+import yaml_codec
+
+
+def build_config(copies):
+    config = domain.PrometheusConfigFile(global_opts={
+        'scrape_interval': '15s',
+    })
+    for i in range(copies):
+        for scrape_config in domain.load_k8s_scrape_configs():
+            scrape_config['job_name'] += '-{}'.format(i)
+            config.add_scrape_config(scrape_config)
+    return config.to_dict()
+
+
+def best_of(func, repeat=5):
+    return min(timeit.repeat(func, number=1, repeat=repeat))
+
+
+def main():
+    copies = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    if not yaml_codec.LIBYAML:
+        print("PyYAML was built without libyaml, nothing to compare")
+        return
+
+    config = build_config(copies)
+    dumped = yaml_codec.dump(config)
+    print("Prometheus config with {} scrape jobs, {} KiB of YAML".format(
+        len(config['scrape_configs']), len(dumped) // 1024
+    ))
+
+    for name, slow, fast in (
+        ('dump',
+         lambda: yaml_codec.dump(config, dumper=yaml.SafeDumper),
+         lambda: yaml_codec.dump(config, dumper=yaml.CSafeDumper)),
+        ('load',
+         lambda: yaml_codec.load(dumped, loader=yaml.SafeLoader),
+         lambda: yaml_codec.load(dumped, loader=yaml.CSafeLoader)),
+    ):
+        slow_time = best_of(slow)
+        fast_time = best_of(fast)
+        print("{}: pure Python {:.1f}ms, libyaml {:.1f}ms ({:.1f}x)".format(
+            name, slow_time * 1000, fast_time * 1000, slow_time / fast_time
+        ))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,258 @@
+import asyncio
+import collections
+import concurrent.futures
+import json
+import logging
+import time
+import urllib.parse
+logger = logging.getLogger()
+
+from adapters import k8s
+from exceptions import KubernetesAPIError
+import instrumentation
+
+
+# Maximum number of queries in flight at any given time when running them
+# through run_concurrently()
+DEFAULT_CONCURRENCY = 4
+
+# Seconds after which a single request is abandoned
+DEFAULT_TIMEOUT = 30
+
+
+class HTTPResponse(collections.namedtuple('HTTPResponse',
+                                          ['status', 'headers', 'body'])):
+
+    def json(self):
+        return json.loads(self.body)
+
+
+class AsyncHTTPClient:
+    """
+    A minimal asyncio HTTP/1.1 client. It opens one connection per request,
+    which is all it takes to run a handful of independent hook-time queries
+    against the k8s API server and Prometheus side by side.
+
+    Requests are only noted down while the event loop runs, as the
+    instrumentation registry is not thread-safe. record_requests() hands
+    them to the registry once the results are in.
+    """
+
+    def __init__(self, host, port=None, ssl_context=None, headers=None,
+                 timeout=DEFAULT_TIMEOUT, client_name='http',
+                 path_template=None):
+        self.host = host
+        self.port = port or (443 if ssl_context else 80)
+        self._ssl_context = ssl_context
+        self._headers = headers or {}
+        self._timeout = timeout
+        self._client_name = client_name
+        self._path_template = path_template or \
+            (lambda path: path.partition('?')[0])
+        self._observations = []
+
+    def record_requests(self, metrics=None):
+        metrics = instrumentation.registry if metrics is None else metrics
+        while self._observations:
+            metrics.observe(**self._observations.pop(0))
+
+    async def get(self, path, headers=None):
+        return await self.request('GET', path, headers=headers)
+
+    async def post(self, path, headers=None, body=None):
+        return await self.request('POST', path, headers=headers, body=body)
+
+    async def request(self, method, path, headers=None, body=None):
+        all_headers = {
+            'Host': self.host,
+            'Connection': 'close',
+        }
+        all_headers.update(self._headers)
+        all_headers.update(headers or {})
+        if body is not None:
+            all_headers['Content-Length'] = str(len(body))
+
+        logger.debug("{} {}/{}".format(method, self.host, path))
+        started = time.monotonic()
+        status, bytes_received = 'error', 0
+        try:
+            response = await asyncio.wait_for(
+                self._request(method, path, all_headers, body),
+                self._timeout
+            )
+            status, bytes_received = response.status, len(response.body)
+            return response
+        finally:
+            self._observations.append(dict(
+                client=self._client_name,
+                method=method,
+                path=self._path_template(path),
+                status=status,
+                latency=time.monotonic() - started,
+                bytes_received=bytes_received,
+            ))
+
+    async def _request(self, method, path, headers, body):
+        reader, writer = await asyncio.open_connection(
+            self.host, self.port, ssl=self._ssl_context
+        )
+        try:
+            head = '{} {} HTTP/1.1\r\n'.format(method, path) + ''.join(
+                '{}: {}\r\n'.format(k, v) for k, v in headers.items()
+            ) + '\r\n'
+            writer.write(head.encode('latin-1') + (body or b''))
+            await writer.drain()
+
+            status_line = await reader.readline()
+            try:
+                status = int(status_line.split(None, 2)[1])
+            except (IndexError, ValueError):
+                raise ConnectionError(
+                    "Malformed HTTP status line: {}".format(status_line)
+                )
+
+            response_headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b'\r\n', b'\n', b''):
+                    break
+                key, _, value = line.decode('latin-1').partition(':')
+                response_headers[key.strip().lower()] = value.strip()
+
+            if response_headers.get('transfer-encoding', '') == 'chunked':
+                response_body = await _read_chunked(reader)
+            elif 'content-length' in response_headers:
+                response_body = await reader.readexactly(
+                    int(response_headers['content-length'])
+                )
+            else:
+                response_body = await reader.read()
+
+            return HTTPResponse(status, response_headers, response_body)
+        finally:
+            writer.close()
+
+
+async def _read_chunked(reader):
+    chunks = []
+    while True:
+        size_line = await reader.readline()
+        size = int(size_line.split(b';', 1)[0].strip(), 16)
+        if size == 0:
+            # Skip the trailers
+            while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                pass
+            return b''.join(chunks)
+        chunks.append(await reader.readexactly(size))
+        await reader.readline()
+
+
+def kubernetes_client():
+    """
+    Returns a client for the k8s API server that shares the SSL context and
+    service account token of the synchronous k8s adapter.
+    """
+    pool = k8s.get_connection_pool()
+    return AsyncHTTPClient(
+        pool.host,
+        ssl_context=pool.ssl_context,
+        headers={
+            'Authorization': 'Bearer {}'.format(pool.token)
+        },
+        client_name='kubernetes',
+        path_template=k8s.path_template
+    )
+
+
+def prometheus_client(juju_model, juju_app):
+    return AsyncHTTPClient('{0}.{1}.svc'.format(juju_app, juju_model),
+                           client_name='prometheus')
+
+
+async def get_app_pod_statuses(client, juju_model, juju_app,
+                               limit=k8s.LIST_PAGE_SIZE):
+    """
+    Resolves the status of every unit of the app with a paged LIST of the
+    app's pods through the given k8s API server client. Returns a dict of
+    unit name to k8s.PodStatus. Pods that aren't annotated with a unit name
+    are left out. Any failure to get the pod list surfaces as a
+    KubernetesAPIError.
+    """
+    namespace = juju_model
+
+    path = '/api/v1/namespaces/{}/pods?' \
+           'labelSelector=juju-app={}&limit={}'.format(namespace, juju_app,
+                                                       limit)
+
+    pod_statuses = {}
+    continue_token = None
+    while True:
+        page_path = path
+        if continue_token:
+            page_path += '&continue={}'.format(
+                urllib.parse.quote(continue_token)
+            )
+
+        try:
+            response = await client.get(page_path)
+            if response.status != 200:
+                raise KubernetesAPIError(
+                    "List request failed with HTTP {}: {}".format(
+                        response.status, response.body
+                    )
+                )
+            pod_list = response.json()
+        except (OSError, EOFError, asyncio.TimeoutError, ValueError) as e:
+            raise KubernetesAPIError(
+                "List request failed: {}".format(str(e) or type(e).__name__)
+            )
+
+        for status_dict in pod_list.get('items') or []:
+            pod_status = k8s.PodStatus(status_dict)
+            if pod_status.unit_name:
+                pod_statuses[pod_status.unit_name] = pod_status
+
+        continue_token = (pod_list.get('metadata') or {}).get('continue')
+        if not continue_token:
+            return pod_statuses
+
+
+def run_concurrently(coroutine_functions, concurrency=DEFAULT_CONCURRENCY):
+    """
+    Synchronous facade for the ops framework. Runs the given coroutine
+    functions on a private event loop, at most `concurrency` of them at a
+    time, and returns their results in the same order. An exception raised
+    by one of them is returned in place of its result so that one failed
+    query doesn't throw away the results of the others.
+    """
+    async def run_all():
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def run_one(coroutine_function):
+            async with semaphore:
+                return await coroutine_function()
+
+        return await asyncio.gather(
+            *(run_one(f) for f in coroutine_functions),
+            return_exceptions=True
+        )
+
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(run_all())
+    finally:
+        loop.close()
+
+
+def run_in_background(coroutine_functions, concurrency=DEFAULT_CONCURRENCY):
+    """
+    Like run_concurrently(), but runs the event loop on a worker thread and
+    returns a concurrent.futures.Future of the results right away. The
+    caller gets on with its blocking work in the meantime, which is where
+    anything that goes through the ops framework belongs.
+    """
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+    future = executor.submit(run_concurrently, coroutine_functions,
+                             concurrency)
+    executor.shutdown(wait=False)
+    return future
@@ -3,7 +3,7 @@ from ops.model import (
     BlockedStatus,
     ModelError,
 )
-import yaml
+import yaml_codec
 
 
 # MODELS
@@ -49,8 +49,8 @@ def _fetch_image_meta(image_name, resources_repo):
         raise ResourceError(image_name, msg)
 
     try:
-        resource_dict = yaml.safe_load(resource_yaml)
-    except yaml.error.YAMLError:
+        resource_dict = yaml_codec.load(resource_yaml)
+    except yaml_codec.YAMLError:
         msg = 'Invalid YAML at {})'.format(path)
         raise ResourceError(image_name, msg)
     else:
@@ -101,6 +101,9 @@ class FrameworkAdapter:
     def observe(self, event, handler):
         self._framework.observe(event, handler)
 
+    def set_app_status(self, state_obj):
+        self._framework.model.app.status = state_obj
+
     def set_pod_spec(self, spec_obj):
         self._framework.model.pod.set_spec(spec_obj)
 
@@ -1,91 +1,727 @@
+import codecs
+import collections
+import gzip
 import json
 import http.client
 import logging
 logger = logging.getLogger()
+import os
 import ssl
+import time
+import urllib.parse
 
+from exceptions import KubernetesAPIError
+import instrumentation
 
-def get_pod_status(juju_model, juju_app, juju_unit):
+
+SERVICE_ACCOUNT_PATH = '/var/run/secrets/kubernetes.io/serviceaccount'
+
+# Number of items requested per page when listing resources
+LIST_PAGE_SIZE = 100
+
+# Juju sets JUJU_DEBUG in `juju debug-hooks` sessions. That's when having
+# the whole pod dict at hand is worth the memory.
+KEEP_RAW_POD_STATUS = 'JUJU_DEBUG' in os.environ
+
+# What a refused or dropped connection, a truncated gzip stream or a body
+# that isn't JSON may raise. They all surface as a KubernetesAPIError.
+TRANSPORT_ERRORS = (OSError, EOFError, http.client.HTTPException, ValueError)
+
+
+def get_pod_status(juju_model, juju_app, juju_unit, pod_name=None):
+    """
+    Looks up the unit's pod directly by name, trying the given pod_name (as
+    resolved in an earlier hook) and then the StatefulSet naming convention
+    `<app>-<unit number>`. Only if both miss are all of the app's pods
+    listed and searched for the unit's annotation.
+    """
     namespace = juju_model
+    api_server = APIServer()
+
+    for candidate in _candidate_pod_names(juju_unit, pod_name):
+        path = '/api/v1/namespaces/{}/pods/{}'.format(namespace, candidate)
+        response = api_server.get(path)
+        if response.get('kind', '') == 'Pod' and \
+                _get_unit_name(response) == juju_unit:
+            return PodStatus(response)
+        logger.debug("Pod {} does not belong to {}".format(candidate,
+                                                           juju_unit))
 
     path = '/api/v1/namespaces/{}/pods?' \
            'labelSelector=juju-app={}'.format(namespace, juju_app)
 
+    # Pods are decoded one at a time as they stream in so we can stop
+    # reading as soon as we come across the unit's pod.
+    status_dict = next(
+        (i for i in api_server.list(path)
+         if _get_unit_name(i) == juju_unit),
+        None
+    )
+
+    return PodStatus(status_dict)
+
+
+def get_config_map_file(juju_model, juju_app, file_name,
+                        config_map_name=None):
+    """
+    Returns a (ConfigMap name, content) tuple for a file that Juju put in one
+    of the app's ConfigMaps, or (None, None) if there's no such file. The
+    given config_map_name (as resolved in an earlier hook) is looked up
+    directly. Only if that misses are all of the app's ConfigMaps listed.
+    """
+    namespace = juju_model
     api_server = APIServer()
-    response = api_server.get(path)
-    status_dict = None
 
-    if response.get('kind', '') == 'PodList' and response['items']:
-        status_dict = next(
-            (i for i in response['items']
-             if i['metadata']['annotations'].get('juju.io/unit') == juju_unit),
-            None
-        )
+    if config_map_name:
+        path = '/api/v1/namespaces/{}/configmaps/{}'.format(namespace,
+                                                            config_map_name)
+        response = api_server.get(path)
+        if response.get('kind', '') == 'ConfigMap':
+            content = (response.get('data') or {}).get(file_name)
+            if content is not None:
+                return config_map_name, content
+        logger.debug("ConfigMap {} does not hold {}".format(
+            config_map_name, file_name
+        ))
+
+    path = '/api/v1/namespaces/{}/configmaps?' \
+           'labelSelector=juju-app={}'.format(namespace, juju_app)
+    for config_map in api_server.list(path):
+        content = (config_map.get('data') or {}).get(file_name)
+        if content is not None:
+            return config_map['metadata']['name'], content
+
+    return None, None
+
+
+def _candidate_pod_names(juju_unit, pod_name=None):
+    candidates = []
+    if pod_name:
+        candidates.append(pod_name)
+
+    # Juju deploys charms with storage as StatefulSets, the pods of which
+    # are named after the unit: prometheus/0 runs in pod prometheus-0.
+    statefulset_pod_name = str(juju_unit).replace('/', '-')
+    if statefulset_pod_name not in candidates:
+        candidates.append(statefulset_pod_name)
+
+    return candidates
 
-    return PodStatus(status_dict)
+
+def _get_unit_name(status_dict):
+    annotations = status_dict.get('metadata', {}).get('annotations') or {}
+    return annotations.get('juju.io/unit')
+
+
+def watch_pod_status(juju_model, juju_app, juju_unit, pod_name=None,
+                     resource_version=None, timeout_seconds=60):
+    """
+    Yields a PodStatus every time the API server reports a change to the
+    unit's pod. The generator ends when the API server closes the watch,
+    which it does after at most `timeout_seconds`.
+
+    :param pod_name: If known, only this pod is watched instead of all of
+        the app's pods.
+    :param resource_version: Only changes newer than this version are
+        reported. If omitted, the current state of the pod is reported first.
+    """
+    namespace = juju_model
+
+    path = '/api/v1/namespaces/{}/pods?' \
+           'labelSelector=juju-app={}&watch=true&timeoutSeconds={}'.format(
+               namespace, juju_app, timeout_seconds
+           )
+    if pod_name:
+        path += '&fieldSelector=metadata.name={}'.format(pod_name)
+    if resource_version:
+        path += '&resourceVersion={}'.format(resource_version)
+
+    api_server = APIServer()
+    # Give the API server a little slack to close the stream by itself
+    # before our own socket timeout kicks in.
+    for event in api_server.watch(path, timeout=timeout_seconds + 5):
+        if event.get('type') == 'ERROR':
+            raise KubernetesAPIError(
+                "Watch returned an error: {}".format(
+                    event.get('object', {}).get('message', event)
+                )
+            )
+
+        status_dict = event.get('object') or {}
+        if _get_unit_name(status_dict) != juju_unit:
+            continue
+
+        if event.get('type') == 'DELETED':
+            yield PodStatus(None)
+        else:
+            yield PodStatus(status_dict)
+
+
+class APIConnectionPool:
+    """
+    Keeps whatever is expensive to set up when talking to the k8s API server
+    around for the lifetime of the hook process: the SSL context, the service
+    account token and idle keep-alive connections. The token is re-read only
+    when the token file changes on disk.
+    """
+
+    def __init__(self,
+                 host='kubernetes.default.svc',
+                 token_path=SERVICE_ACCOUNT_PATH + '/token',
+                 ca_path=SERVICE_ACCOUNT_PATH + '/ca.crt'):
+        self.host = host
+        self._token_path = token_path
+        self._ca_path = ca_path
+        self._ssl_context = None
+        self._token = None
+        self._token_mtime = None
+        self._idle_connections = []
+        self.connections_opened = 0
+        self.connections_reused = 0
+
+    @property
+    def ssl_context(self):
+        if self._ssl_context is None:
+            self._ssl_context = ssl.SSLContext()
+            self._ssl_context.load_verify_locations(self._ca_path)
+        return self._ssl_context
+
+    @property
+    def token(self):
+        token_mtime = os.stat(self._token_path).st_mtime
+        if token_mtime != self._token_mtime:
+            logger.debug("Loading service account token")
+            with open(self._token_path) as token_file:
+                self._token = token_file.read()
+            self._token_mtime = token_mtime
+        return self._token
+
+    @property
+    def stats(self):
+        return {
+            'connections_opened': self.connections_opened,
+            'connections_reused': self.connections_reused,
+        }
+
+    def acquire(self, timeout=None):
+        """
+        Returns a (connection, reused) tuple, preferring an idle
+        connection over opening a new one.
+        """
+        if self._idle_connections:
+            conn = self._idle_connections.pop()
+            conn.timeout = timeout
+            if conn.sock:
+                conn.sock.settimeout(timeout)
+            self.connections_reused += 1
+            return conn, True
+
+        conn = http.client.HTTPSConnection(self.host,
+                                           context=self.ssl_context,
+                                           timeout=timeout)
+        self.connections_opened += 1
+        return conn, False
+
+    def release(self, conn, response):
+        """
+        Hands a connection back to the pool. The response must have been
+        fully read, otherwise the connection can't be reused.
+        """
+        if response.will_close or not response.isclosed():
+            conn.close()
+        else:
+            self._idle_connections.append(conn)
+
+    def close(self):
+        while self._idle_connections:
+            self._idle_connections.pop().close()
+
+
+_connection_pool = None
+
+
+def get_connection_pool():
+    global _connection_pool
+    if _connection_pool is None:
+        _connection_pool = APIConnectionPool()
+    return _connection_pool
 
 
 class APIServer:
     """
     Wraps the logic needed to access the k8s API server from inside a pod.
     It does this by reading the service account token which is mounted onto
-    the pod.
+    the pod. Connections are shared by all instances through the process-wide
+    APIConnectionPool unless a specific pool is given.
     """
 
+    def __init__(self, pool=None, metrics=None):
+        self._pool = pool or get_connection_pool()
+        self._metrics = instrumentation.registry if metrics is None \
+            else metrics
+
+    @property
+    def stats(self):
+        return self._pool.stats
+
     def get(self, path):
         return self.request('GET', path)
 
     def request(self, method, path):
-        with open("/var/run/secrets/kubernetes.io/serviceaccount/token") \
-                as token_file:
-            kube_token = token_file.read()
+        try:
+            started = time.monotonic()
+            conn, response, retries = self._send(method, path,
+                                                 compressed=True)
+            wire = _CountingReader(response)
+            try:
+                body = _decompressed(wire).read()
+            finally:
+                self._pool.release(conn, response)
+            self._record(method, path, response.status, started, wire,
+                         retries)
+            logger.debug("API server connections: {}".format(self.stats))
+            return json.loads(body)
+        except TRANSPORT_ERRORS as e:
+            raise KubernetesAPIError("Request failed: {}".format(e))
 
-        ssl_context = ssl.SSLContext()
-        ssl_context.load_verify_locations(
-            '/var/run/secrets/kubernetes.io/serviceaccount/ca.crt')
+    def list(self, path, limit=LIST_PAGE_SIZE):
+        """
+        Yields the items of a LIST request one at a time. The items are
+        fetched in pages of at most `limit` items and each page is decoded
+        incrementally as it streams in, so only one item at a time is held
+        in memory and the caller may stop early.
+        """
+        try:
+            continue_token = None
+            while True:
+                page_path = '{}{}limit={}'.format(
+                    path, '&' if '?' in path else '?', limit
+                )
+                if continue_token:
+                    page_path += '&continue={}'.format(
+                        urllib.parse.quote(continue_token)
+                    )
 
+                started = time.monotonic()
+                conn, response, retries = self._send('GET', page_path,
+                                                     compressed=True)
+                wire = _CountingReader(response)
+                stream = _decompressed(wire)
+                if response.status != 200:
+                    body = stream.read()
+                    self._pool.release(conn, response)
+                    self._record('GET', path, response.status, started, wire,
+                                 retries)
+                    raise KubernetesAPIError(
+                        "List request failed with HTTP {}: {}".format(
+                            response.status, body
+                        )
+                    )
+
+                metadata = {}
+                try:
+                    for key, value in JSONObjectStream(stream):
+                        if key == 'items':
+                            yield value
+                        elif key == 'metadata':
+                            metadata = value
+                    # Consume whatever trails the object so that the connection
+                    # can be reused.
+                    stream.read()
+                finally:
+                    self._pool.release(conn, response)
+                    self._record('GET', path, response.status, started, wire,
+                                 retries)
+
+                continue_token = (metadata or {}).get('continue')
+                if not continue_token:
+                    return
+        except TRANSPORT_ERRORS as e:
+            raise KubernetesAPIError("List request failed: {}".format(e))
+
+    def watch(self, path, timeout=None):
+        """
+        Issues a watch request and yields each event as soon as the API
+        server flushes it down the (chunked) response stream.
+        """
+        try:
+            started = time.monotonic()
+            conn, response, retries = self._send('GET', path,
+                                                 timeout=timeout)
+            wire = _CountingReader(response)
+            if response.status != 200:
+                body = wire.read()
+                self._pool.release(conn, response)
+                self._record('GET', path, response.status, started, wire,
+                             retries)
+                raise KubernetesAPIError(
+                    "Watch request failed with HTTP {}: {}".format(
+                        response.status, body
+                    )
+                )
+
+            # Watches are long-lived and may be abandoned half-way through
+            # the stream so the connection is never handed back to the pool.
+            try:
+                for line in wire:
+                    line = line.strip()
+                    if line:
+                        yield json.loads(line)
+            finally:
+                conn.close()
+                self._record('GET', path, response.status, started, wire,
+                             retries)
+        except TRANSPORT_ERRORS as e:
+            raise KubernetesAPIError("Watch stream broke: {}".format(e))
+
+    def _send(self, method, path, timeout=None, compressed=False):
         headers = {
-            'Authorization': 'Bearer {}'.format(kube_token)
+            'Authorization': 'Bearer {}'.format(self._pool.token)
         }
+        if compressed:
+            headers['Accept-Encoding'] = 'gzip'
 
-        host = 'kubernetes.default.svc'
-        conn = http.client.HTTPSConnection(host, context=ssl_context)
-        logger.debug("{} {}/{}".format(method, host, path))
-        conn.request(method=method, url=path, headers=headers)
+        started = time.monotonic()
+        retries = 0
+        while True:
+            conn, reused = self._pool.acquire(timeout=timeout)
+            logger.debug("{} {}/{}".format(method, self._pool.host, path))
+            try:
+                conn.request(method=method, url=path, headers=headers)
+                return conn, conn.getresponse(), retries
+            except (ConnectionError, http.client.BadStatusLine):
+                conn.close()
+                # The API server may have dropped an idle keep-alive
+                # connection in the meantime. Retry on a fresh one.
+                if not reused:
+                    self._record(method, path, 'error', started, None,
+                                 retries)
+                    raise
+                retries += 1
+                logger.debug("Stale API server connection, reconnecting")
 
-        return json.loads(conn.getresponse().read())
+    def _record(self, method, path, status, started, wire, retries):
+        self._metrics.observe(
+            client='kubernetes',
+            method=method,
+            path=path_template(path),
+            status=status,
+            latency=time.monotonic() - started,
+            bytes_received=wire.bytes_read if wire else 0,
+            retries=retries,
+        )
 
 
-class PodStatus:
+def path_template(path):
+    """
+    Replaces the namespace and object name in a k8s API path with
+    placeholders so that requests for different objects of the same kind
+    are aggregated together. Watches are told apart from plain reads since
+    they are long-lived.
+    """
+    path, _, query = path.partition('?')
+    segments = path.split('/')
+    for i, segment in enumerate(segments):
+        if i >= 1 and segments[i - 1] == 'namespaces':
+            segments[i] = '{namespace}'
+        elif i >= 3 and segments[i - 3] == 'namespaces':
+            segments[i] = '{name}'
+    template = '/'.join(segments)
+    if 'watch=true' in query.split('&'):
+        template += '?watch=true'
+    return template
 
-    def __init__(self, status_dict):
-        self._status = status_dict
 
-    @property
-    def is_ready(self):
-        if not self._status:
+class _CountingReader:
+    """
+    Counts the bytes read off the wire from an HTTP response, before any
+    decompression.
+    """
+
+    def __init__(self, response):
+        self._response = response
+        self.bytes_read = 0
+
+    def getheader(self, name, default=None):
+        return self._response.getheader(name, default)
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            data = self._response.read()
+        else:
+            data = self._response.read(size)
+        self.bytes_read += len(data)
+        return data
+
+    def readline(self, size=-1):
+        data = self._response.readline(size)
+        self.bytes_read += len(data)
+        return data
+
+    def __iter__(self):
+        while True:
+            line = self.readline()
+            if not line:
+                return
+            yield line
+
+
+def _decompressed(response):
+    if response.getheader('Content-Encoding', '') == 'gzip':
+        return gzip.GzipFile(fileobj=response)
+    return response
+
+
+class JSONObjectStream:
+    """
+    Incrementally decodes a JSON object read from a binary stream, such as
+    a k8s PodList, yielding (key, value) pairs for its top-level keys. If
+    the value of `items` is an array, its elements are yielded one by one as
+    ('items', element) pairs as soon as each of them has been read, rather
+    than after the whole array has been loaded.
+    """
+
+    def __init__(self, stream, chunk_size=64 * 1024):
+        self._stream = stream
+        self._chunk_size = chunk_size
+        self._utf8 = codecs.getincrementaldecoder('utf-8')()
+        self._decoder = json.JSONDecoder()
+        self._buffer = ''
+        self._pos = 0
+        self._eof = False
+
+    def __iter__(self):
+        self._consume('{')
+        if self._peek() == '}':
+            self._consume('}')
+            return
+
+        while True:
+            key = self._decode_value()
+            self._consume(':')
+            if key == 'items' and self._peek() == '[':
+                self._consume('[')
+                if self._peek() == ']':
+                    self._consume(']')
+                else:
+                    while True:
+                        yield key, self._decode_value()
+                        if self._consume(',]') == ']':
+                            break
+            else:
+                yield key, self._decode_value()
+
+            if self._consume(',}') == '}':
+                return
+
+    def _fill(self):
+        if self._eof:
+            return False
+
+        chunk = self._stream.read(self._chunk_size)
+        if not chunk:
+            self._eof = True
+            self._buffer += self._utf8.decode(b'', final=True)
             return False
 
-        return next(
+        # Drop whatever has already been decoded
+        self._buffer = self._buffer[self._pos:] + self._utf8.decode(chunk)
+        self._pos = 0
+        return True
+
+    def _peek(self):
+        while True:
+            while self._pos < len(self._buffer) and \
+                    self._buffer[self._pos] in ' \t\r\n':
+                self._pos += 1
+            if self._pos < len(self._buffer):
+                return self._buffer[self._pos]
+            if not self._fill():
+                raise ValueError("Unexpected end of JSON stream")
+
+    def _consume(self, expected):
+        char = self._peek()
+        if char not in expected:
+            raise ValueError("Expected one of {} at {} but got {}".format(
+                expected, self._pos, char
+            ))
+        self._pos += 1
+        return char
+
+    def _decode_value(self):
+        self._peek()
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._buffer, self._pos)
+            except ValueError:
+                if self._fill():
+                    continue
+                raise
+            # A number cut off at the end of the buffer still decodes so
+            # only trust the value if there's something after it.
+            if end == len(self._buffer) and self._fill():
+                continue
+            self._pos = end
+            return value
+
+
+# Reasons for a container to be stuck in the waiting state that it will not
+# recover from on its own
+FAILED_CONTAINER_REASONS = frozenset([
+    'CrashLoopBackOff',
+    'CreateContainerConfigError',
+    'CreateContainerError',
+    'ErrImageNeverPull',
+    'ErrImagePull',
+    'ImagePullBackOff',
+    'InvalidImageName',
+    'RunContainerError',
+])
+
+# A container that keeps terminating is considered failed after this many
+# restarts, even before the kubelet reports it as CrashLoopBackOff
+FAILED_CONTAINER_RESTART_COUNT = 3
+
+ContainerStatus = collections.namedtuple(
+    'ContainerStatus', ['name', 'ready', 'restart_count', 'state', 'reason']
+)
+
+
+class PodStatus:
+    """
+    A snapshot of the parts of a pod's status the charm cares about. They
+    are extracted once at construction so that polling the properties in
+    readiness loops is cheap. The raw pod dict is dropped unless it is
+    explicitly kept or Juju runs the hook in a debug session.
+    """
+
+    __slots__ = (
+        '_is_unknown',
+        '_pod_name',
+        '_unit_name',
+        '_resource_version',
+        '_phase',
+        '_is_ready',
+        '_container_statuses',
+        '_failure_reason',
+        '_raw_status',
+    )
+
+    def __init__(self, status_dict, keep_raw=None):
+        if keep_raw is None:
+            keep_raw = KEEP_RAW_POD_STATUS
+
+        status_dict = status_dict or {}
+        metadata = status_dict.get('metadata') or {}
+        status = status_dict.get('status') or {}
+
+        self._is_unknown = not status_dict
+        self._pod_name = metadata.get('name')
+        self._unit_name = (metadata.get('annotations') or {}).get(
+            'juju.io/unit'
+        )
+        self._resource_version = metadata.get('resourceVersion')
+        self._phase = status.get('phase')
+        self._is_ready = next(
             (
-                condition['status'] == "True" for condition
-                in self._status['status']['conditions']
-                if condition['type'] == 'ContainersReady'
+                condition.get('status') == "True" for condition
+                in status.get('conditions') or []
+                if condition.get('type') == 'ContainersReady'
             ),
             False
         )
+        self._container_statuses = tuple(
+            _build_container_status(container_status)
+            for container_status in status.get('containerStatuses') or []
+        )
+        self._failure_reason = next(
+            (
+                "{}: {} (restarts: {})".format(c.name, c.reason,
+                                               c.restart_count)
+                for c in self._container_statuses if _is_failed(c)
+            ),
+            None
+        )
+        self._raw_status = status_dict if keep_raw and status_dict else None
 
     @property
-    def is_running(self):
-        if not self._status:
-            return False
+    def container_statuses(self):
+        return self._container_statuses
 
-        return self._status['status']['phase'] == 'Running'
+    @property
+    def failure_reason(self):
+        """
+        Describes the first container that is failing in a way that it will
+        not recover from by itself, or None if there is no such container.
+        """
+        return self._failure_reason
+
+    @property
+    def is_failed(self):
+        return self._failure_reason is not None
+
+    @property
+    def is_ready(self):
+        return self._is_ready
+
+    @property
+    def is_running(self):
+        return self._phase == 'Running'
 
     @property
     def is_unknown(self):
-        return not self._status
+        return self._is_unknown
+
+    @property
+    def phase(self):
+        return self._phase
+
+    @property
+    def pod_name(self):
+        return self._pod_name
 
     @property
     def raw_status(self):
-        return self._status
+        return self._raw_status
+
+    @property
+    def resource_version(self):
+        return self._resource_version
+
+    @property
+    def restart_count(self):
+        return sum(c.restart_count for c in self._container_statuses)
+
+    @property
+    def unit_name(self):
+        return self._unit_name
+
+    def __repr__(self):
+        return "PodStatus(pod_name={}, phase={}, ready={}, " \
+               "restarts={}, resource_version={})".format(
+                   self._pod_name, self._phase, self._is_ready,
+                   self.restart_count, self._resource_version
+               )
+
+
+def _build_container_status(container_status):
+    state, details = next(
+        iter((container_status.get('state') or {}).items()),
+        (None, None)
+    )
+    return ContainerStatus(
+        name=container_status.get('name'),
+        ready=bool(container_status.get('ready')),
+        restart_count=container_status.get('restartCount', 0),
+        state=state,
+        reason=(details or {}).get('reason'),
+    )
+
+
+def _is_failed(container_status):
+    if container_status.state == 'waiting':
+        return container_status.reason in FAILED_CONTAINER_REASONS
+    if container_status.state == 'terminated':
+        return container_status.reason != 'Completed' and \
+            container_status.restart_count >= FAILED_CONTAINER_RESTART_COUNT
+    return False
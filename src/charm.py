@@ -21,12 +21,31 @@ from ops.framework import StoredState
 from adapters.framework import FrameworkAdapter
 from domain import (
     build_juju_pod_spec,
-    reload_configuration,
+    build_juju_pod_spec_digest,
+    build_prometheus_config,
+    canonical_digest,
+    ConfigReload,
+    read_config_fingerprint,
+    ReadinessSchedule,
+    RELOAD_CONVERGED,
+    RELOAD_FAILED,
+    RELOAD_PENDING_PROPAGATION,
 )
-from adapters import k8s
-from exceptions import CharmError
+from adapters import (
+    aio,
+    k8s,
+)
+from exceptions import (
+    CharmError,
+    KubernetesAPIError,
+)
+import instrumentation
 from interface_alertmanager import AlertManagerInterface
 from interface_http import PrometheusInterface
+from interface_scrape_target import (
+    get_scrape_targets,
+    ScrapeTargetInterface,
+)
 
 
 # CHARM
@@ -49,21 +68,37 @@ class Charm(CharmBase):
         self.fw_adapter = FrameworkAdapter(self.framework)
         self.prometheus = PrometheusInterface(self, 'http-api')
         self.alertmanager = AlertManagerInterface(self, 'alertmanager')
+        self.scrape_target = ScrapeTargetInterface(self, 'scrape-target')
         # Bind event handlers to events
         event_handler_bindings = {
             self.on.start: self.on_start,
             self.on.config_changed: self.on_config_changed,
             self.on.upgrade_charm: self.on_upgrade,
+            self.on.leader_elected: self.on_leader_elected,
             self.on.stop: self.on_stop,
             self.alertmanager.on.new_relation:
                 self.on_new_alertmanager_relation,
+            self.scrape_target.on.targets_changed:
+                self.on_scrape_targets_changed,
+            self.on.api_metrics_action: self.on_api_metrics_action,
+            self.framework.on.pre_commit: self.on_pre_commit,
         }
         for event, handler in event_handler_bindings.items():
             self.fw_adapter.observe(event, handler)
 
         self._stored.set_default(
-            recently_started=True,
-            config_propagated=True
+            config_reload={},
+            alerting_config={},
+            config_map_name=None,
+            generation=0,
+            deferred_generations={},
+            pod_name=None,
+            readiness_deadline=None,
+            request_metrics={},
+            pod_spec_inputs_digest=None,
+            pod_spec_digest=None,
+            pod_spec_cache_hits=0,
+            pod_spec_cache_misses=0
         )
 
     # DELEGATORS
@@ -80,8 +115,21 @@ class Charm(CharmBase):
     def on_config_changed(self, event):
         on_config_changed_handler(event, self.fw_adapter, self._stored)
 
+    def on_api_metrics_action(self, event):
+        on_api_metrics_action_handler(event, self._stored)
+
+    def on_leader_elected(self, event):
+        on_leader_elected_handler(event, self._stored)
+
     def on_new_alertmanager_relation(self, event):
-        on_new_alertmanager_relation_handler(event, self.fw_adapter)
+        on_new_alertmanager_relation_handler(event, self.fw_adapter,
+                                             self._stored)
+
+    def on_pre_commit(self, event):
+        on_pre_commit_handler(event, self._stored)
+
+    def on_scrape_targets_changed(self, event):
+        on_scrape_targets_changed_handler(event, self.fw_adapter, self._stored)
 
     def on_start(self, event):
         on_start_handler(event, self.fw_adapter, self._stored)
@@ -102,34 +150,148 @@ class Charm(CharmBase):
 # coordinating domain models and services.
 
 def on_config_changed_handler(event, fw_adapter, state):
-    if set_juju_pod_spec(fw_adapter):
-        wait_for_pod_readiness(fw_adapter)
-        ensure_config_is_reloaded(event, fw_adapter, state)
+    generation = claim_generation(event, state)
+    if generation is None:
+        return
+
+    if not set_juju_pod_spec(fw_adapter, state):
+        # Nothing to wait for, so don't let a later hook pick up the
+        # deadline of this one
+        state.readiness_deadline = None
+        return
+
+    pod_is_ready = wait_for_pod_readiness(fw_adapter, state)
+    # The app status doesn't depend on the config reload, so the LIST of the
+    # app's pods goes out while the reload is being stepped.
+    app_pod_statuses = look_up_app_pod_statuses(fw_adapter)
 
+    if pod_is_ready:
+        if not ensure_config_is_reloaded(fw_adapter, state):
+            defer_generation(event, state, generation)
+    elif state.readiness_deadline:
+        # The pod may still become ready before the deadline. Let Juju
+        # get on with other hooks and check back later.
+        logger.debug("Pod not ready yet. Deferring.")
+        defer_generation(event, state, generation)
 
-def on_new_alertmanager_relation_handler(event, fw_adapter):
-    alerting_config = json.loads(event.data.get('alerting_config', '{}'))
-    set_juju_pod_spec(fw_adapter, alerting_config)
+    update_juju_app_status(fw_adapter, app_pod_statuses)
+
+
+def on_api_metrics_action_handler(event, state):
+    metrics = instrumentation.RequestMetrics.from_dict(state.request_metrics)
+    metrics.merge(instrumentation.registry)
+    event.set_results({'metrics': metrics.render()})
+
+
+def on_new_alertmanager_relation_handler(event, fw_adapter, state):
+    # Kept so that every later spec build, whatever its trigger, is built
+    # with the same alerting config
+    state.alerting_config = \
+        json.loads(event.data.get('alerting_config', '{}'))
+    set_juju_pod_spec(fw_adapter, state)
+
+
+def on_scrape_targets_changed_handler(event, fw_adapter, state):
+    # Only the file_sd files change, which Prometheus picks up by itself.
+    # The pod neither restarts nor needs a config reload.
+    set_juju_pod_spec(fw_adapter, state, set_status=False)
 
 
 def on_start_handler(event, fw_adapter, state):
-    set_juju_pod_spec(fw_adapter)
-    state.recently_started = True
-    state.config_propagated = True
+    set_juju_pod_spec(fw_adapter, state)
+    try:
+        expected_config = build_prometheus_config(fw_adapter.get_config())
+    except CharmError as e:
+        fw_adapter.set_unit_status(
+            BlockedStatus("Config build failure: {0}".format(e))
+        )
+        return
+
+    # Prometheus starts off the current ConfigMap so there's no need to
+    # reload it until the config changes
+    config_reload = ConfigReload(state.config_reload)
+    config_reload.adopt(expected_config.fingerprint)
+    state.config_reload = config_reload.to_dict()
 
 
 def on_upgrade_handler(event, fw_adapter, state):
+    # The new charm revision may ship different templates which the inputs
+    # digest does not cover.
+    state.pod_spec_inputs_digest = None
     on_start_handler(event, fw_adapter, state)
 
 
+def on_leader_elected_handler(event, state):
+    # The digests describe the spec this unit pushed when it last led. The
+    # leaders in between may have pushed a different one since.
+    state.pod_spec_inputs_digest = None
+    state.pod_spec_digest = None
+
+
+def on_pre_commit_handler(event, state):
+    # The registry only lives as long as the hook does. Fold it into the
+    # stored totals before the framework persists its state.
+    if len(instrumentation.registry):
+        metrics = instrumentation.RequestMetrics.from_dict(
+            state.request_metrics
+        )
+        metrics.merge(instrumentation.registry)
+        state.request_metrics = metrics.to_dict()
+        instrumentation.registry.clear()
+        # Juju runs actions in the workload container, which can't read
+        # the stored totals, so they also go to the unit log.
+        logger.info("API request totals:\n{0}".format(metrics.render()))
+
+
 def on_stop_handler(event, fw_adapter):
     fw_adapter.set_unit_status(MaintenanceStatus("Pod is terminating"))
 
 
+# EVENT COALESCING
+# Config changes tend to come in bursts, and every config-changed event
+# that can't finish its work right away is deferred. Juju would then
+# re-emit each of the deferred events on every subsequent hook, all of them
+# working towards the same desired state. Instead, every fresh event claims
+# a new generation of the desired state, and a deferred event remembers the
+# generation it was working towards. Once a newer generation has been
+# claimed, the deferred event is dropped, so that there's only ever one
+# deferred event carrying the work forward.
+
+def claim_generation(event, state):
+    """
+    Returns the generation of the desired state the event works towards, or
+    None if the event was deferred and has been superseded since, in which
+    case it should be dropped.
+    """
+    path = event.handle.path
+    if path in state.deferred_generations:
+        generation = state.deferred_generations.pop(path)
+        if generation < state.generation:
+            logger.debug(
+                "Dropping {0}, generation {1} superseded by {2}".format(
+                    path, generation, state.generation
+                )
+            )
+            return None
+        return generation
+
+    state.generation += 1
+    return state.generation
+
+
+def defer_generation(event, state, generation):
+    state.deferred_generations[event.handle.path] = generation
+    event.defer()
+
+
 # OTHER FRAMEWORK-SPECIFIC LOGIC
 
 def build_juju_unit_status(pod_status):
-    if pod_status.is_unknown:
+    if pod_status.is_failed:
+        unit_status = BlockedStatus(
+            "Pod is failing: {0}".format(pod_status.failure_reason)
+        )
+    elif pod_status.is_unknown:
         unit_status = MaintenanceStatus("Waiting for pod to appear")
     elif not pod_status.is_running:
         unit_status = MaintenanceStatus("Pod is starting")
@@ -141,109 +303,372 @@ def build_juju_unit_status(pod_status):
         # Covering a "variable referenced before assignment" linter error
         unit_status = BlockedStatus(
             "Error: Unexpected pod_status received: {0}".format(
-                pod_status.raw_status
+                pod_status
             )
         )
 
     return unit_status
 
 
-def ensure_config_is_reloaded(event, fw_adapter, state):
+def build_juju_app_status(pod_statuses):
+    """
+    :param pod_statuses: A dict of unit name to k8s.PodStatus as returned by
+        aio.get_app_pod_statuses()
+    """
+    failing = sorted(
+        (unit, pod_status) for unit, pod_status in pod_statuses.items()
+        if pod_status.is_failed
+    )
+    ready_count = sum(
+        1 for pod_status in pod_statuses.values()
+        if pod_status.is_running and pod_status.is_ready
+    )
+
+    if not pod_statuses:
+        app_status = MaintenanceStatus("Waiting for pods to appear")
+    elif failing:
+        unit, pod_status = failing[0]
+        app_status = BlockedStatus(
+            "{0}/{1} pods failing, {2}: {3}".format(
+                len(failing), len(pod_statuses), unit,
+                pod_status.failure_reason
+            )
+        )
+    elif ready_count < len(pod_statuses):
+        app_status = MaintenanceStatus(
+            "{0}/{1} pods ready".format(ready_count, len(pod_statuses))
+        )
+    else:
+        app_status = ActiveStatus()
+
+    return app_status
+
+
+def look_up_app_pod_statuses(fw_adapter):
+    """
+    Starts the leader's LIST of the app's pods on a background event loop.
+    Returns a (client, future of the results) tuple for
+    update_juju_app_status(), or None on the other units. Only the k8s API
+    server is talked to off the main thread; everything that goes through
+    the framework stays on it.
+    """
+    if not fw_adapter.unit_is_leader():
+        return None
+
+    # One LIST for the whole app rather than one lookup per unit
+    client = aio.kubernetes_client()
     juju_model = fw_adapter.get_model_name()
     juju_app = fw_adapter.get_app_name()
+    return client, aio.run_in_background([
+        lambda: aio.get_app_pod_statuses(client, juju_model, juju_app)
+    ])
+
 
-    # Prometheus has recently started so its config file and the underlying
-    # CofigMap are synchronized so there's no need to reload.
-    if state.recently_started:
-        state.recently_started = False
+def update_juju_app_status(fw_adapter, app_pod_statuses=None):
+    """
+    :param app_pod_statuses: A (client, future) tuple as returned by
+        look_up_app_pod_statuses(). The lookup is started here if not given.
+    """
+    if not fw_adapter.unit_is_leader():
         return
 
-    config_was_changed_post_startup = \
-        not state.recently_started and state.config_propagated
-    config_needs_reloading = \
-        not state.recently_started and not state.config_propagated
+    if app_pod_statuses is None:
+        app_pod_statuses = look_up_app_pod_statuses(fw_adapter)
+    client, future = app_pod_statuses
+    pod_statuses, = future.result()
+    # Back on the main thread, where the registry may be written to
+    client.record_requests()
+    if isinstance(pod_statuses, KubernetesAPIError):
+        # The app status is only informational. Keep the last one rather
+        # than failing the hook over it.
+        logger.warning(
+            "App pod status lookup failed, keeping the app status: "
+            "{0}".format(pod_statuses)
+        )
+        return
+    elif isinstance(pod_statuses, Exception):
+        raise pod_statuses
+
+    logging.debug("Received k8s pod statuses: {0}".format(pod_statuses))
+    fw_adapter.set_app_status(build_juju_app_status(pod_statuses))
+
+
+def ensure_config_is_reloaded(fw_adapter, state):
+    """
+    Advances the config reload by one step per hook. Returns True once it
+    has either converged or failed, otherwise the caller is expected to
+    defer. A reload in progress starts over when the config changes again
+    in the meantime, and a failed one is retried on the next config change.
+    An invalid config Blocks the unit and counts as
+    settled, as there's nothing to reload until it is fixed.
+    """
+    try:
+        expected_config = build_prometheus_config(fw_adapter.get_config())
+    except CharmError as e:
+        fw_adapter.set_unit_status(
+            BlockedStatus("Config build failure: {0}".format(e))
+        )
+        return True
 
-    if config_was_changed_post_startup:
-        # We assume that the new config hasn't propagated all the way up
-        # to the Prometheus container.
-        state.config_propagated = False
+    config_reload = ConfigReload(state.config_reload)
+    previous_phase = config_reload.phase
 
-        fw_adapter.set_unit_status(MaintenanceStatus(
-            "Waiting for new config to propagate to unit"
+    if config_reload.fingerprint is None:
+        # Nothing was recorded yet, which means that Prometheus has only
+        # just started off the current ConfigMap
+        config_reload.adopt(expected_config.fingerprint)
+    elif config_reload.fingerprint != expected_config.fingerprint:
+        # We assume that the new config hasn't propagated all the way up
+        # to the Prometheus container yet. Juju needs to apply it to the
+        # ConfigMap and kubernetes to the mounted volume in the pod first,
+        # neither of which happens before this hook is over.
+        config_reload.start(expected_config.fingerprint)
+    else:
+        if config_reload.phase == RELOAD_FAILED:
+            # A deferred event never finds a failed reload, as it stopped
+            # deferring when the reload failed. So every fresh event gets
+            # another go at it.
+            config_reload.retry()
+        config_map_fingerprint = None
+        if config_reload.due and \
+                config_reload.phase == RELOAD_PENDING_PROPAGATION:
+            config_map_fingerprint = get_config_map_fingerprint(fw_adapter,
+                                                                state)
+        config_reload.step(fw_adapter.get_model_name(),
+                           fw_adapter.get_app_name(),
+                           expected_config,
+                           config_map_fingerprint)
+    state.config_reload = config_reload.to_dict()
+
+    if config_reload.phase == RELOAD_CONVERGED:
+        if previous_phase != RELOAD_CONVERGED:
+            fw_adapter.set_unit_status(ActiveStatus())
+    elif config_reload.phase == RELOAD_FAILED:
+        fw_adapter.set_unit_status(BlockedStatus(
+            "Config has not been propagated, see unit logs"
         ))
-        logger.debug("Config not yet propagated. Deferring.")
-        # The rest of this event handler is deferred so that Juju can continue
-        # with the config-change cycle, apply the new config to the ConfigMap
-        # and allow kubernetes to propagate that the the mounted volume in
-        # the Prometheus pod.
-        event.defer()
-        return
+    else:
+        if config_reload.phase == RELOAD_PENDING_PROPAGATION:
+            message = "Waiting for new config to propagate to unit"
+        else:
+            message = "Reloading config ({0})".format(config_reload.phase)
+        fw_adapter.set_unit_status(MaintenanceStatus(message))
+        logger.debug("Config reload is {0}. Deferring.".format(
+            config_reload.phase
+        ))
+        return False
+
+    return True
 
-    if config_needs_reloading:
-        state.config_propagated = reload_configuration(
-            juju_model, juju_app, fw_adapter.get_config()
+
+def get_config_map_fingerprint(fw_adapter, state):
+    """
+    Returns the fingerprint of the config Juju put in the ConfigMap, or None
+    if it can't be told.
+    """
+    try:
+        config_map_name, config_text = k8s.get_config_map_file(
+            juju_model=fw_adapter.get_model_name(),
+            juju_app=fw_adapter.get_app_name(),
+            file_name='prometheus.yml',
+            config_map_name=state.config_map_name
         )
-        if state.config_propagated:
-            fw_adapter.set_unit_status(ActiveStatus())
-        return
+    except KubernetesAPIError as e:
+        logger.warning("Could not read the ConfigMap: {0}".format(e))
+        return None
+
+    if config_map_name is None:
+        logger.warning("Found no ConfigMap holding prometheus.yml")
+        return None
 
+    # Remember which ConfigMap holds the config so that subsequent hooks
+    # can look it up directly instead of listing all of the app's ones.
+    state.config_map_name = config_map_name
+    return read_config_fingerprint(config_text)
 
-def set_juju_pod_spec(fw_adapter, alerting_config=None):
-    # Mutable defaults bug as described in https://bit.ly/3cF0k0w
-    if not alerting_config:
-        alerting_config = dict()
 
+def set_juju_pod_spec(fw_adapter, state, set_status=True):
     if not fw_adapter.unit_is_leader():
         logging.debug("Unit is not a leader, skip pod spec configuration")
         # Although PodSpec will not be altered, the pod provisioning process
         # still have to continue
         return True
 
+    alerting_config = dict(state.alerting_config)
     if alerting_config:
         logger.debug(
             "Got alerting config: {} {}".format(type(alerting_config),
                                                 alerting_config)
         )
 
+    spec_inputs = dict(
+        app_name=fw_adapter.get_app_name(),
+        charm_config=fw_adapter.get_config(),
+        prom_image_meta=fw_adapter.get_image_meta('prometheus-image'),
+        nginx_image_meta=fw_adapter.get_image_meta('nginx-image'),
+        alerting_config=alerting_config,
+        scrape_targets=get_scrape_targets(
+            fw_adapter.get_relations('scrape-target')
+        )
+    )
+    inputs_digest = build_juju_pod_spec_digest(**spec_inputs)
+    if inputs_digest == state.pod_spec_inputs_digest:
+        count_pod_spec_cache_hit(state, "inputs unchanged")
+        return True
+
     logging.debug("Building Juju pod spec")
     try:
-        juju_pod_spec = build_juju_pod_spec(
-            app_name=fw_adapter.get_app_name(),
-            charm_config=fw_adapter.get_config(),
-            prom_image_meta=fw_adapter.get_image_meta('prometheus-image'),
-            nginx_image_meta=fw_adapter.get_image_meta('nginx-image'),
-            alerting_config=alerting_config
-        )
+        juju_pod_spec = build_juju_pod_spec(**spec_inputs)
         pod_spec = juju_pod_spec.to_dict()
     except CharmError as e:
         fw_adapter.set_unit_status(
             BlockedStatus("Pod spec build failure: {0}".format(e))
         )
         return False
+
+    spec_digest = canonical_digest(pod_spec)
+    state.pod_spec_inputs_digest = inputs_digest
+    if spec_digest == state.pod_spec_digest:
+        count_pod_spec_cache_hit(state, "rendered spec unchanged")
+        return True
+
+    state.pod_spec_cache_misses += 1
     logging.debug("Configuring pod: set PodSpec to: {0}".format(pod_spec))
     fw_adapter.set_pod_spec(pod_spec)
-    fw_adapter.set_unit_status(MaintenanceStatus("Configuring pod"))
+    state.pod_spec_digest = spec_digest
+    # The new spec gets the full readiness timeout
+    state.readiness_deadline = None
+    if set_status:
+        fw_adapter.set_unit_status(MaintenanceStatus("Configuring pod"))
     return True
 
 
-def wait_for_pod_readiness(fw_adapter):
+def count_pod_spec_cache_hit(state, reason):
+    state.pod_spec_cache_hits += 1
+    logger.info(
+        "Pod spec not pushed, {0} (cache hits: {1}, misses: {2})".format(
+            reason, state.pod_spec_cache_hits, state.pod_spec_cache_misses
+        )
+    )
+
+
+def wait_for_pod_readiness(fw_adapter, state):
+    """
+    Blocks until the unit's pod is ready, for at most the hook budget. Returns
+    True once the pod is ready. Returns False if the budget was spent or the
+    pod is failing, in which case state.readiness_deadline is kept for the
+    next attempt, or if the overall deadline passed or the hook budget is
+    not positive, in which case the unit is Blocked and the deadline is
+    cleared.
+    """
     juju_model = fw_adapter.get_model_name()
     juju_app = fw_adapter.get_app_name()
     juju_unit = fw_adapter.get_unit_name()
-    pod_is_ready = False
 
-    # TODO: Fail by timeout, if pod will never go to the Ready state?
-    while not pod_is_ready:
+    try:
+        schedule = ReadinessSchedule(
+            timeout=float(fw_adapter.get_config('pod-readiness-timeout')),
+            budget=float(fw_adapter.get_config('pod-readiness-hook-budget')),
+            deadline=state.readiness_deadline
+        )
+    except CharmError as e:
+        fw_adapter.set_unit_status(BlockedStatus(str(e)))
+        state.readiness_deadline = None
+        return False
+    state.readiness_deadline = schedule.deadline
+
+    while True:
+        # Look at the pod before giving up on it so that a pod that became
+        # ready while the hook was deferred is not reported as timed out.
         logging.debug("Checking k8s pod readiness")
-        k8s_pod_status = k8s.get_pod_status(juju_model=juju_model,
-                                            juju_app=juju_app,
-                                            juju_unit=juju_unit)
-        logging.debug("Received k8s pod status: {0}".format(k8s_pod_status))
-        juju_unit_status = build_juju_unit_status(k8s_pod_status)
-        logging.debug("Built unit status: {0}".format(juju_unit_status))
-        fw_adapter.set_unit_status(juju_unit_status)
-        pod_is_ready = isinstance(juju_unit_status, ActiveStatus)
-        time.sleep(1)
+        try:
+            k8s_pod_status = k8s.get_pod_status(juju_model=juju_model,
+                                                juju_app=juju_app,
+                                                juju_unit=juju_unit,
+                                                pod_name=state.pod_name)
+        except KubernetesAPIError as e:
+            logger.warning(
+                "Pod status lookup failed, retrying: {0}".format(e)
+            )
+            k8s_pod_status = None
+
+        if k8s_pod_status is not None:
+            # Remember which pod runs this unit so that subsequent hooks can
+            # look it up directly instead of listing all of the app's pods.
+            if k8s_pod_status.pod_name:
+                state.pod_name = k8s_pod_status.pod_name
+            juju_unit_status = set_unit_status_from_pod(fw_adapter,
+                                                        k8s_pod_status)
+            pod_is_ready = check_pod_readiness(juju_unit_status, schedule,
+                                               state)
+            if pod_is_ready is not None:
+                return pod_is_ready
+
+        if schedule.deadline_exceeded:
+            fw_adapter.set_unit_status(BlockedStatus(
+                "Pod did not become ready in time"
+            ))
+            state.readiness_deadline = None
+            return False
+
+        if schedule.budget_spent:
+            logger.debug("Pod readiness budget spent")
+            return False
+
+        if k8s_pod_status is None:
+            time.sleep(schedule.next_delay())
+            continue
+
+        # Instead of polling the pod list, block on a watch so that we wake
+        # up as soon as the pod changes. Once the API server closes the
+        # watch we go back to the top and list again.
+        try:
+            for k8s_pod_status in k8s.watch_pod_status(
+                    juju_model=juju_model,
+                    juju_app=juju_app,
+                    juju_unit=juju_unit,
+                    pod_name=state.pod_name,
+                    resource_version=k8s_pod_status.resource_version,
+                    timeout_seconds=max(1, int(schedule.time_left()))):
+                juju_unit_status = set_unit_status_from_pod(fw_adapter,
+                                                            k8s_pod_status)
+                pod_is_ready = check_pod_readiness(juju_unit_status,
+                                                   schedule, state)
+                if pod_is_ready is not None:
+                    return pod_is_ready
+        except KubernetesAPIError as e:
+            logger.warning(
+                "Pod watch failed, falling back to polling: {0}".format(e)
+            )
+            time.sleep(schedule.next_delay())
+
+
+def set_unit_status_from_pod(fw_adapter, k8s_pod_status):
+    logging.debug("Received k8s pod status: {0}".format(k8s_pod_status))
+    juju_unit_status = build_juju_unit_status(k8s_pod_status)
+    logging.debug("Built unit status: {0}".format(juju_unit_status))
+    fw_adapter.set_unit_status(juju_unit_status)
+    return juju_unit_status
+
+
+def check_pod_readiness(juju_unit_status, schedule, state):
+    """
+    Returns True if the pod is ready, False if the hook should stop waiting
+    on it, or None if it should keep waiting. A failing pod is not waited on
+    within the hook, but it may still recover, e.g. once an image pull goes
+    through, so its deadline is kept for the caller to defer on until it
+    passes.
+    """
+    if isinstance(juju_unit_status, ActiveStatus):
+        state.readiness_deadline = None
+        return True
+
+    if isinstance(juju_unit_status, BlockedStatus):
+        if schedule.deadline_exceeded:
+            state.readiness_deadline = None
+        return False
+
+    return None
 
 
 if __name__ == "__main__":
@@ -1,8 +1,10 @@
-import copy
+import collections
+import hashlib
 import json
 import logging
-import yaml
 import http.client
+import os
+import re
 import sys
 import time
 import random
@@ -10,11 +12,15 @@ import random
 sys.path.append('lib')
 
 logger = logging.getLogger()
-from jinja2 import Environment, FileSystemLoader
+from jinja2 import (
+    Environment, FileSystemLoader, ModuleLoader, TemplateNotFound
+)
 from exceptions import (
-    CharmError, ExternalLabelParseError,
+    CharmError, DuplicateScrapeJobError, ExternalLabelParseError,
     TimeStringParseError, PrometheusAPIError
 )
+import instrumentation
+import yaml_codec
 
 
 # There is never ever a need to customize the advertised port of a
@@ -22,6 +28,139 @@ from exceptions import (
 # option and making it statically default to its typical 9090
 PROMETHEUS_ADVERTISED_PORT = 9090
 
+# Timeouts, in seconds, of the calls to the Prometheus API. Connecting
+# only takes a while when the service has no ready endpoint, whereas
+# Prometheus may be slow to answer while it is busy reloading its config.
+PROMETHEUS_API_CONNECT_TIMEOUT = 5
+PROMETHEUS_API_READ_TIMEOUT = 15
+
+# Times a call to the Prometheus API is retried after a connection error or
+# a timeout, and the seconds waited before the first retry. The delay is
+# doubled on every subsequent retry.
+PROMETHEUS_API_RETRIES = 2
+PROMETHEUS_API_RETRY_DELAY = 0.5
+
+# Bytes read at most from a response of the Prometheus API. The rendered
+# config is by far the largest response the charm asks for.
+PROMETHEUS_API_MAX_RESPONSE_SIZE = 4 * 1024 * 1024
+
+# Bytes read at a time from responses that are searched as they stream in
+PROMETHEUS_API_READ_CHUNK_SIZE = 4 * 1024
+
+# Phases of a ConfigReload
+RELOAD_PENDING_PROPAGATION = 'pending-propagation'
+RELOAD_RELOADING = 'reloading'
+RELOAD_VERIFYING = 'verifying'
+RELOAD_CONVERGED = 'converged'
+RELOAD_FAILED = 'failed'
+
+# Seconds the kubelet is first expected to take to sync a changed
+# ConfigMap into the container. Kubelets resync the volumes of their pods
+# about once a minute by default. The estimate is refined with every
+# reload, see ConfigReload.
+KUBELET_SYNC_LATENCY = 30
+
+# Weight of the latest observation in the kubelet sync latency estimate
+KUBELET_SYNC_LATENCY_WEIGHT = 0.3
+
+# Seconds between checks of the ConfigMap and between reload attempts
+CONFIG_RELOAD_RETRY_DELAY = 5
+
+# Checks of the ConfigMap, and then reloads, after which a config is
+# deemed not to propagate
+CONFIG_RELOAD_MAX_ATTEMPTS = 6
+
+# Samples of Prometheus' own /metrics that tell whether its last config
+# reload worked and when it last did
+RELOAD_SUCCESSFUL_METRIC = 'prometheus_config_last_reload_successful'
+RELOAD_TIMESTAMP_METRIC = \
+    'prometheus_config_last_reload_success_timestamp_seconds'
+
+# See PrometheusConfigFile.fingerprint
+FINGERPRINT_JOB_PREFIX = 'config-fingerprint-'
+FINGERPRINT_COMMENT_PREFIX = '# Fingerprint: '
+
+# Targets of the scrape-target relation are handed to Prometheus through
+# file_sd files in their own volume rather than through prometheus.yml, so
+# that Prometheus picks up target churn by itself without a reload. The
+# volume is mounted outside of the read-only prom-config volume since the
+# latter can't host a mount point.
+SCRAPE_TARGETS_JOB = 'scrape-targets'
+SCRAPE_TARGETS_DIR = '/etc/prometheus-targets'
+SCRAPE_TARGETS_REFRESH_INTERVAL = '1m'
+
+# Always present so that the volume is never empty
+EMPTY_SCRAPE_TARGETS_FILE = 'empty.json'
+
+TEMPLATES_DIR = 'templates'
+
+# Output of `make templates`. Optional, it only saves compiling the Jinja
+# templates at hook time.
+COMPILED_TEMPLATES_DIR = os.path.join(TEMPLATES_DIR, 'compiled')
+
+# Digests of the sources of the compiled templates written by `make
+# templates`, so that a compiled template is only used for the very source
+# it was compiled from
+COMPILED_TEMPLATES_MANIFEST = 'manifest.json'
+
+# Jinja templates by name, compiled at most once per process
+_template_cache = {}
+
+K8S_SCRAPE_CONFIGS_TEMPLATE = 'prometheus-k8s.yml'
+
+# Pre-parsed K8S_SCRAPE_CONFIGS_TEMPLATE written by `make templates`
+K8S_SCRAPE_CONFIGS_ARTIFACT = 'prometheus-k8s.json'
+
+# JSON serialized scrape configs by (path, mtime, size) of their source
+_k8s_scrape_configs_cache = {}
+
+# What Prometheus fills in for the options that are left out of its config
+# https://prometheus.io/docs/prometheus/latest/configuration/configuration
+PROMETHEUS_GLOBAL_DEFAULTS = {
+    'scrape_interval': '1m',
+    'scrape_timeout': '10s',
+    'evaluation_interval': '1m',
+}
+
+# scrape_interval and scrape_timeout default to their global counterparts
+PROMETHEUS_SCRAPE_CONFIG_DEFAULTS = {
+    'metrics_path': '/metrics',
+    'scheme': 'http',
+    'honor_labels': False,
+    'honor_timestamps': True,
+}
+
+PROMETHEUS_RELABEL_CONFIG_DEFAULTS = {
+    'separator': ';',
+    'regex': '(.*)',
+    'replacement': '$1',
+    'action': 'replace',
+}
+
+PROMETHEUS_ALERTMANAGER_CONFIG_DEFAULTS = {
+    'scheme': 'http',
+    'timeout': '10s',
+    'api_version': 'v1',
+}
+
+PROMETHEUS_DURATION_KEYS = frozenset([
+    'scrape_interval', 'scrape_timeout', 'evaluation_interval',
+    'refresh_interval', 'timeout',
+])
+
+# Units of Prometheus durations in milliseconds, largest first
+PROMETHEUS_DURATION_UNITS = collections.OrderedDict([
+    ('y', 1000 * 60 * 60 * 24 * 365),
+    ('w', 1000 * 60 * 60 * 24 * 7),
+    ('d', 1000 * 60 * 60 * 24),
+    ('h', 1000 * 60 * 60),
+    ('m', 1000 * 60),
+    ('s', 1000),
+    ('ms', 1),
+])
+
+_DURATION_RE = re.compile(r'(\d+)(ms|y|w|d|h|m|s)')
+
 
 # DOMAIN MODELS
 class PrometheusJujuPodSpec:
@@ -39,79 +178,64 @@ class PrometheusJujuPodSpec:
                  nginx_config,
                  enforce_pod_restart_workaround,
                  ssl_cert,
-                 ssl_key):
+                 ssl_key,
+                 scrape_target_files=None):
 
         self._enforce_pod_restart = enforce_pod_restart_workaround
         self._ssl_cert = ssl_cert
         self._ssl_key = ssl_key
         self._prometheus_config = prometheus_config
         self._nginx_config = nginx_config
-        self._spec = {
-            'containers': [{
-                'name': app_name,
-                'imageDetails': {
-                    'imagePath': prom_image_path,
-                    'username': prom_repo_username,
-                    'password': prom_repo_password
+        self._scrape_target_files = scrape_target_files or {}
+        self._prom_container_name = app_name
+        self._nginx_container_name = '{0}-nginx'.format(app_name)
+
+        # The parts of the containers that don't depend on the rendered
+        # files. to_dict() shares them between the specs it builds rather
+        # than copying them so neither they nor the specs are to be mutated.
+        self._containers = ({
+            'name': self._prom_container_name,
+            'imageDetails': {
+                'imagePath': prom_image_path,
+                'username': prom_repo_username,
+                'password': prom_repo_password
+            },
+            'args': prometheus_cli_args,
+            'readinessProbe': {
+                'httpGet': {
+                    'path': '/-/ready',
+                    'port': PROMETHEUS_ADVERTISED_PORT
                 },
-                'args': prometheus_cli_args,
-                'readinessProbe': {
-                    'httpGet': {
-                        'path': '/-/ready',
-                        'port': PROMETHEUS_ADVERTISED_PORT
-                    },
-                    'initialDelaySeconds': 10,
-                    'timeoutSeconds': 30
+                'initialDelaySeconds': 10,
+                'timeoutSeconds': 30
+            },
+            'livenessProbe': {
+                'httpGet': {
+                    'path': '/-/healthy',
+                    'port': PROMETHEUS_ADVERTISED_PORT
                 },
-                'livenessProbe': {
-                    'httpGet': {
-                        'path': '/-/healthy',
-                        'port': PROMETHEUS_ADVERTISED_PORT
-                    },
-                    'initialDelaySeconds': 30,
-                    'timeoutSeconds': 30
-                },
-                'files': [{
-                    'name': 'prom-config',
-                    'mountPath': '/etc/prometheus',
-                    'files': {
-                        'prometheus.yml': ''
-                    }
-                }]
+                'initialDelaySeconds': 30,
+                'timeoutSeconds': 30
+            },
+        }, {
+            'name': self._nginx_container_name,
+            'imageDetails': {
+                'imagePath': nginx_image_path,
+                'username': nginx_repo_username,
+                'password': nginx_repo_password
+            },
+            'ports': [{
+                'containerPort': 80,
+                'name': 'nginx-http',
+                'protocol': 'TCP'
             }, {
-                'name': '{0}-nginx'.format(app_name),
-                'imageDetails': {
-                    'imagePath': nginx_image_path,
-                    'username': nginx_repo_username,
-                    'password': nginx_repo_password
-                },
-                'ports': [{
-                    'containerPort': 80,
-                    'name': 'nginx-http',
-                    'protocol': 'TCP'
-                }, {
-                    'containerPort': 443,
-                    'name': 'nginx-https',
-                    'protocol': 'TCP'
-                }],
-                'files': [{
-                    'name': 'nginx-config',
-                    'mountPath': '/etc/nginx/conf.d',
-                    'files': {
-                        'default.conf': ''
-                    }
-                }]
-            }
-            ]
-        }
+                'containerPort': 443,
+                'name': 'nginx-https',
+                'protocol': 'TCP'
+            }],
+        })
 
     def to_dict(self):
-        final_dict = copy.deepcopy(self._spec)
-        final_dict['containers'][0]['files'][0]['files']['prometheus.yml'] = \
-            self._prometheus_config.yaml_dump()
-        final_dict['containers'][1]['files'][0]['files']['default.conf'] = \
-            self._nginx_config.render_config()
-
         if (self._ssl_cert and not self._ssl_key) or \
                 (not self._ssl_cert and self._ssl_key):
             raise CharmError(
@@ -119,38 +243,328 @@ class PrometheusJujuPodSpec:
                 'both ssl_cert and ssl_key have to be configured'
             )
 
+        nginx_config = self._nginx_config.render_config()
+        files = {
+            self._prom_container_name: [
+                _file_volume('prom-config', '/etc/prometheus', {
+                    'prometheus.yml': self._prometheus_config.yaml_dump()
+                }),
+                _file_volume('prom-targets', SCRAPE_TARGETS_DIR, dict(
+                    self._scrape_target_files,
+                    **{EMPTY_SCRAPE_TARGETS_FILE: '[]'}
+                )),
+            ],
+            self._nginx_container_name: [
+                _file_volume('nginx-config', '/etc/nginx/conf.d', {
+                    'default.conf': nginx_config
+                })
+            ],
+        }
+
         if self._ssl_cert and self._ssl_key:
-            final_dict['containers'][1]['files'].append({
-                'name': 'prom-ssl',
-                'mountPath': '/etc/nginx/ssl',
-                'files': {
+            files[self._nginx_container_name].append(
+                _file_volume('prom-ssl', '/etc/nginx/ssl', {
                     'prom-tls.pem': self._ssl_cert,
                     'prom-tls.key': self._ssl_key,
-                }
-            })
+                })
+            )
 
         # (vgrevtsev) As for Jul 2020, there is no clear way to tell
         # the NGINX to reload and/or restart itself. This is a workaround,
         # which actually enforces the k8s to rebuild the pod, leading
-        # to the service restart.
+        # to the service restart. The volume is named after a digest of
+        # what NGINX reads so the pod is only rebuilt when that changes.
 
         if self._enforce_pod_restart:
-            def randomizer():
-                return str(hash(random.random()))[:4]
-            final_dict['containers'][1]['files'].append({
-                'name': 'rand-{0}'.format(randomizer()),
-                'mountPath': '/tmp',
-                'files': {
-                    randomizer(): randomizer()
+            nginx_digest = canonical_digest(
+                [nginx_config, self._ssl_cert, self._ssl_key]
+            )
+            files[self._nginx_container_name].append(_file_volume(
+                'nginx-restart-{0}'.format(nginx_digest[:12]), '/tmp', {
+                    'nginx-config-digest': nginx_digest
                 }
-            })
+            ))
+
+        return {
+            'containers': [
+                dict(container, files=files[container['name']])
+                for container in self._containers
+            ]
+        }
+
+
+def _file_volume(name, mount_path, files):
+    return {
+        'name': name,
+        'mountPath': mount_path,
+        'files': files,
+    }
+
+
+class ReadinessSchedule:
+    '''
+    Decides for how long a hook may keep waiting on the pod to become ready.
+    The deadline spans hooks, so the caller is expected to persist it and
+    hand it back in, while the budget only covers the current hook. Once the
+    budget is spent the hook should defer rather than block the unit's hook
+    queue. Retry delays back off exponentially with jitter so that the units
+    of an app don't hit the API server in lockstep.
+    '''
+
+    def __init__(self, timeout, budget, deadline=None,
+                 initial_delay=1, max_delay=30,
+                 clock=time.time, rng=random.random):
+        if budget <= 0:
+            # The hook would defer without ever looking at the pod
+            raise CharmError(
+                'The pod readiness hook budget has to be positive, '
+                'got {0}'.format(budget)
+            )
+
+        self._clock = clock
+        self._rng = rng
+        self._delay = initial_delay
+        self._max_delay = max_delay
+
+        now = clock()
+        self.deadline = deadline or now + timeout
+        self._budget_end = now + budget
+
+    @property
+    def deadline_exceeded(self):
+        return self._clock() >= self.deadline
+
+    @property
+    def budget_spent(self):
+        return self._clock() >= self._budget_end
+
+    def time_left(self):
+        return max(0, min(self.deadline, self._budget_end) - self._clock())
+
+    def next_delay(self):
+        # Half of the delay is fixed and the other half is random
+        delay = self._delay / 2 + self._rng() * self._delay / 2
+        self._delay = min(self._delay * 2, self._max_delay)
+        return min(delay, self.time_left())
+
+
+class ConfigReload:
+    '''
+    Resumable state machine that gets Prometheus to load a new config:
+
+        pending-propagation -> reloading -> verifying -> converged
+                                   ^            |
+                                   +------------+-> failed
+
+    Every call to step() advances it by at most one phase, so that the hook
+    can defer instead of blocking until Prometheus has caught up. The state
+    round-trips through to_dict() and the initializer. retry() takes a
+    failed reload back to reloading.
+    '''
+
+    def __init__(self, state=None, clock=time.time,
+                 sync_latency=KUBELET_SYNC_LATENCY,
+                 sync_latency_weight=KUBELET_SYNC_LATENCY_WEIGHT,
+                 retry_delay=CONFIG_RELOAD_RETRY_DELAY,
+                 max_attempts=CONFIG_RELOAD_MAX_ATTEMPTS):
+        # Mutable defaults bug as described in https://bit.ly/3cF0k0w
+        if not state:
+            state = dict()
+
+        self._clock = clock
+        self._sync_latency_weight = sync_latency_weight
+        self._retry_delay = retry_delay
+        self._max_attempts = max_attempts
+
+        self.phase = state.get('phase', RELOAD_CONVERGED)
+        self.fingerprint = state.get('fingerprint')
+        self.attempts = state.get('attempts', 0)
+        self.not_before = state.get('not_before', 0)
+        self.previous_reload = state.get('previous_reload')
+        self.config_map_updated_at = state.get('config_map_updated_at')
+        self.reloaded_at = state.get('reloaded_at')
+        self.stale_after = state.get('stale_after', 0)
+        self.sync_latency = state.get('sync_latency', sync_latency)
+
+    @property
+    def settled(self):
+        return self.phase in (RELOAD_CONVERGED, RELOAD_FAILED)
+
+    @property
+    def due(self):
+        return not self.settled and self._clock() >= self.not_before
+
+    def to_dict(self):
+        return {
+            'phase': self.phase,
+            'fingerprint': self.fingerprint,
+            'attempts': self.attempts,
+            'not_before': self.not_before,
+            'previous_reload': self.previous_reload,
+            'config_map_updated_at': self.config_map_updated_at,
+            'reloaded_at': self.reloaded_at,
+            'stale_after': self.stale_after,
+            'sync_latency': self.sync_latency,
+        }
+
+    def adopt(self, fingerprint):
+        '''
+        Records that Prometheus already runs with the config of the given
+        fingerprint, such as right after it started off the ConfigMap.
+        '''
+        self._enter(RELOAD_CONVERGED, fingerprint)
+
+    def start(self, fingerprint):
+        self._enter(RELOAD_PENDING_PROPAGATION, fingerprint)
+
+    def retry(self):
+        '''
+        Starts a failed reload over from the reload itself, with all of its
+        attempts ahead of it.
+        '''
+        self._enter(RELOAD_RELOADING, self.fingerprint)
+
+    def step(self, juju_model, juju_app, expected_config,
+             config_map_fingerprint=None):
+        '''
+        Advances to the next phase unless it has settled or has to wait a
+        little longer, and returns the resulting phase.
+
+        :param config_map_fingerprint: The fingerprint of the config in the
+            ConfigMap, only needed while pending propagation. If it can't
+            be told, the ConfigMap is assumed to be up to date.
+        '''
+        if not self.due:
+            return self.phase
+
+        if self.phase == RELOAD_PENDING_PROPAGATION:
+            self._await_config_map(config_map_fingerprint)
+        elif self.phase == RELOAD_VERIFYING:
+            try:
+                propagated = self._verify(juju_model, juju_app,
+                                          expected_config)
+            except CharmError as e:
+                logger.warning("Config check failed: {0}".format(e))
+                propagated = False
+
+            if propagated:
+                logger.debug("Config reloaded")
+                self._learn_sync_latency()
+                self.phase = RELOAD_CONVERGED
+            else:
+                self._retry_or_fail(RELOAD_RELOADING)
+        else:
+            self.attempts += 1
+            try:
+                self.previous_reload = get_config_reload_metrics(
+                    juju_model, juju_app
+                ).get(RELOAD_TIMESTAMP_METRIC)
+                config_reload_api_call(juju_model, juju_app)
+                self.reloaded_at = self._clock()
+                self.phase = RELOAD_VERIFYING
+            except CharmError as e:
+                logger.warning("Config reload failed: {0}".format(e))
+                self._retry_or_fail(RELOAD_RELOADING)
+
+        return self.phase
+
+    def _await_config_map(self, config_map_fingerprint):
+        if config_map_fingerprint not in (None, self.fingerprint):
+            self.attempts += 1
+            logger.debug("ConfigMap still holds config {0}".format(
+                config_map_fingerprint
+            ))
+            self._retry_or_fail(RELOAD_PENDING_PROPAGATION)
+            return
+
+        now = self._clock()
+        logger.debug("ConfigMap is up to date, reloading in {0:.1f}s".format(
+            self.sync_latency
+        ))
+        self.config_map_updated_at = now
+        self.attempts = 0
+        self.phase = RELOAD_RELOADING
+        self.not_before = now + self.sync_latency
+
+    def _verify(self, juju_model, juju_app, expected_config):
+        # The reload metrics are cheap and compare timestamps of Prometheus
+        # with each other, which keeps clock skew out of the picture. The
+        # running config is only read, up to its fingerprint, once they
+        # confirm a reload or if Prometheus doesn't expose them.
+        samples = get_config_reload_metrics(juju_model, juju_app)
+        if self.previous_reload is not None \
+                and RELOAD_SUCCESSFUL_METRIC in samples \
+                and RELOAD_TIMESTAMP_METRIC in samples:
+            if samples[RELOAD_SUCCESSFUL_METRIC] != 1:
+                logger.warning("Prometheus failed to load its config")
+                return False
+            if samples[RELOAD_TIMESTAMP_METRIC] <= self.previous_reload:
+                return False
+        else:
+            logger.debug("No reload metrics, checking the running config")
+
+        # The metrics say that a reload went through, not that it read the
+        # new file, so the fingerprint decides
+        if check_config_propagation(juju_model, juju_app, expected_config):
+            return True
+
+        # Prometheus reloaded the file the kubelet had not updated yet
+        if self.reloaded_at is not None \
+                and self.config_map_updated_at is not None:
+            self.stale_after = self.reloaded_at - self.config_map_updated_at
+        return False
+
+    def _learn_sync_latency(self):
+        # A reload that found the old config moves the estimate up to the
+        # middle of the next retry interval, as anything past it is Juju
+        # being slow to run the hook. A first reload that found the new
+        # config moves it down by one retry interval.
+        if self.reloaded_at is None or self.config_map_updated_at is None:
+            return
+
+        synced_before = self.reloaded_at - self.config_map_updated_at
+        if self.stale_after > 0:
+            synced_within = min(synced_before - self.stale_after,
+                                self._retry_delay)
+            sample = self.stale_after + synced_within / 2
+        else:
+            sample = max(0, self.sync_latency - self._retry_delay)
+        self.sync_latency += \
+            self._sync_latency_weight * (sample - self.sync_latency)
+        logger.info(
+            "Kubelet synced the ConfigMap within {0:.1f}s, now expecting "
+            "it to take {1:.1f}s".format(synced_before, self.sync_latency)
+        )
 
-        return final_dict
+    def _enter(self, phase, fingerprint):
+        self.phase = phase
+        self.fingerprint = fingerprint
+        self.attempts = 0
+        self.not_before = 0
+        self.previous_reload = None
+        self.config_map_updated_at = None
+        self.reloaded_at = None
+        self.stale_after = 0
+
+    def _retry_or_fail(self, phase):
+        if self.attempts >= self._max_attempts:
+            logger.error(
+                "Config has not been propagated after {0} attempts".format(
+                    self.attempts
+                )
+            )
+            self.phase = RELOAD_FAILED
+        else:
+            self.phase = phase
+            self.not_before = self._clock() + self._retry_delay
 
 
 class PrometheusConfigFile:
     '''
     https://prometheus.io/docs/prometheus/latest/configuration/configuration
+
+    Scrape configs are indexed by job_name and serialized in the order in
+    which their jobs were first added.
     '''
 
     def __init__(self, global_opts, alerting=None):
@@ -158,26 +572,82 @@ class PrometheusConfigFile:
         if not alerting:
             alerting = dict()
 
-        self._config_dict = {
-            'global': global_opts,
-            'scrape_configs': [],
-            'alerting': alerting
-        }
+        self._global_opts = global_opts
+        self._alerting = alerting
+        self._scrape_configs = collections.OrderedDict()
+        self._fingerprint = None
+
+    def __contains__(self, job_name):
+        return job_name in self._scrape_configs
+
+    def __len__(self):
+        return len(self._scrape_configs)
 
     def add_scrape_config(self, scrape_config):
         '''
         https://prometheus.io/docs/prometheus/latest/configuration/configuration/#scrape_config
         '''
-        self._config_dict['scrape_configs'].append(scrape_config)
+        job_name = scrape_config['job_name']
+        if job_name in self._scrape_configs:
+            raise DuplicateScrapeJobError(
+                "Duplicate scrape job: {0}".format(job_name)
+            )
+        self.upsert_scrape_config(scrape_config)
+
+    def upsert_scrape_config(self, scrape_config):
+        '''
+        Adds the scrape config or replaces the one with the same job_name,
+        which keeps its position.
+        '''
+        self._scrape_configs[scrape_config['job_name']] = scrape_config
+        self._fingerprint = None
+
+    def remove_scrape_config(self, job_name):
+        '''
+        Removes and returns the scrape config of the given job, if any
+        '''
+        self._fingerprint = None
+        return self._scrape_configs.pop(job_name, None)
+
+    def get_scrape_config(self, job_name):
+        return self._scrape_configs.get(job_name)
+
+    @property
+    def fingerprint(self):
+        '''
+        A digest of the config. yaml_dump() embeds it as the name of an
+        empty scrape job, which unlike a comment survives Prometheus
+        loading the config, so it can be found in the running config with
+        a text search.
+        '''
+        if self._fingerprint is None:
+            self._fingerprint = canonical_digest(self.to_dict())[:16]
+        return self._fingerprint
+
+    @property
+    def fingerprint_job_name(self):
+        return '{0}{1}'.format(FINGERPRINT_JOB_PREFIX, self.fingerprint)
 
     def yaml_dump(self):
-        return yaml.dump(self._config_dict)
+        return '{0}{1}\n{2}'.format(
+            FINGERPRINT_COMMENT_PREFIX, self.fingerprint,
+            yaml_codec.dump(self.to_dict(fingerprint=True))
+        )
 
-    def to_dict(self):
-        return self._config_dict
+    def to_dict(self, fingerprint=False):
+        scrape_configs = list(self._scrape_configs.values())
+        if fingerprint:
+            # First, so that check_config_propagation() finds it without
+            # reading all of the other scrape jobs
+            scrape_configs.insert(0, {'job_name': self.fingerprint_job_name})
+        return {
+            'global': self._global_opts,
+            'scrape_configs': scrape_configs,
+            'alerting': self._alerting
+        }
 
     def __repr__(self):
-        return str(self._config_dict)
+        return str(self.to_dict())
 
 
 class NginxConfigFile:
@@ -187,8 +657,7 @@ class NginxConfigFile:
             'ssl_cert': charm_config.get('ssl_cert', False),
             'ssl_key': charm_config.get('ssl_key', False),
         }
-        tenv = Environment(loader=FileSystemLoader('templates'))
-        template = tenv.get_template('prometheus-nginx.conf.j2')
+        template = get_template('prometheus-nginx.conf.j2')
         self.rendered_config = template.render(ctxt)
 
     def render_config(self):
@@ -200,6 +669,130 @@ class NginxConfigFile:
 # More stateless functions. This group is purely business logic that take
 # simple values or data structures and produce new values from them.
 
+def get_template(name):
+    '''
+    Returns the named Jinja template. A template precompiled by
+    compile_templates() is used as long as the SHA-256 digest of its source
+    matches the one recorded in the manifest, otherwise the source is
+    compiled. Either way this happens once per process.
+    '''
+    if name not in _template_cache:
+        _template_cache[name] = _load_template(name)
+    return _template_cache[name]
+
+
+def _load_template(name):
+    with open(os.path.join(TEMPLATES_DIR, name), 'rb') as source:
+        source_digest = hashlib.sha256(source.read()).hexdigest()
+
+    # Unlike mtimes, the digest survives checkouts and charm builds
+    if _read_compiled_template_digests().get(name) == source_digest:
+        try:
+            env = Environment(loader=ModuleLoader(COMPILED_TEMPLATES_DIR))
+            return env.get_template(name)
+        except (TemplateNotFound, ImportError, SyntaxError) as e:
+            # E.g. compiled with an incompatible version of Jinja
+            logger.warning(
+                "Ignoring precompiled template {0}: {1}".format(name, e)
+            )
+
+    env = Environment(loader=FileSystemLoader(TEMPLATES_DIR))
+    return env.get_template(name)
+
+
+def _read_compiled_template_digests():
+    manifest_path = os.path.join(COMPILED_TEMPLATES_DIR,
+                                 COMPILED_TEMPLATES_MANIFEST)
+    try:
+        with open(manifest_path) as manifest:
+            return dict(json.load(manifest)['source_sha256'])
+    except FileNotFoundError:
+        pass
+    except (ValueError, KeyError, TypeError) as e:
+        logger.warning(
+            "Ignoring precompiled templates manifest {0}: {1}".format(
+                manifest_path, e
+            )
+        )
+    return {}
+
+
+def compile_templates():
+    '''
+    Compiles the Jinja templates and pre-parses the k8s scrape configs ahead
+    of time into COMPILED_TEMPLATES_DIR
+    '''
+    env = Environment(loader=FileSystemLoader(TEMPLATES_DIR))
+    env.compile_templates(
+        COMPILED_TEMPLATES_DIR,
+        zip=None,
+        filter_func=lambda name: name.endswith('.j2'),
+        ignore_errors=False
+    )
+
+    source_digests = {}
+    for name in env.list_templates(filter_func=lambda n: n.endswith('.j2')):
+        with open(os.path.join(TEMPLATES_DIR, name), 'rb') as source:
+            source_digests[name] = hashlib.sha256(source.read()).hexdigest()
+    with open(os.path.join(COMPILED_TEMPLATES_DIR,
+                           COMPILED_TEMPLATES_MANIFEST), 'w') as manifest:
+        json.dump({'source_sha256': source_digests}, manifest)
+
+    with open(os.path.join(TEMPLATES_DIR,
+                           K8S_SCRAPE_CONFIGS_TEMPLATE), 'rb') as source:
+        source_bytes = source.read()
+    artifact_path = os.path.join(COMPILED_TEMPLATES_DIR,
+                                 K8S_SCRAPE_CONFIGS_ARTIFACT)
+    with open(artifact_path, 'w') as artifact:
+        json.dump({
+            'source_sha256': hashlib.sha256(source_bytes).hexdigest(),
+            'scrape_configs': _parse_k8s_scrape_configs(source_bytes),
+        }, artifact)
+
+
+def load_k8s_scrape_configs():
+    '''
+    Returns the scrape configs of the k8s scrape config template. The YAML
+    is parsed at most once per process for as long as the file does not
+    change, or not at all if compile_templates() pre-parsed it. Each call
+    returns a new copy that the caller is free to modify.
+    '''
+    path = os.path.join(TEMPLATES_DIR, K8S_SCRAPE_CONFIGS_TEMPLATE)
+    stat = os.stat(path)
+    key = (path, stat.st_mtime_ns, stat.st_size)
+    if key not in _k8s_scrape_configs_cache:
+        _k8s_scrape_configs_cache.clear()
+        _k8s_scrape_configs_cache[key] = _read_k8s_scrape_configs(path)
+    return json.loads(_k8s_scrape_configs_cache[key])
+
+
+def _read_k8s_scrape_configs(path):
+    with open(path, 'rb') as source:
+        source_bytes = source.read()
+
+    artifact_path = os.path.join(COMPILED_TEMPLATES_DIR,
+                                 K8S_SCRAPE_CONFIGS_ARTIFACT)
+    try:
+        with open(artifact_path) as artifact:
+            parsed = json.load(artifact)
+        # Unlike mtimes, the digest survives checkouts and charm builds
+        if parsed['source_sha256'] == \
+                hashlib.sha256(source_bytes).hexdigest():
+            return json.dumps(parsed['scrape_configs'])
+    except FileNotFoundError:
+        pass
+    except (ValueError, KeyError, TypeError) as e:
+        logger.warning(
+            "Ignoring pre-parsed {0}: {1}".format(artifact_path, e)
+        )
+
+    return json.dumps(_parse_k8s_scrape_configs(source_bytes))
+
+
+def _parse_k8s_scrape_configs(source_bytes):
+    return yaml_codec.load(source_bytes).get('scrape_configs', [])
+
+
 def build_prometheus_cli_args(charm_config):
     """
     This function is taking the default Prometheus CLI args
@@ -280,7 +873,12 @@ def build_prometheus_cli_args(charm_config):
 
 
 def build_juju_pod_spec(app_name, charm_config, prom_image_meta,
-                        nginx_image_meta, alerting_config=None):
+                        nginx_image_meta, alerting_config=None,
+                        scrape_targets=None):
+    '''
+    :param scrape_targets: A dict of the targets of each scrape-target
+        relation as described in build_scrape_target_files()
+    '''
 
     # Mutable defaults bug as described in https://bit.ly/3cF0k0w
     if not alerting_config:
@@ -305,11 +903,71 @@ def build_juju_pod_spec(app_name, charm_config, prom_image_meta,
         ),
         ssl_cert=charm_config.get('ssl_cert'),
         ssl_key=charm_config.get('ssl_key'),
+        scrape_target_files=build_scrape_target_files(scrape_targets or {}),
     )
 
     return spec
 
 
+def build_scrape_target_files(scrape_targets):
+    '''
+    Renders the file_sd files of the scrape-target relations, one per
+    relation, with a target group per unit.
+
+    :param scrape_targets: A dict of relation key to a list of dicts with
+        the unit, hostname, port and, optionally, metrics_path of each of
+        the relation's units
+    '''
+    files = {}
+    for relation_key, targets in scrape_targets.items():
+        target_groups = []
+        for target in sorted(targets, key=lambda t: t['unit']):
+            labels = {
+                'juju_unit': target['unit'],
+                'juju_application': target['unit'].split('/')[0],
+            }
+            if target.get('metrics_path'):
+                labels['__metrics_path__'] = target['metrics_path']
+            target_groups.append({
+                'targets': [
+                    '{0}:{1}'.format(target['hostname'], target['port'])
+                ],
+                'labels': labels,
+            })
+        files['{0}.json'.format(relation_key)] = json.dumps(
+            target_groups, sort_keys=True, indent=1
+        )
+    return files
+
+
+def build_juju_pod_spec_digest(app_name, charm_config, prom_image_meta,
+                               nginx_image_meta, alerting_config=None,
+                               scrape_targets=None):
+    '''
+    Returns a digest of everything build_juju_pod_spec() renders the pod
+    spec from. Equal digests mean equal pod specs, except across charm
+    upgrades since the templates are not part of it.
+    '''
+    return canonical_digest({
+        'app_name': app_name,
+        'charm_config': dict(charm_config),
+        'prom_image': prom_image_meta.resource_dict,
+        'nginx_image': nginx_image_meta.resource_dict,
+        'alerting_config': alerting_config or dict(),
+        'scrape_targets': scrape_targets or dict(),
+    })
+
+
+def canonical_digest(obj):
+    '''
+    SHA-256 of the canonical JSON serialization of obj, so that dicts which
+    only differ in key order have the same digest.
+    '''
+    serialized = json.dumps(obj, sort_keys=True, separators=(',', ':'),
+                            default=str)
+    return hashlib.sha256(serialized.encode('utf-8')).hexdigest()
+
+
 def validate_and_parse_external_labels(raw_labels):
     """
     Determines, if the input variable can be safely injected into the
@@ -417,77 +1075,370 @@ def build_prometheus_config(charm_config):
         }]
     })
 
-    if charm_config.get('monitor-k8s'):
-        with open('templates/prometheus-k8s.yml') as prom_yaml:
-            k8s_scrape_configs = \
-                yaml.safe_load(prom_yaml).get('scrape_configs', [])
+    # Targets of the scrape-target relations
+    prometheus_config.add_scrape_config({
+        'job_name': SCRAPE_TARGETS_JOB,
+        'file_sd_configs': [{
+            'files': ['{0}/*.json'.format(SCRAPE_TARGETS_DIR)],
+            'refresh_interval': SCRAPE_TARGETS_REFRESH_INTERVAL,
+        }]
+    })
 
-        for scrape_config in k8s_scrape_configs:
+    if charm_config.get('monitor-k8s'):
+        for scrape_config in load_k8s_scrape_configs():
             prometheus_config.add_scrape_config(scrape_config)
 
     logger.debug("Build prom config: {}".format(prometheus_config))
     return prometheus_config
 
 
-def _prometheus_http_api_call(
-        model_name, app_name, method, endpoint, return_response=True):
+class _Missing:
 
-    if method not in ['GET', 'POST', 'PUT']:
-        raise CharmError('Wrong HTTP method')
+    def __repr__(self):
+        return '<missing>'
 
-    host = "{0}.{1}.svc".format(app_name, model_name)
-    conn = http.client.HTTPConnection(host)
-    conn.request(method=method, url=endpoint)
-    logger.debug("Calling Prom API: {0} {1}".format(method, endpoint))
 
-    # TODO: Handle the un-available API endpoint case
-    response = conn.getresponse()
+# Stands in for an option that is absent from one side of a ConfigDifference
+MISSING = _Missing()
 
-    if response.status < 200 or response.status >= 300:
-        logger.error("API returned error: {0}".format(
-            response.read()
-        ))
-        raise PrometheusAPIError("Prom API returned error, see unit logs")
+ConfigDifference = collections.namedtuple(
+    'ConfigDifference', ['path', 'expected', 'actual']
+)
+
+
+def normalize_prometheus_config(config_dict):
+    '''
+    Returns a new config dict in canonical form: the defaults that
+    Prometheus fills in are added, durations are written the way Prometheus
+    writes them and empty options, which Prometheus leaves out, are dropped.
+    The config that was loaded by Prometheus and the one it was loaded from
+    normalize to the same dict.
+    '''
+    global_opts = _with_defaults(config_dict.get('global'),
+                                 PROMETHEUS_GLOBAL_DEFAULTS)
+    scrape_config_defaults = dict(
+        PROMETHEUS_SCRAPE_CONFIG_DEFAULTS,
+        scrape_interval=global_opts['scrape_interval'],
+        scrape_timeout=global_opts['scrape_timeout'],
+    )
+
+    normalized = dict(config_dict)
+    normalized['global'] = global_opts
+    normalized['scrape_configs'] = [
+        _normalize_scrape_config(scrape_config, scrape_config_defaults)
+        for scrape_config in config_dict.get('scrape_configs') or []
+    ]
+    alerting = config_dict.get('alerting')
+    if alerting:
+        normalized['alerting'] = dict(alerting, alertmanagers=[
+            _with_defaults(alertmanager,
+                           PROMETHEUS_ALERTMANAGER_CONFIG_DEFAULTS)
+            for alertmanager in alerting.get('alertmanagers') or []
+        ])
+
+    return _canonical(normalized)
+
+
+def _normalize_scrape_config(scrape_config, defaults):
+    normalized = _with_defaults(scrape_config, defaults)
+    for key in ('relabel_configs', 'metric_relabel_configs'):
+        if normalized.get(key):
+            normalized[key] = [
+                _with_defaults(relabel_config,
+                               PROMETHEUS_RELABEL_CONFIG_DEFAULTS)
+                for relabel_config in normalized[key]
+            ]
+    return normalized
+
+
+def _with_defaults(options, defaults):
+    with_defaults = dict(defaults)
+    with_defaults.update(options or {})
+    return with_defaults
+
+
+def _canonical(value, key=None):
+    if isinstance(value, dict):
+        canonical = {}
+        for k, v in value.items():
+            v = _canonical(v, k)
+            if v not in (None, {}, [], ''):
+                canonical[k] = v
+        return canonical
+    if isinstance(value, list):
+        return [_canonical(item) for item in value]
+    if key in PROMETHEUS_DURATION_KEYS and isinstance(value, str):
+        return canonical_duration(value)
+    return value
 
-    if return_response:
-        try:
-            return json.loads(response.read())
-        except (ValueError, TypeError) as e:
-            logger.error("Prom API returned non-JSON: {0}".format(e))
-            raise PrometheusAPIError("Non-JSON response returned")
 
+def canonical_duration(duration):
+    '''
+    Rewrites a Prometheus duration such as 60s or 90m the way Prometheus
+    itself prints it, e.g. 1m and 1h30m. Invalid durations are returned
+    unchanged.
+    '''
+    parts = _DURATION_RE.findall(duration)
+    if not parts or ''.join(n + u for n, u in parts) != duration:
+        return duration
+
+    remaining = sum(int(n) * PROMETHEUS_DURATION_UNITS[u] for n, u in parts)
+    if remaining == 0:
+        return '0s'
+
+    canonical = ''
+    for unit, unit_ms in PROMETHEUS_DURATION_UNITS.items():
+        # Like Prometheus, only use years and weeks if they are exact
+        if unit in ('y', 'w') and remaining % unit_ms:
+            continue
+        count = remaining // unit_ms
+        if count:
+            canonical += '{0}{1}'.format(count, unit)
+            remaining -= count * unit_ms
+    return canonical
+
+
+def diff_prometheus_configs(expected, actual, path=''):
+    '''
+    Yields a ConfigDifference for each option where two normalized configs
+    differ. Scrape configs are matched by job_name rather than by position
+    so that the paths name the job that did not converge, e.g.
+    scrape_configs[prometheus].scrape_interval
+    '''
+    if isinstance(expected, dict) and isinstance(actual, dict):
+        for key in sorted(set(expected) | set(actual)):
+            yield from diff_prometheus_configs(
+                expected.get(key, MISSING), actual.get(key, MISSING),
+                '{0}.{1}'.format(path, key) if path else key
+            )
+    elif isinstance(expected, list) and isinstance(actual, list):
+        expected_items = _index_list_items(expected)
+        actual_items = _index_list_items(actual)
+        keys = list(expected_items) + [
+            key for key in actual_items if key not in expected_items
+        ]
+        for key in keys:
+            yield from diff_prometheus_configs(
+                expected_items.get(key, MISSING),
+                actual_items.get(key, MISSING),
+                '{0}[{1}]'.format(path, key)
+            )
+    elif expected != actual:
+        yield ConfigDifference(path, expected, actual)
 
-def reload_configuration(juju_model, juju_app, current_charm_config):
 
-    try:
-        expected_config = build_prometheus_config(current_charm_config)
-        logging.debug(
-            "Awaiting Prom config to be: {0}".format(expected_config)
+def _index_list_items(items):
+    if all(isinstance(item, dict) and 'job_name' in item for item in items):
+        return collections.OrderedDict(
+            (item['job_name'], item) for item in items
         )
+    return collections.OrderedDict(enumerate(items))
+
+
+class PrometheusAPIClient:
+    '''
+    Client of the HTTP API of the Prometheus app. It keeps its connection
+    alive between calls so that the reload loop doesn't reconnect to the
+    service on every request, bounds the time spent connecting and waiting
+    for a response, retries connection errors and timeouts a bounded number
+    of times, and refuses responses larger than max_response_size. Every
+    call is recorded in the instrumentation registry.
+
+    A reader can be handed in to consume a successful response as it
+    arrives, for instance to stop reading once it has found what it is
+    after. The connection is only kept alive if the reader read the
+    response to its end.
+    '''
+
+    def __init__(self, host,
+                 connect_timeout=PROMETHEUS_API_CONNECT_TIMEOUT,
+                 read_timeout=PROMETHEUS_API_READ_TIMEOUT,
+                 retries=PROMETHEUS_API_RETRIES,
+                 retry_delay=PROMETHEUS_API_RETRY_DELAY,
+                 max_response_size=PROMETHEUS_API_MAX_RESPONSE_SIZE,
+                 metrics=None):
+        self.host = host
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.max_response_size = max_response_size
+        self._metrics = instrumentation.registry if metrics is None \
+            else metrics
+        self._conn = None
+        self.connections_opened = 0
+        self.connections_reused = 0
+
+    @property
+    def stats(self):
+        return {
+            'connections_opened': self.connections_opened,
+            'connections_reused': self.connections_reused,
+        }
 
-        i = 0
+    def request(self, method, endpoint, reader=None):
+        '''
+        Returns a (status, body) tuple, where body is whatever the reader
+        returned if one was given and the response was successful. Raises
+        PrometheusAPIError once the retries are exhausted or if the
+        response is too large.
+        '''
+        started = time.monotonic()
+        retries = 0
         while True:
-            # Wait, until ConfigMap changes will be propagated
-            config_reload_api_call(juju_model, juju_app)
-            new_config_applied = check_config_propagation(
-                juju_model, juju_app, expected_config
-            )
-            if new_config_applied:
+            reused = self._conn is not None
+            try:
+                status, body, size = self._request_once(method, endpoint,
+                                                        reader)
                 break
-            i += 1
-            if i > 5:
-                logger.error(
-                    "Config has not been propagated after timeout"
+            except (OSError, http.client.HTTPException) as e:
+                self.close()
+                # Prometheus may have dropped the idle keep-alive connection
+                # in the meantime, which doesn't count as a retry
+                if reused:
+                    logger.debug("Stale Prom API connection, reconnecting")
+                    continue
+                if retries >= self.retries:
+                    self._record(method, endpoint, 'error', started, 0,
+                                 retries)
+                    raise PrometheusAPIError(
+                        "Prom API unavailable: {0}".format(e)
+                    )
+                delay = self.retry_delay * 2 ** retries
+                retries += 1
+                logger.warning(
+                    "Prom API call {0} {1} failed ({2}), retry {3} of {4} "
+                    "in {5}s".format(method, endpoint, e, retries,
+                                     self.retries, delay)
                 )
-                return False
-            time.sleep(5)
+                time.sleep(delay)
+            except PrometheusAPIError:
+                self.close()
+                self._record(method, endpoint, 'error', started, 0, retries)
+                raise
+
+        self._record(method, endpoint, status, started, size, retries)
+        logger.debug("Prom API connections: {0}".format(self.stats))
+        return status, body
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def _request_once(self, method, endpoint, reader):
+        conn, self._conn = self._conn, None
+        if conn is None:
+            conn = http.client.HTTPConnection(self.host,
+                                              timeout=self.connect_timeout)
+            self.connections_opened += 1
+            conn.connect()
+        else:
+            self.connections_reused += 1
+        # From here on the timeout applies to every read from the socket
+        sock = getattr(conn, 'sock', None)
+        if sock is not None:
+            sock.settimeout(self.read_timeout)
+        # Hand the connection back early so that close() cleans it up
+        self._conn = conn
+
+        logger.debug("Calling Prom API: {0} {1}".format(method, endpoint))
+        conn.request(method=method, url=endpoint)
+        response = conn.getresponse()
+
+        bounded_response = _BoundedResponse(
+            response, self.max_response_size,
+            "{0} {1}".format(method, endpoint)
+        )
+        if reader is None or not 200 <= response.status < 300:
+            body = bounded_response.read()
+        else:
+            body = reader(bounded_response)
+
+        if response.will_close or not response.isclosed():
+            self.close()
+        return response.status, body, bounded_response.bytes_read
+
+    def _record(self, method, endpoint, status, started, size, retries):
+        self._metrics.observe(
+            client='prometheus',
+            method=method,
+            path=endpoint.partition('?')[0],
+            status=status,
+            latency=time.monotonic() - started,
+            bytes_received=size,
+            retries=retries,
+        )
 
-        logger.debug("Config reloaded")
-    except CharmError as e:
-        logger.error("Exception raised: {0}".format(e))
-        return False
 
-    return new_config_applied
+class _BoundedResponse:
+    '''
+    Counts the bytes read from a response and raises PrometheusAPIError
+    once they exceed the limit. Reading one byte past the limit tells a
+    response that is exactly as long as the limit from one that is larger.
+    '''
+
+    def __init__(self, response, limit, request_line):
+        self._response = response
+        self._limit = limit
+        self._request_line = request_line
+        self.bytes_read = 0
+
+    def read(self, size=None):
+        # A response that fits is read to its end, which leaves the
+        # connection reusable
+        remaining = self._limit - self.bytes_read + 1
+        if size is not None:
+            remaining = min(size, remaining)
+        return self._count(self._response.read(remaining))
+
+    def __iter__(self):
+        while True:
+            line = self._response.readline(self._limit - self.bytes_read + 1)
+            if not line:
+                return
+            yield self._count(line)
+
+    def _count(self, data):
+        self.bytes_read += len(data)
+        if self.bytes_read > self._limit:
+            raise PrometheusAPIError(
+                "Prom API response to {0} exceeds {1} bytes".format(
+                    self._request_line, self._limit
+                )
+            )
+        return data
+
+
+_prometheus_api_clients = {}
+
+
+def get_prometheus_api_client(model_name, app_name):
+    host = "{0}.{1}.svc".format(app_name, model_name)
+    if host not in _prometheus_api_clients:
+        _prometheus_api_clients[host] = PrometheusAPIClient(host)
+    return _prometheus_api_clients[host]
+
+
+def _prometheus_http_api_call(
+        model_name, app_name, method, endpoint, return_response=True):
+
+    if method not in ['GET', 'POST', 'PUT']:
+        raise CharmError('Wrong HTTP method')
+
+    client = get_prometheus_api_client(model_name, app_name)
+    status, body = client.request(method, endpoint)
+
+    if status < 200 or status >= 300:
+        logger.error("API returned error: {0}".format(body))
+        raise PrometheusAPIError("Prom API returned error, see unit logs")
+
+    if return_response:
+        try:
+            return json.loads(body)
+        except (ValueError, TypeError) as e:
+            logger.error("Prom API returned non-JSON: {0}".format(e))
+            raise PrometheusAPIError("Non-JSON response returned")
 
 
 def config_reload_api_call(model_name, app_name):
@@ -496,8 +1447,54 @@ def config_reload_api_call(model_name, app_name):
     )
 
 
+def read_config_fingerprint(config_text):
+    '''
+    Returns the fingerprint PrometheusConfigFile.yaml_dump() put at the top
+    of a config file, or None if there is none.
+    '''
+    first_line = config_text.partition('\n')[0]
+    if not first_line.startswith(FINGERPRINT_COMMENT_PREFIX):
+        return None
+    return first_line[len(FINGERPRINT_COMMENT_PREFIX):].strip()
+
+
+def get_config_reload_metrics(model_name, app_name):
+    '''
+    Returns the reload samples of Prometheus' own metrics by name, leaving
+    out those it doesn't expose. /metrics is only read up to where both
+    have been seen, which takes a few KB rather than the whole config.
+    '''
+    wanted = (RELOAD_SUCCESSFUL_METRIC, RELOAD_TIMESTAMP_METRIC)
+
+    def read_reload_metrics(response):
+        samples = {}
+        try:
+            for sample in instrumentation.parse_text_exposition(response):
+                if sample.name in wanted:
+                    samples[sample.name] = sample.value
+                    if len(samples) == len(wanted):
+                        break
+        except ValueError as e:
+            raise PrometheusAPIError(str(e))
+        return samples
+
+    client = get_prometheus_api_client(model_name, app_name)
+    status, samples = client.request('GET', '/metrics',
+                                     reader=read_reload_metrics)
+    if status < 200 or status >= 300:
+        logger.error("API returned error: {0}".format(samples))
+        raise PrometheusAPIError("Prom API returned error, see unit logs")
+    return samples
+
+
 def check_config_propagation(model_name, app_name, expected_config):
     """
+    Tells whether Prometheus runs the expected config by looking for its
+    fingerprint job in the running config. As that job comes before all
+    others, a config that has converged is only read up to there, which
+    takes a few KB however many scrape jobs there are. Only a config that
+    has not converged is read in full, to log what differs.
+
     :param model_name
     :param app_name
     :param expected_config: PrometheusConfigFile instance
@@ -511,21 +1508,50 @@ def check_config_propagation(model_name, app_name, expected_config):
         )
 
     logging.debug("Expected: {0}".format(expected_config))
-    response = _prometheus_http_api_call(
-        model_name, app_name, 'GET', '/api/v1/status/config'
-    )
-    current_config = yaml.safe_load(response['data']['yaml'])
+    fingerprint_job = 'job_name: {0}'.format(
+        expected_config.fingerprint_job_name
+    ).encode()
 
-    # Some of the config options may be empty, so we have to re-add them
-    # back to the received dict; otherwise this comparison will fail.
-
-    if not current_config['global'].get('external_labels'):
-        logging.debug("No external_labels received, adding empty key")
-        current_config['global']['external_labels'] = {}
+    def read_up_to_fingerprint_job(response):
+        body = bytearray()
+        while True:
+            chunk = response.read(PROMETHEUS_API_READ_CHUNK_SIZE)
+            if not chunk:
+                return bytes(body), False
+            body += chunk
+            # Only look at what may have completed the job name
+            start = max(0, len(body) - len(chunk) - len(fingerprint_job))
+            if body.find(fingerprint_job, start) >= 0:
+                return bytes(body), True
+
+    client = get_prometheus_api_client(model_name, app_name)
+    status, response = client.request('GET', '/api/v1/status/config',
+                                      reader=read_up_to_fingerprint_job)
+    if status < 200 or status >= 300:
+        logger.error("API returned error: {0}".format(response))
+        raise PrometheusAPIError("Prom API returned error, see unit logs")
 
-    if not current_config.get('alerting'):
-        logging.debug("No alerting received, adding empty key")
-        current_config['alerting'] = {}
+    body, found = response
+    if found:
+        return True
 
+    try:
+        current_yaml = json.loads(body.decode())['data']['yaml']
+    except (ValueError, TypeError, KeyError) as e:
+        logger.error("Prom API returned an unexpected config: {0}".format(e))
+        raise PrometheusAPIError("Unexpected config response returned")
+
+    # Only parse the whole config to tell what has not converged yet
+    current_config = normalize_prometheus_config(
+        yaml_codec.load(current_yaml)
+    )
     logging.debug("Received from API: {0}".format(current_config))
-    return current_config == expected_config.to_dict()
+    expected_dict = normalize_prometheus_config(
+        expected_config.to_dict(fingerprint=True)
+    )
+    for difference in diff_prometheus_configs(expected_dict, current_config):
+        logger.info(
+            "Config has not converged at {0}: expected {1!r}, "
+            "got {2!r}".format(*difference)
+        )
+    return False
@@ -6,6 +6,10 @@ class CharmError(Exception):
         return repr(self.message)
 
 
+class DuplicateScrapeJobError(CharmError):
+    pass
+
+
 class ExternalLabelParseError(CharmError):
     pass
 
@@ -16,3 +20,7 @@ class TimeStringParseError(CharmError):
 
 class PrometheusAPIError(CharmError):
     pass
+
+
+class KubernetesAPIError(CharmError):
+    pass
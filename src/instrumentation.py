@@ -0,0 +1,212 @@
+import collections
+
+
+# Upper bounds, in seconds, of the request latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+METRIC_PREFIX = 'charm_http'
+
+LABEL_NAMES = ('client', 'method', 'path', 'status')
+
+
+# A sample of the text exposition format as parsed by parse_text_exposition()
+Sample = collections.namedtuple('Sample',
+                                ['name', 'labels', 'value', 'timestamp'])
+
+
+class RequestMetrics:
+    """
+    In-process registry of the HTTP requests the charm makes. Requests are
+    aggregated by client, method, path template and status so the registry
+    stays small no matter how many requests a hook makes. It can be turned
+    into a plain dict of simple types for persistence in StoredState and
+    rendered in the Prometheus text exposition format.
+    """
+
+    def __init__(self):
+        self._series = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self._series)
+
+    def observe(self, client, method, path, status, latency, bytes_received,
+                retries=0):
+        series = self._get_series(
+            (client, method, path, str(status))
+        )
+        series['count'] += 1
+        series['latency_sum'] += latency
+        series['bytes_received'] += bytes_received
+        series['retries'] += retries
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if latency <= bound:
+                series['buckets'][i] += 1
+
+    def clear(self):
+        self._series.clear()
+
+    def merge(self, other):
+        for labels, other_series in other._series.items():
+            series = self._get_series(labels)
+            for name in ('count', 'latency_sum', 'bytes_received', 'retries'):
+                series[name] += other_series[name]
+            series['buckets'] = [
+                a + b for a, b in zip(series['buckets'],
+                                      other_series['buckets'])
+            ]
+
+    def to_dict(self):
+        return {
+            '\t'.join(labels): dict(series, buckets=list(series['buckets']))
+            for labels, series in self._series.items()
+        }
+
+    @classmethod
+    def from_dict(cls, metrics_dict):
+        metrics = cls()
+        for key in sorted(metrics_dict.keys()):
+            series = metrics._get_series(tuple(key.split('\t')))
+            series.update(metrics_dict[key])
+            series['buckets'] = list(series['buckets'])
+        return metrics
+
+    def render(self):
+        """
+        Returns the registry in the Prometheus text exposition format.
+        """
+        lines = []
+        name = METRIC_PREFIX + '_request_duration_seconds'
+        lines.append('# HELP {} Latency of the HTTP requests made by the '
+                     'charm.'.format(name))
+        lines.append('# TYPE {} histogram'.format(name))
+        for labels, series in self._series.items():
+            for bound, count in zip(LATENCY_BUCKETS, series['buckets']):
+                lines.append('{}_bucket{} {}'.format(
+                    name, _format_labels(labels, le=_format_float(bound)),
+                    count
+                ))
+            lines.append('{}_bucket{} {}'.format(
+                name, _format_labels(labels, le='+Inf'), series['count']
+            ))
+            lines.append('{}_sum{} {}'.format(
+                name, _format_labels(labels),
+                _format_float(series['latency_sum'])
+            ))
+            lines.append('{}_count{} {}'.format(
+                name, _format_labels(labels), series['count']
+            ))
+
+        for suffix, key, help_text in (
+            ('response_bytes_total', 'bytes_received',
+             'Bytes received in response to the HTTP requests made by the '
+             'charm.'),
+            ('request_retries_total', 'retries',
+             'Times the HTTP requests made by the charm were retried.'),
+        ):
+            name = '{}_{}'.format(METRIC_PREFIX, suffix)
+            lines.append('# HELP {} {}'.format(name, help_text))
+            lines.append('# TYPE {} counter'.format(name))
+            for labels, series in self._series.items():
+                lines.append('{}{} {}'.format(
+                    name, _format_labels(labels), series[key]
+                ))
+
+        return '\n'.join(lines) + '\n'
+
+    def _get_series(self, labels):
+        if labels not in self._series:
+            self._series[labels] = {
+                'count': 0,
+                'latency_sum': 0.0,
+                'bytes_received': 0,
+                'retries': 0,
+                'buckets': [0] * len(LATENCY_BUCKETS),
+            }
+        return self._series[labels]
+
+
+def _format_labels(labels, **extra):
+    pairs = list(zip(LABEL_NAMES, labels)) + sorted(extra.items())
+    return '{' + ','.join(
+        '{}="{}"'.format(name, _escape_label_value(value))
+        for name, value in pairs
+    ) + '}'
+
+
+def _escape_label_value(value):
+    return str(value).replace('\\', '\\\\') \
+                     .replace('"', '\\"') \
+                     .replace('\n', '\\n')
+
+
+def _format_float(value):
+    return repr(float(value))
+
+
+def parse_text_exposition(lines):
+    """
+    Parses the Prometheus text exposition format one line at a time and
+    yields a Sample per sample line, so that the caller can stop reading
+    as soon as it has seen the samples it is after. Lines may be str or
+    bytes. Comments, including HELP and TYPE lines, are skipped.
+
+    https://prometheus.io/docs/instrumenting/exposition_formats
+    """
+    for line in lines:
+        if isinstance(line, bytes):
+            line = line.decode('utf-8')
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+
+        try:
+            yield _parse_sample(line)
+        except (IndexError, ValueError):
+            raise ValueError("Malformed sample line: {}".format(line))
+
+
+def _parse_sample(line):
+    brace = line.find('{')
+    space = line.find(' ')
+    if brace != -1 and (space == -1 or brace < space):
+        name = line[:brace]
+        labels, end = _parse_labels(line, brace + 1)
+        rest = line[end:].split()
+    else:
+        name, *rest = line.split()
+        labels = {}
+
+    value = float(rest[0])
+    timestamp = int(rest[1]) if len(rest) > 1 else None
+    return Sample(name, labels, value, timestamp)
+
+
+def _parse_labels(line, pos):
+    """
+    Returns the labels starting at pos, right after the opening brace, and
+    the position right after the closing brace.
+    """
+    labels = {}
+    while True:
+        while line[pos] in ' ,':
+            pos += 1
+        if line[pos] == '}':
+            return labels, pos + 1
+
+        equals = line.index('=', pos)
+        label_name = line[pos:equals].strip()
+        pos = line.index('"', equals) + 1
+        value = []
+        while line[pos] != '"':
+            if line[pos] == '\\':
+                pos += 1
+                value.append({'n': '\n'}.get(line[pos], line[pos]))
+            else:
+                value.append(line[pos])
+            pos += 1
+        labels[label_name] = ''.join(value)
+        pos += 1
+
+
+# The registry every client records into for the lifetime of the hook
+registry = RequestMetrics()
@@ -0,0 +1,73 @@
+import logging
+
+logger = logging.getLogger()
+
+from ops.framework import (
+    EventBase,
+    EventSource,
+    Object,
+    ObjectEvents,
+)
+from adapters.framework import FrameworkAdapter
+
+
+class ScrapeTargetsChangedEvent(EventBase):
+    pass
+
+
+class ScrapeTargetEvents(ObjectEvents):
+    targets_changed = EventSource(ScrapeTargetsChangedEvent)
+
+
+class ScrapeTargetInterface(Object):
+    """
+    The requiring side of an `http` interface relation. Every unit on the
+    other side advertises its metrics endpoint through the hostname, port
+    and, optionally, metrics_path keys of its relation data.
+    """
+    on = ScrapeTargetEvents()
+
+    def __init__(self, charm, relation_name):
+        super().__init__(charm, relation_name)
+
+        self.fw_adapter = FrameworkAdapter(self.framework)
+        self.relation_name = relation_name
+
+        for event in (charm.on[relation_name].relation_changed,
+                      charm.on[relation_name].relation_departed,
+                      charm.on[relation_name].relation_broken):
+            self.fw_adapter.observe(event, self.on_relation_changed)
+
+    def on_relation_changed(self, event):
+        logger.debug("Emitting targets_changed event")
+        self.on.targets_changed.emit()
+
+
+def get_scrape_targets(relations):
+    """
+    Returns the targets advertised by the units of the given relations in
+    the form expected by domain.build_scrape_target_files()
+    """
+    scrape_targets = {}
+    for relation in relations:
+        targets = []
+        for unit in relation.units:
+            data = relation.data[unit]
+            hostname = data.get('hostname') or \
+                data.get('ingress-address') or \
+                data.get('private-address')
+            port = data.get('port')
+            if not (hostname and port):
+                logger.debug(
+                    "{} has not advertised its endpoint yet".format(unit.name)
+                )
+                continue
+
+            targets.append({
+                'unit': unit.name,
+                'hostname': hostname,
+                'port': port,
+                'metrics_path': data.get('metrics_path'),
+            })
+        scrape_targets['{0}-{1}'.format(relation.name, relation.id)] = targets
+    return scrape_targets
@@ -0,0 +1,42 @@
+"""
+The YAML codec shared by the domain and the adapters. It uses the libyaml
+bindings when PyYAML was built with them and falls back to the pure Python
+implementation otherwise. Both emit the same documents given the explicit
+dump options below.
+"""
+import yaml
+
+try:
+    from yaml import (
+        CSafeDumper as SafeDumper,
+        CSafeLoader as SafeLoader,
+    )
+    LIBYAML = True
+except ImportError:
+    from yaml import (
+        SafeDumper,
+        SafeLoader,
+    )
+    LIBYAML = False
+
+
+YAMLError = yaml.YAMLError
+
+# Spelled out rather than left to PyYAML's defaults so that the output does
+# not depend on the PyYAML version nor on whether libyaml is used
+DUMP_OPTIONS = {
+    'default_flow_style': False,
+    'sort_keys': True,
+    'allow_unicode': False,
+    'indent': 2,
+    'width': 80,
+    'line_break': '\n',
+}
+
+
+def load(stream, loader=SafeLoader):
+    return yaml.load(stream, Loader=loader)
+
+
+def dump(data, dumper=SafeDumper):
+    return yaml.dump(data, Dumper=dumper, **DUMP_OPTIONS)
@@ -0,0 +1,238 @@
+import asyncio
+import json
+import socket
+import sys
+import threading
+import time
+import unittest
+from uuid import uuid4
+
+sys.path.append('lib')
+sys.path.append('src')
+from adapters import aio
+from exceptions import KubernetesAPIError
+from instrumentation import RequestMetrics
+from stub_server import (
+    json_responder,
+    pod_list_responder,
+    StubHTTPServer,
+)
+
+
+class AsyncHTTPClientTest(unittest.TestCase):
+
+    def test__it_reads_content_length_responses(self):
+        # Setup
+        body = {str(uuid4()): str(uuid4())}
+
+        with StubHTTPServer(json_responder(body)) as stub:
+            client = aio.AsyncHTTPClient('127.0.0.1', stub.port)
+
+            # Exercise
+            response, = aio.run_concurrently([lambda: client.get('/')])
+
+        # Assert
+        assert response.status == 200
+        assert response.json() == body
+
+    def test__it_reads_chunked_responses(self):
+        # Setup
+        body = {str(uuid4()): [str(uuid4()) for _ in range(10)]}
+
+        with StubHTTPServer(json_responder(body, chunked=True)) as stub:
+            client = aio.AsyncHTTPClient('127.0.0.1', stub.port)
+
+            # Exercise
+            response, = aio.run_concurrently([lambda: client.get('/')])
+
+        # Assert
+        assert response.json() == body
+
+
+class RunConcurrentlyTest(unittest.TestCase):
+
+    def test__it_runs_independent_queries_side_by_side(self):
+        # Setup
+        k8s_respond = json_responder({'kind': 'Pod'}, delay=0.2)
+        prom_respond = json_responder({'status': 'success'}, delay=0.2)
+        with StubHTTPServer(k8s_respond) as k8s_stub, \
+                StubHTTPServer(prom_respond) as prom_stub:
+            k8s_client = aio.AsyncHTTPClient('127.0.0.1', k8s_stub.port)
+            prom_client = aio.AsyncHTTPClient('127.0.0.1', prom_stub.port)
+            queries = [
+                lambda: k8s_client.get('/api/v1/namespaces/lma/pods/p-0'),
+                lambda: k8s_client.get('/api/v1/namespaces/lma/pods/p-1'),
+                lambda: prom_client.get('/api/v1/status/config'),
+            ]
+
+            # Exercise
+            started = time.monotonic()
+            responses = aio.run_concurrently(queries, concurrency=3)
+            elapsed = time.monotonic() - started
+
+        # Assert
+        assert [r.json() for r in responses] == [
+            {'kind': 'Pod'},
+            {'kind': 'Pod'},
+            {'status': 'success'},
+        ]
+        # Sequentially these would take at least 0.6s
+        assert elapsed < 0.5
+        assert k8s_stub.max_in_flight == 2
+
+    def test__it_honors_the_concurrency_limit(self):
+        # Setup
+        with StubHTTPServer(json_responder({}, delay=0.05)) as stub:
+            client = aio.AsyncHTTPClient('127.0.0.1', stub.port)
+
+            # Exercise
+            responses = aio.run_concurrently(
+                [lambda: client.get('/') for _ in range(8)],
+                concurrency=2
+            )
+
+        # Assert
+        assert len(responses) == 8
+        assert stub.max_in_flight == 2
+
+    def test__it_returns_exceptions_in_place_of_results(self):
+        # Setup
+        async def fail():
+            raise ConnectionRefusedError()
+
+        async def succeed():
+            return 42
+
+        # Exercise
+        results = aio.run_concurrently([fail, succeed])
+
+        # Assert
+        assert isinstance(results[0], ConnectionRefusedError)
+        assert results[1] == 42
+
+
+class RunInBackgroundTest(unittest.TestCase):
+
+    def test__it_returns_while_the_queries_are_in_flight(self):
+        # Setup
+        release = threading.Event()
+
+        async def query():
+            while not release.is_set():
+                await asyncio.sleep(0.01)
+            return 42
+
+        # Exercise
+        future = aio.run_in_background([query])
+        in_flight = not future.done()
+        release.set()
+
+        # Assert
+        assert in_flight
+        assert future.result(timeout=5) == [42]
+
+
+class GetAppPodStatusesTest(unittest.TestCase):
+
+    def test__it_indexes_the_pod_statuses_by_unit_across_pages(self):
+        # Setup
+        items = [
+            {'metadata': {'annotations': {'juju.io/unit': 'prometheus/0'}}},
+            {'metadata': {'annotations': {}}},
+            {'metadata': {'annotations': {'juju.io/unit': 'prometheus/1'}}},
+        ]
+
+        with StubHTTPServer(pod_list_responder(items)) as stub:
+            client = aio.AsyncHTTPClient('127.0.0.1', stub.port)
+
+            # Exercise
+            pod_statuses, = aio.run_concurrently([
+                lambda: aio.get_app_pod_statuses(client, 'lma', 'prometheus',
+                                                 limit=2)
+            ])
+
+        # Assert
+        assert sorted(pod_statuses.keys()) == ['prometheus/0', 'prometheus/1']
+        assert pod_statuses['prometheus/1'].unit_name == 'prometheus/1'
+        assert stub.paths == [
+            '/api/v1/namespaces/lma/pods?'
+            'labelSelector=juju-app=prometheus&limit=2',
+            '/api/v1/namespaces/lma/pods?'
+            'labelSelector=juju-app=prometheus&limit=2&continue=2',
+        ]
+
+    def test__it_raises_an_api_error_if_the_list_fails(self):
+        # Setup
+        respond = json_responder({'kind': 'Status'}, status=403)
+
+        with StubHTTPServer(respond) as stub:
+            client = aio.AsyncHTTPClient('127.0.0.1', stub.port)
+
+            # Exercise
+            result, = aio.run_concurrently([
+                lambda: aio.get_app_pod_statuses(client, 'lma', 'prometheus')
+            ])
+
+        # Assert
+        assert isinstance(result, KubernetesAPIError)
+        assert '403' in str(result)
+
+    def test__it_raises_an_api_error_if_the_server_is_unreachable(self):
+        # Setup
+        with socket.socket() as sock:
+            sock.bind(('127.0.0.1', 0))
+            port = sock.getsockname()[1]
+        client = aio.AsyncHTTPClient('127.0.0.1', port)
+
+        # Exercise
+        result, = aio.run_concurrently([
+            lambda: aio.get_app_pod_statuses(client, 'lma', 'prometheus')
+        ])
+
+        # Assert
+        assert isinstance(result, KubernetesAPIError)
+
+
+class RecordRequestsTest(unittest.TestCase):
+
+    def test__it_records_the_requests_once_asked_to(self):
+        # Setup
+        metrics = RequestMetrics()
+        body = {str(uuid4()): str(uuid4())}
+
+        with StubHTTPServer(json_responder(body)) as stub:
+            client = aio.AsyncHTTPClient(
+                '127.0.0.1', stub.port, client_name='kubernetes',
+                path_template=lambda path: '/api/v1/{name}'
+            )
+            aio.run_in_background([
+                lambda: client.get('/api/v1/foo?limit=1')
+            ]).result(timeout=5)
+
+            # Exercise
+            recorded_while_running = len(metrics)
+            client.record_requests(metrics)
+            client.record_requests(metrics)
+
+        # Assert
+        assert recorded_while_running == 0
+        series, = metrics.to_dict().items()
+        assert series[0] == 'kubernetes\tGET\t/api/v1/{name}\t200'
+        assert series[1]['count'] == 1
+        assert series[1]['bytes_received'] == len(json.dumps(body))
+
+    def test__it_records_failed_requests_as_errors(self):
+        # Setup
+        metrics = RequestMetrics()
+        with socket.socket() as sock:
+            sock.bind(('127.0.0.1', 0))
+            port = sock.getsockname()[1]
+        client = aio.AsyncHTTPClient('127.0.0.1', port)
+        aio.run_concurrently([lambda: client.get('/foo?bar=1')])
+
+        # Exercise
+        client.record_requests(metrics)
+
+        # Assert
+        labels, = metrics.to_dict().keys()
+        assert labels == 'http\tGET\t/foo\terror'
@@ -1,8 +1,12 @@
+import gzip
 import io
 import json
+import os
 import sys
+import tempfile
 import unittest
 from unittest.mock import (
+    call,
     patch,
 )
 from uuid import (
@@ -13,8 +17,84 @@ sys.path.append('src')
 from adapters import k8s
 from adapters.k8s import (
     APIServer,
+    JSONObjectStream,
     PodStatus,
+    path_template,
 )
+from exceptions import KubernetesAPIError
+from instrumentation import RequestMetrics
+from stub_server import (
+    json_responder,
+    pod_list_responder,
+    StubHTTPServer,
+)
+
+
+def watch_responder(events, status=200):
+    def respond(handler):
+        handler.send_response(status)
+        handler.send_header('Content-Type', 'application/json')
+        handler.send_header('Transfer-Encoding', 'chunked')
+        handler.end_headers()
+        for event in events:
+            chunk = (json.dumps(event) + '\n').encode()
+            handler.wfile.write(b'%x\r\n%s\r\n' % (len(chunk), chunk))
+            handler.wfile.flush()
+        handler.wfile.write(b'0\r\n\r\n')
+        handler.close_connection = True
+    return respond
+
+
+def build_pod_event(event_type, juju_unit, phase, ready):
+    return {
+        'type': event_type,
+        'object': {
+            'metadata': {
+                'annotations': {
+                    'juju.io/unit': juju_unit
+                },
+                'resourceVersion': str(uuid4())
+            },
+            'status': {
+                'phase': phase,
+                'conditions': [{
+                    'type': 'ContainersReady',
+                    'status': str(ready)
+                }]
+            }
+        }
+    }
+
+
+class StubAPIServerTestCase(unittest.TestCase):
+
+    def setUp(self):
+        token_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(token_dir.cleanup)
+        self.token_path = os.path.join(token_dir.name, 'token')
+        with open(self.token_path, 'w') as token_file:
+            token_file.write(str(uuid4()))
+
+        patcher = patch('adapters.k8s.ssl.SSLContext',
+                        autospec=True, spec_set=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.pool = k8s.APIConnectionPool(token_path=self.token_path)
+        self.addCleanup(self.pool.close)
+        patcher = patch('adapters.k8s._connection_pool', self.pool)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def start_stub_server(self, respond):
+        stub = StubHTTPServer(respond)
+        patcher = patch('adapters.k8s.http.client.HTTPSConnection',
+                        side_effect=stub.connect)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        stub.__enter__()
+        self.addCleanup(stub.__exit__)
+        return stub
 
 
 class GetPodStatusTest(unittest.TestCase):
@@ -28,15 +108,16 @@ class GetPodStatusTest(unittest.TestCase):
 
         mock_api_server = mock_api_server_cls.return_value
         mock_api_server.get.return_value = {
-            'kind': 'PodList',
-            'items': [{
-                'metadata': {
-                    'annotations': {
-                        'juju.io/unit': juju_unit
-                    }
-                }
-            }]
+            'kind': 'Status',
+            'code': 404
         }
+        mock_api_server.list.return_value = iter([{
+            'metadata': {
+                'annotations': {
+                    'juju.io/unit': juju_unit
+                }
+            }
+        }])
 
         # Exercise
         pod_status = k8s.get_pod_status(juju_model=uuid4(),
@@ -45,6 +126,7 @@ class GetPodStatusTest(unittest.TestCase):
 
         # Assert
         assert type(pod_status) == PodStatus
+        assert not pod_status.is_unknown
 
     @patch('adapters.k8s.APIServer', autospec=True, spec_set=True)
     def test__returns_PodStatus_even_if_resource_not_found(
@@ -53,9 +135,10 @@ class GetPodStatusTest(unittest.TestCase):
         # Setup
         mock_api_server = mock_api_server_cls.return_value
         mock_api_server.get.return_value = {
-            'kind': 'PodList',
-            'items': []
+            'kind': 'Status',
+            'code': 404
         }
+        mock_api_server.list.return_value = iter([])
 
         # Exercise
         pod_status = k8s.get_pod_status(juju_model=uuid4(),
@@ -64,28 +147,322 @@ class GetPodStatusTest(unittest.TestCase):
 
         # Assert
         assert type(pod_status) == PodStatus
+        assert pod_status.is_unknown
 
+    @patch('adapters.k8s.APIServer', autospec=True, spec_set=True)
+    def test__it_gets_the_statefulset_pod_without_listing(
+            self,
+            mock_api_server_cls):
+        # Setup
+        mock_api_server = mock_api_server_cls.return_value
+        mock_api_server.get.return_value = {
+            'kind': 'Pod',
+            'metadata': {
+                'name': 'prometheus-1',
+                'annotations': {
+                    'juju.io/unit': 'prometheus/1'
+                }
+            }
+        }
 
-class APIServerTest(unittest.TestCase):
+        # Exercise
+        pod_status = k8s.get_pod_status(juju_model='lma',
+                                        juju_app='prometheus',
+                                        juju_unit='prometheus/1')
 
-    @patch('adapters.k8s.open', create=True)
-    @patch('adapters.k8s.ssl.SSLContext', autospec=True, spec_set=True)
-    @patch('adapters.k8s.http.client.HTTPSConnection',
-           autospec=True, spec_set=True)
-    def test__get__loads_json_string_successfully(
+        # Assert
+        assert pod_status.pod_name == 'prometheus-1'
+        assert mock_api_server.get.call_args_list == [
+            call('/api/v1/namespaces/lma/pods/prometheus-1')
+        ]
+
+    @patch('adapters.k8s.APIServer', autospec=True, spec_set=True)
+    def test__it_tries_the_given_pod_name_first(
+            self,
+            mock_api_server_cls):
+        # Setup
+        pod_name = str(uuid4())
+        mock_api_server = mock_api_server_cls.return_value
+        mock_api_server.get.return_value = {
+            'kind': 'Pod',
+            'metadata': {
+                'name': pod_name,
+                'annotations': {
+                    'juju.io/unit': 'prometheus/1'
+                }
+            }
+        }
+
+        # Exercise
+        pod_status = k8s.get_pod_status(juju_model='lma',
+                                        juju_app='prometheus',
+                                        juju_unit='prometheus/1',
+                                        pod_name=pod_name)
+
+        # Assert
+        assert pod_status.pod_name == pod_name
+        assert mock_api_server.get.call_args_list == [
+            call('/api/v1/namespaces/lma/pods/{}'.format(pod_name))
+        ]
+
+    @patch('adapters.k8s.APIServer', autospec=True, spec_set=True)
+    def test__it_lists_pods_if_the_pod_belongs_to_another_unit(
+            self,
+            mock_api_server_cls):
+        # Setup
+        mock_api_server = mock_api_server_cls.return_value
+        mock_api_server.get.return_value = {
+            'kind': 'Pod',
+            'metadata': {
+                'name': 'prometheus-1',
+                'annotations': {
+                    'juju.io/unit': 'prometheus/7'
+                }
+            }
+        }
+        mock_api_server.list.return_value = iter([{
+            'metadata': {
+                'name': 'prometheus-abcde',
+                'annotations': {
+                    'juju.io/unit': 'prometheus/1'
+                }
+            }
+        }])
+
+        # Exercise
+        pod_status = k8s.get_pod_status(juju_model='lma',
+                                        juju_app='prometheus',
+                                        juju_unit='prometheus/1')
+
+        # Assert
+        assert pod_status.pod_name == 'prometheus-abcde'
+        assert mock_api_server.get.call_args_list == [
+            call('/api/v1/namespaces/lma/pods/prometheus-1'),
+        ]
+        assert mock_api_server.list.call_args_list == [
+            call('/api/v1/namespaces/lma/pods?'
+                 'labelSelector=juju-app=prometheus'),
+        ]
+
+    @patch('adapters.k8s.APIServer', autospec=True, spec_set=True)
+    def test__it_stops_reading_the_pod_list_at_the_unit_pod(
             self,
-            mock_https_connection_cls,
-            mock_ssl_context_cls,
-            mock_open):
+            mock_api_server_cls):
         # Setup
-        mock_token = str(uuid4())
-        mock_token_file = io.StringIO(mock_token)
-        mock_open.return_value = mock_token_file
-        mock_response_dict = {}
-        mock_response_json = io.StringIO(json.dumps(mock_response_dict))
+        def pods():
+            for unit in ['prometheus/7', 'prometheus/1', 'prometheus/8']:
+                pods.yielded.append(unit)
+                yield {
+                    'metadata': {
+                        'annotations': {
+                            'juju.io/unit': unit
+                        }
+                    }
+                }
+        pods.yielded = []
+
+        mock_api_server = mock_api_server_cls.return_value
+        mock_api_server.get.return_value = {
+            'kind': 'Status',
+            'code': 404
+        }
+        mock_api_server.list.return_value = pods()
+
+        # Exercise
+        pod_status = k8s.get_pod_status(juju_model='lma',
+                                        juju_app='prometheus',
+                                        juju_unit='prometheus/1')
+
+        # Assert
+        assert not pod_status.is_unknown
+        assert pods.yielded == ['prometheus/7', 'prometheus/1']
+
+
+class GetConfigMapFileTest(unittest.TestCase):
 
-        mock_conn = mock_https_connection_cls.return_value
-        mock_conn.getresponse.return_value = mock_response_json
+    @patch('adapters.k8s.APIServer', autospec=True, spec_set=True)
+    def test__it_gets_the_given_config_map_without_listing(
+            self,
+            mock_api_server_cls):
+        # Setup
+        mock_api_server = mock_api_server_cls.return_value
+        mock_api_server.get.return_value = {
+            'kind': 'ConfigMap',
+            'metadata': {'name': 'prometheus-config'},
+            'data': {'prometheus.yml': 'foo'}
+        }
+
+        # Exercise
+        config_map_file = k8s.get_config_map_file(
+            juju_model='lma',
+            juju_app='prometheus',
+            file_name='prometheus.yml',
+            config_map_name='prometheus-config'
+        )
+
+        # Assert
+        assert config_map_file == ('prometheus-config', 'foo')
+        assert mock_api_server.get.call_args_list == [
+            call('/api/v1/namespaces/lma/configmaps/prometheus-config')
+        ]
+        assert mock_api_server.list.call_count == 0
+
+    @patch('adapters.k8s.APIServer', autospec=True, spec_set=True)
+    def test__it_lists_the_app_config_maps_if_the_given_one_is_gone(
+            self,
+            mock_api_server_cls):
+        # Setup
+        mock_api_server = mock_api_server_cls.return_value
+        mock_api_server.get.return_value = {
+            'kind': 'Status',
+            'code': 404
+        }
+        mock_api_server.list.return_value = iter([
+            {'metadata': {'name': 'nginx-config'},
+             'data': {'nginx.conf': 'bar'}},
+            {'metadata': {'name': 'prometheus-config-2'},
+             'data': {'prometheus.yml': 'foo'}},
+        ])
+
+        # Exercise
+        config_map_file = k8s.get_config_map_file(
+            juju_model='lma',
+            juju_app='prometheus',
+            file_name='prometheus.yml',
+            config_map_name='prometheus-config'
+        )
+
+        # Assert
+        assert config_map_file == ('prometheus-config-2', 'foo')
+        assert mock_api_server.list.call_args_list == [
+            call('/api/v1/namespaces/lma/configmaps?'
+                 'labelSelector=juju-app=prometheus'),
+        ]
+
+    @patch('adapters.k8s.APIServer', autospec=True, spec_set=True)
+    def test__it_returns_nothing_if_no_config_map_holds_the_file(
+            self,
+            mock_api_server_cls):
+        # Setup
+        mock_api_server = mock_api_server_cls.return_value
+        mock_api_server.list.return_value = iter([
+            {'metadata': {'name': 'nginx-config'}, 'data': None},
+        ])
+
+        # Exercise
+        config_map_file = k8s.get_config_map_file(
+            juju_model='lma',
+            juju_app='prometheus',
+            file_name='prometheus.yml'
+        )
+
+        # Assert
+        assert config_map_file == (None, None)
+        assert mock_api_server.get.call_count == 0
+
+
+class WatchPodStatusTest(StubAPIServerTestCase):
+
+    def test__it_yields_the_unit_pod_changes_until_it_is_ready(self):
+        # Setup
+        juju_unit = str(uuid4())
+        stub = self.start_stub_server(watch_responder([
+            build_pod_event('ADDED', juju_unit, 'Pending', False),
+            build_pod_event('MODIFIED', str(uuid4()), 'Running', True),
+            build_pod_event('MODIFIED', juju_unit, 'Running', False),
+            build_pod_event('MODIFIED', juju_unit, 'Running', True),
+        ]))
+
+        # Exercise
+        pod_statuses = list(k8s.watch_pod_status(
+            juju_model='lma',
+            juju_app='prometheus',
+            juju_unit=juju_unit,
+            resource_version='42'
+        ))
+
+        # Assert
+        assert [(s.is_running, s.is_ready) for s in pod_statuses] == [
+            (False, False),
+            (True, False),
+            (True, True),
+        ]
+        assert len(stub.paths) == 1
+        assert 'watch=true' in stub.paths[0]
+        assert 'labelSelector=juju-app=prometheus' in stub.paths[0]
+        assert 'resourceVersion=42' in stub.paths[0]
+
+    def test__it_only_watches_the_given_pod(self):
+        # Setup
+        stub = self.start_stub_server(watch_responder([]))
+
+        # Exercise
+        list(k8s.watch_pod_status(
+            juju_model='lma',
+            juju_app='prometheus',
+            juju_unit='prometheus/0',
+            pod_name='prometheus-0'
+        ))
+
+        # Assert
+        assert 'fieldSelector=metadata.name=prometheus-0' in stub.paths[0]
+
+    def test__it_reports_a_deleted_pod_as_unknown(self):
+        # Setup
+        juju_unit = str(uuid4())
+        self.start_stub_server(watch_responder([
+            build_pod_event('DELETED', juju_unit, 'Running', False),
+        ]))
+
+        # Exercise
+        pod_statuses = list(k8s.watch_pod_status(
+            juju_model='lma',
+            juju_app='prometheus',
+            juju_unit=juju_unit
+        ))
+
+        # Assert
+        assert len(pod_statuses) == 1
+        assert pod_statuses[0].is_unknown
+
+    def test__it_raises_on_watch_error_events(self):
+        # Setup
+        self.start_stub_server(watch_responder([{
+            'type': 'ERROR',
+            'object': {
+                'kind': 'Status',
+                'code': 410,
+                'message': 'too old resource version'
+            }
+        }]))
+
+        # Exercise and assert
+        with self.assertRaises(KubernetesAPIError):
+            list(k8s.watch_pod_status(
+                juju_model='lma',
+                juju_app='prometheus',
+                juju_unit=str(uuid4())
+            ))
+
+    def test__it_raises_if_the_api_server_rejects_the_watch(self):
+        # Setup
+        self.start_stub_server(watch_responder([], status=403))
+
+        # Exercise and assert
+        with self.assertRaises(KubernetesAPIError):
+            list(k8s.watch_pod_status(
+                juju_model='lma',
+                juju_app='prometheus',
+                juju_unit=str(uuid4())
+            ))
+
+
+class APIServerTest(StubAPIServerTestCase):
+
+    def test__get__loads_json_string_successfully(self):
+        # Setup
+        mock_response_dict = {str(uuid4()): str(uuid4())}
+        self.start_stub_server(json_responder(mock_response_dict))
 
         # Exercise
         api_server = APIServer()
@@ -94,6 +471,307 @@ class APIServerTest(unittest.TestCase):
         # Assert
         assert response == mock_response_dict
 
+    def test__it_reuses_keep_alive_connections(self):
+        # Setup
+        stub = self.start_stub_server(json_responder({}))
+
+        # Exercise
+        for _ in range(3):
+            APIServer().get('/some/path')
+
+        # Assert
+        assert len(stub.requests) == 3
+        assert self.pool.stats == {
+            'connections_opened': 1,
+            'connections_reused': 2,
+        }
+
+    def test__it_reconnects_if_an_idle_connection_was_dropped(self):
+        # Setup
+        mock_response_dict = {str(uuid4()): str(uuid4())}
+        self.start_stub_server(
+            json_responder(mock_response_dict, keep_alive=False)
+        )
+
+        # Exercise
+        api_server = APIServer()
+        api_server.get('/some/path')
+        response = api_server.get('/some/path')
+
+        # Assert
+        assert response == mock_response_dict
+        assert self.pool.stats == {
+            'connections_opened': 2,
+            'connections_reused': 1,
+        }
+
+    def test__it_reloads_the_token_only_when_the_token_file_changes(self):
+        # Setup
+        stub = self.start_stub_server(json_responder({}))
+        api_server = APIServer()
+
+        # Exercise
+        with patch('adapters.k8s.open', create=True,
+                   side_effect=open) as mock_open:
+            api_server.get('/some/path')
+            api_server.get('/some/path')
+
+            new_token = str(uuid4())
+            with open(self.token_path, 'w') as token_file:
+                token_file.write(new_token)
+            token_mtime = os.stat(self.token_path).st_mtime
+            os.utime(self.token_path, (token_mtime + 1, token_mtime + 1))
+            api_server.get('/some/path')
+
+        # Assert
+        assert mock_open.call_count == 2
+        path, headers = stub.requests[-1]
+        assert headers['Authorization'] == 'Bearer {}'.format(new_token)
+
+    def test__get__requests_and_decompresses_gzip(self):
+        # Setup
+        mock_response_dict = {str(uuid4()): str(uuid4())}
+        stub = self.start_stub_server(json_responder(mock_response_dict))
+
+        # Exercise
+        response = APIServer().get('/some/path')
+
+        # Assert
+        assert response == mock_response_dict
+        path, headers = stub.requests[0]
+        assert headers['Accept-Encoding'] == 'gzip'
+
+    def test__list__pages_through_all_items(self):
+        # Setup
+        items = [{'metadata': {'name': str(i)}} for i in range(7)]
+        stub = self.start_stub_server(pod_list_responder(items))
+
+        # Exercise
+        listed = list(APIServer().list('/api/v1/pods?labelSelector=a=b',
+                                       limit=3))
+
+        # Assert
+        assert listed == items
+        assert stub.paths == [
+            '/api/v1/pods?labelSelector=a=b&limit=3',
+            '/api/v1/pods?labelSelector=a=b&limit=3&continue=3',
+            '/api/v1/pods?labelSelector=a=b&limit=3&continue=6',
+        ]
+        assert self.pool.stats == {
+            'connections_opened': 1,
+            'connections_reused': 2,
+        }
+
+    def test__list__does_not_fetch_more_pages_than_needed(self):
+        # Setup
+        items = [{'metadata': {'name': str(i)}} for i in range(7)]
+        stub = self.start_stub_server(pod_list_responder(items))
+
+        # Exercise
+        listed = APIServer().list('/api/v1/pods', limit=3)
+        first_item = next(listed)
+        listed.close()
+
+        # Assert
+        assert first_item == items[0]
+        assert stub.paths == ['/api/v1/pods?limit=3']
+
+    def test__list__raises_on_api_errors(self):
+        # Setup
+        self.start_stub_server(json_responder({
+            'kind': 'Status',
+            'code': 410,
+            'reason': 'Expired'
+        }, status=410))
+
+        # Exercise and assert
+        with self.assertRaises(KubernetesAPIError):
+            list(APIServer().list('/api/v1/pods'))
+
+    def test__it_raises_if_the_api_server_hangs_up(self):
+        # Setup
+        def hang_up(handler):
+            handler.close_connection = True
+        self.start_stub_server(hang_up)
+
+        # Exercise and assert
+        with self.assertRaises(KubernetesAPIError):
+            APIServer().get('/some/path')
+        with self.assertRaises(KubernetesAPIError):
+            list(APIServer().list('/api/v1/pods'))
+
+    def test__it_raises_if_the_body_is_not_json(self):
+        # Setup
+        def respond_with_html(handler):
+            body = b'<html>Bad Gateway</html>'
+            handler.send_response(200)
+            handler.send_header('Content-Length', str(len(body)))
+            handler.end_headers()
+            handler.wfile.write(body)
+        self.start_stub_server(respond_with_html)
+
+        # Exercise and assert
+        with self.assertRaises(KubernetesAPIError):
+            APIServer().get('/some/path')
+        with self.assertRaises(KubernetesAPIError):
+            list(APIServer().list('/api/v1/pods'))
+
+    @patch('adapters.k8s.http.client.HTTPSConnection',
+           autospec=True, spec_set=True)
+    def test__it_caches_the_ssl_context(self, mock_https_connection_cls):
+        # Exercise
+        self.pool.acquire()
+        self.pool.acquire()
+
+        # Assert
+        assert k8s.ssl.SSLContext.call_count == 1
+        assert mock_https_connection_cls.call_count == 2
+
+    def test__it_records_each_request_by_path_template(self):
+        # Setup
+        payload = {str(uuid4()): str(uuid4())}
+        self.start_stub_server(json_responder(payload))
+        metrics = RequestMetrics()
+
+        # Exercise
+        api_server = APIServer(metrics=metrics)
+        api_server.get('/api/v1/namespaces/foo/pods/foo-0')
+        api_server.get('/api/v1/namespaces/bar/pods/bar-1')
+
+        # Assert
+        recorded = metrics.to_dict()
+        assert list(recorded.keys()) == [
+            'kubernetes\tGET\t/api/v1/namespaces/{namespace}/pods/{name}'
+            '\t200'
+        ]
+        series = list(recorded.values())[0]
+        assert series['count'] == 2
+        assert series['retries'] == 0
+        assert series['bytes_received'] == \
+            2 * len(gzip.compress(json.dumps(payload).encode()))
+        assert series['latency_sum'] > 0
+
+    def test__it_records_retried_requests(self):
+        # Setup
+        self.start_stub_server(json_responder({}, keep_alive=False))
+        metrics = RequestMetrics()
+
+        # Exercise
+        api_server = APIServer(metrics=metrics)
+        api_server.get('/some/path')
+        api_server.get('/some/path')
+
+        # Assert
+        series = metrics.to_dict()['kubernetes\tGET\t/some/path\t200']
+        assert series['count'] == 2
+        assert series['retries'] == 1
+
+    def test__it_records_each_page_of_a_list(self):
+        # Setup
+        items = [{'metadata': {'name': str(i)}} for i in range(7)]
+        self.start_stub_server(pod_list_responder(items))
+        metrics = RequestMetrics()
+
+        # Exercise
+        list(APIServer(metrics=metrics).list(
+            '/api/v1/namespaces/foo/pods?labelSelector=a=b', limit=3
+        ))
+
+        # Assert
+        series = metrics.to_dict()[
+            'kubernetes\tGET\t/api/v1/namespaces/{namespace}/pods\t200'
+        ]
+        assert series['count'] == 3
+        assert series['bytes_received'] > 0
+
+
+class PathTemplateTest(unittest.TestCase):
+
+    def test__it_replaces_the_namespace_and_object_name(self):
+        assert path_template('/api/v1/namespaces/foo/pods/foo-0') == \
+            '/api/v1/namespaces/{namespace}/pods/{name}'
+
+    def test__it_keeps_subresources(self):
+        assert path_template('/api/v1/namespaces/foo/pods/foo-0/log') == \
+            '/api/v1/namespaces/{namespace}/pods/{name}/log'
+
+    def test__it_drops_the_query_string_but_tells_watches_apart(self):
+        assert path_template(
+            '/api/v1/namespaces/foo/pods?labelSelector=a=b&limit=3'
+        ) == '/api/v1/namespaces/{namespace}/pods'
+        assert path_template(
+            '/api/v1/namespaces/foo/pods?labelSelector=a=b&watch=true'
+        ) == '/api/v1/namespaces/{namespace}/pods?watch=true'
+
+
+class JSONObjectStreamTest(unittest.TestCase):
+
+    def test__it_yields_top_level_keys_and_each_item(self):
+        # Setup
+        pod_list = {
+            'kind': 'PodList',
+            'metadata': {
+                'continue': str(uuid4()),
+                'remainingItemCount': 12345
+            },
+            'items': [
+                {'metadata': {'name': str(uuid4()), 'uid': 10}},
+                {'metadata': {'name': 'p\u00f8d \\ "quoted" ]}'}},
+                {'spec': {'containers': [{'ports': [9090, 443]}]}},
+            ],
+            'count': 1234567
+        }
+        stream = io.BytesIO(json.dumps(pod_list, indent=1).encode())
+
+        # Exercise with the smallest possible chunks so that every token
+        # is split across reads.
+        decoded = list(JSONObjectStream(stream, chunk_size=1))
+
+        # Assert
+        assert decoded == [
+            ('kind', 'PodList'),
+            ('metadata', pod_list['metadata']),
+            ('items', pod_list['items'][0]),
+            ('items', pod_list['items'][1]),
+            ('items', pod_list['items'][2]),
+            ('count', 1234567),
+        ]
+
+    def test__it_handles_empty_objects_and_lists(self):
+        assert list(JSONObjectStream(io.BytesIO(b' { } '))) == []
+        assert list(JSONObjectStream(io.BytesIO(b'{"items": []}'))) == []
+        assert list(JSONObjectStream(io.BytesIO(b'{"items": null}'))) == [
+            ('items', None)
+        ]
+
+    def test__it_decodes_items_lazily(self):
+        # Setup
+        class CountingStream(io.BytesIO):
+            bytes_read = 0
+
+            def read(self, size=-1):
+                chunk = super().read(size)
+                self.bytes_read += len(chunk)
+                return chunk
+
+        payload = json.dumps({
+            'items': [{'n': i, 'pad': 'x' * 100} for i in range(100)]
+        }).encode()
+        stream = CountingStream(payload)
+
+        # Exercise
+        first_key, first_item = next(iter(
+            JSONObjectStream(stream, chunk_size=256)
+        ))
+
+        # Assert
+        assert first_item['n'] == 0
+        assert stream.bytes_read < len(payload) / 10
+
+    def test__it_raises_on_truncated_streams(self):
+        with self.assertRaises(ValueError):
+            list(JSONObjectStream(io.BytesIO(b'{"items": [{"a": 1}')))
+
 
 class PodStatusTest(unittest.TestCase):
 
@@ -180,3 +858,135 @@ class PodStatusTest(unittest.TestCase):
         assert pod_status.is_unknown
         assert not pod_status.is_running
         assert not pod_status.is_ready
+
+    def test__it_snapshots_the_pod_without_keeping_the_raw_dict(self):
+        # Setup
+        status_dict = {
+            'metadata': {
+                'name': 'prometheus-0',
+                'resourceVersion': '1234',
+                'annotations': {
+                    'juju.io/unit': 'prometheus/0'
+                }
+            },
+            'status': {
+                'phase': 'Running',
+                'conditions': [{
+                    'type': 'ContainersReady',
+                    'status': 'True'
+                }],
+                'containerStatuses': [{
+                    'name': 'prometheus',
+                    'ready': True,
+                    'restartCount': 2,
+                    'state': {
+                        'running': {
+                            'startedAt': '2020-07-10T10:00:00Z'
+                        }
+                    }
+                }, {
+                    'name': 'prometheus-nginx',
+                    'ready': False,
+                    'restartCount': 1,
+                    'state': {
+                        'waiting': {
+                            'reason': 'ContainerCreating'
+                        }
+                    }
+                }]
+            }
+        }
+
+        # Exercise
+        pod_status = PodStatus(status_dict=status_dict, keep_raw=False)
+
+        # Assert
+        assert not hasattr(pod_status, '__dict__')
+        assert pod_status.raw_status is None
+        assert pod_status.pod_name == 'prometheus-0'
+        assert pod_status.unit_name == 'prometheus/0'
+        assert pod_status.resource_version == '1234'
+        assert pod_status.phase == 'Running'
+        assert pod_status.is_ready
+        assert pod_status.restart_count == 3
+        assert pod_status.container_statuses == (
+            k8s.ContainerStatus(name='prometheus', ready=True,
+                                restart_count=2, state='running',
+                                reason=None),
+            k8s.ContainerStatus(name='prometheus-nginx', ready=False,
+                                restart_count=1, state='waiting',
+                                reason='ContainerCreating'),
+        )
+
+    def test__it_keeps_the_raw_dict_when_debugging(self):
+        # Setup
+        status_dict = {
+            'status': {
+                'phase': 'Pending'
+            }
+        }
+
+        # Exercise
+        pod_status = PodStatus(status_dict=status_dict, keep_raw=True)
+
+        # Assert
+        assert pod_status.raw_status is status_dict
+
+    def test__it_detects_containers_that_will_not_recover(self):
+        for state, restart_count in [
+            ({'waiting': {'reason': 'CrashLoopBackOff'}}, 5),
+            ({'waiting': {'reason': 'ErrImagePull'}}, 0),
+            ({'waiting': {'reason': 'ImagePullBackOff'}}, 0),
+            ({'terminated': {'reason': 'Error'}}, 3),
+        ]:
+            # Setup
+            status_dict = {
+                'status': {
+                    'phase': 'Running',
+                    'containerStatuses': [{
+                        'name': 'prometheus',
+                        'restartCount': 0,
+                        'state': {'running': {}}
+                    }, {
+                        'name': 'prometheus-nginx',
+                        'restartCount': restart_count,
+                        'state': state
+                    }]
+                }
+            }
+
+            # Exercise
+            pod_status = PodStatus(status_dict=status_dict)
+
+            # Assert
+            assert pod_status.is_failed
+            reason = list(state.values())[0]['reason']
+            assert pod_status.failure_reason == \
+                'prometheus-nginx: {} (restarts: {})'.format(reason,
+                                                             restart_count)
+
+    def test__it_does_not_flag_containers_that_are_still_starting(self):
+        for state, restart_count in [
+            ({'waiting': {'reason': 'ContainerCreating'}}, 0),
+            ({'terminated': {'reason': 'Error'}}, 1),
+            ({'terminated': {'reason': 'Completed'}}, 5),
+            ({'running': {}}, 5),
+        ]:
+            # Setup
+            status_dict = {
+                'status': {
+                    'phase': 'Pending',
+                    'containerStatuses': [{
+                        'name': 'prometheus',
+                        'restartCount': restart_count,
+                        'state': state
+                    }]
+                }
+            }
+
+            # Exercise
+            pod_status = PodStatus(status_dict=status_dict)
+
+            # Assert
+            assert not pod_status.is_failed
+            assert pod_status.failure_reason is None
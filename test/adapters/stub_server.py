@@ -0,0 +1,124 @@
+from http.server import (
+    BaseHTTPRequestHandler,
+    HTTPServer,
+)
+from socketserver import ThreadingMixIn
+import gzip
+import http.client
+import json
+import threading
+import time
+import urllib.parse
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    block_on_close = False
+
+
+class StubHTTPServer:
+    """
+    A local HTTP/1.1 server standing in for the k8s API server or Prometheus.
+    Every request is recorded and then answered by the given responder. It
+    also keeps track of how many requests it was handling at the same time.
+    """
+
+    def __init__(self, respond):
+        stub = self
+        self.requests = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._lock = threading.Lock()
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                with stub._lock:
+                    stub.requests.append((self.path, dict(self.headers)))
+                    stub.in_flight += 1
+                    stub.max_in_flight = max(stub.max_in_flight,
+                                             stub.in_flight)
+                try:
+                    respond(self)
+                finally:
+                    with stub._lock:
+                        stub.in_flight -= 1
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self._thread = threading.Thread(target=self._server.serve_forever,
+                                        kwargs={'poll_interval': 0.01})
+
+    @property
+    def port(self):
+        return self._server.server_port
+
+    @property
+    def paths(self):
+        return [path for path, headers in self.requests]
+
+    def connect(self, host, context=None, timeout=None):
+        return http.client.HTTPConnection(
+            '127.0.0.1', self.port, timeout=timeout
+        )
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+
+
+def json_responder(body, keep_alive=True, status=200, delay=0,
+                   chunked=False):
+    def respond(handler):
+        time.sleep(delay)
+        payload = json.dumps(body).encode()
+        handler.send_response(status)
+        handler.send_header('Content-Type', 'application/json')
+        if 'gzip' in handler.headers.get('Accept-Encoding', ''):
+            payload = gzip.compress(payload)
+            handler.send_header('Content-Encoding', 'gzip')
+        if chunked:
+            handler.send_header('Transfer-Encoding', 'chunked')
+            handler.end_headers()
+            for i in range(0, len(payload), 7):
+                chunk = payload[i:i + 7]
+                handler.wfile.write(b'%x\r\n%s\r\n' % (len(chunk), chunk))
+            handler.wfile.write(b'0\r\n\r\n')
+        else:
+            handler.send_header('Content-Length', str(len(payload)))
+            handler.end_headers()
+            handler.wfile.write(payload)
+        # Simulates the API server silently dropping an idle connection
+        handler.close_connection = not keep_alive
+    return respond
+
+
+def pod_list_responder(items):
+    """
+    Pages through the given items the way the API server does, honoring the
+    limit and continue query parameters.
+    """
+    def respond(handler):
+        url = urllib.parse.urlparse(handler.path)
+        query = urllib.parse.parse_qs(url.query)
+        limit = int(query['limit'][0])
+        start = int(query.get('continue', ['0'])[0])
+        page = items[start:start + limit]
+        metadata = {'resourceVersion': '1'}
+        if start + limit < len(items):
+            metadata['continue'] = str(start + limit)
+        json_responder({
+            'kind': 'PodList',
+            'apiVersion': 'v1',
+            'metadata': metadata,
+            'items': page
+        })(handler)
+    return respond
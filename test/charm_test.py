@@ -1,3 +1,4 @@
+import concurrent.futures
 import json
 import sys
 import unittest
@@ -9,20 +10,32 @@ from unittest.mock import (
 from uuid import uuid4
 
 sys.path.append('lib')
+from ops.charm import (
+    ActionEvent,
+)
 from ops.framework import (
     EventBase,
+    Handle,
 )
 from ops.model import (
     ActiveStatus,
+    BlockedStatus,
     MaintenanceStatus,
 )
 sys.path.append('src')
 from adapters import (
+    aio,
     framework,
     k8s,
 )
 import charm
 import domain
+from domain_test import get_default_charm_config
+from exceptions import (
+    CharmError,
+    KubernetesAPIError,
+)
+import instrumentation
 
 
 # This test is disabled due to the:
@@ -77,6 +90,37 @@ import domain
 #         # ]
 
 
+def create_mock_state():
+    mock_state = create_autospec(charm.StoredState).return_value
+    mock_state.pod_spec_inputs_digest = None
+    mock_state.pod_spec_digest = None
+    mock_state.pod_spec_cache_hits = 0
+    mock_state.pod_spec_cache_misses = 0
+    mock_state.config_reload = {}
+    mock_state.alerting_config = {}
+    mock_state.generation = 0
+    mock_state.deferred_generations = {}
+    return mock_state
+
+
+def create_future(result):
+    future = concurrent.futures.Future()
+    future.set_result(result)
+    return future
+
+
+def create_lookup(result):
+    mock_client = create_autospec(aio.AsyncHTTPClient,
+                                  spec_set=True).return_value
+    return mock_client, create_future(result)
+
+
+def create_mock_event():
+    mock_event = create_autospec(EventBase).return_value
+    mock_event.handle = Handle(None, 'config_changed', str(uuid4()))
+    return mock_event
+
+
 class BuildJujuUnitStatusTest(unittest.TestCase):
 
     def test_returns_maintenance_status_if_pod_status_cannot_be_fetched(self):
@@ -164,8 +208,211 @@ class BuildJujuUnitStatusTest(unittest.TestCase):
         # Assertions
         assert type(juju_unit_status) == ActiveStatus
 
+    def test_returns_blocked_status_if_a_container_is_crash_looping(self):
+        # Setup
+        status_dict = {
+            'status': {
+                'phase': 'Running',
+                'conditions': [{
+                    'type': 'ContainersReady',
+                    'status': 'False'
+                }],
+                'containerStatuses': [{
+                    'name': 'prometheus',
+                    'restartCount': 4,
+                    'state': {
+                        'waiting': {
+                            'reason': 'CrashLoopBackOff'
+                        }
+                    }
+                }]
+            }
+        }
+        pod_status = k8s.PodStatus(status_dict=status_dict)
+
+        # Exercise
+        juju_unit_status = charm.build_juju_unit_status(pod_status)
+
+        # Assertions
+        assert type(juju_unit_status) == BlockedStatus
+        assert juju_unit_status.message == \
+            "Pod is failing: prometheus: CrashLoopBackOff (restarts: 4)"
+
+
+class BuildJujuAppStatusTest(unittest.TestCase):
+
+    def build_pod_status(self, phase='Running', ready=True,
+                         waiting_reason=None):
+        status_dict = {
+            'status': {
+                'phase': phase,
+                'conditions': [{
+                    'type': 'ContainersReady',
+                    'status': str(ready)
+                }],
+            }
+        }
+        if waiting_reason:
+            status_dict['status']['containerStatuses'] = [{
+                'name': 'prometheus',
+                'restartCount': 0,
+                'state': {
+                    'waiting': {
+                        'reason': waiting_reason
+                    }
+                }
+            }]
+        return k8s.PodStatus(status_dict=status_dict)
+
+    def test__it_waits_for_pods_to_appear(self):
+        # Exercise
+        app_status = charm.build_juju_app_status({})
+
+        # Assert
+        assert type(app_status) == MaintenanceStatus
+
+    def test__it_counts_ready_pods(self):
+        # Setup
+        pod_statuses = {
+            'prometheus/0': self.build_pod_status(),
+            'prometheus/1': self.build_pod_status(ready=False),
+            'prometheus/2': self.build_pod_status(phase='Pending',
+                                                  ready=False),
+        }
+
+        # Exercise
+        app_status = charm.build_juju_app_status(pod_statuses)
+
+        # Assert
+        assert type(app_status) == MaintenanceStatus
+        assert app_status.message == "1/3 pods ready"
+
+    def test__it_is_active_when_all_pods_are_ready(self):
+        # Setup
+        pod_statuses = {
+            'prometheus/0': self.build_pod_status(),
+            'prometheus/1': self.build_pod_status(),
+        }
+
+        # Exercise
+        app_status = charm.build_juju_app_status(pod_statuses)
+
+        # Assert
+        assert type(app_status) == ActiveStatus
+
+    def test__it_is_blocked_when_pods_are_failing(self):
+        # Setup
+        pod_statuses = {
+            'prometheus/0': self.build_pod_status(),
+            'prometheus/1': self.build_pod_status(
+                phase='Pending', ready=False, waiting_reason='ErrImagePull'
+            ),
+        }
+
+        # Exercise
+        app_status = charm.build_juju_app_status(pod_statuses)
+
+        # Assert
+        assert type(app_status) == BlockedStatus
+        assert app_status.message == \
+            "1/2 pods failing, prometheus/1: " \
+            "prometheus: ErrImagePull (restarts: 0)"
+
+
+class UpdateJujuAppStatusTest(unittest.TestCase):
+
+    @patch('charm.aio', spec_set=True, autospec=True)
+    def test__it_reports_the_app_status_from_a_single_lookup(
+            self,
+            mock_aio_mod):
+        # Setup
+        mock_fw = create_autospec(framework.FrameworkAdapter,
+                                  spec_set=True).return_value
+        mock_fw.unit_is_leader.return_value = True
+        mock_aio_mod.run_in_background.return_value = create_future([{}])
+
+        # Exercise
+        charm.update_juju_app_status(mock_fw)
+
+        # Assert
+        assert mock_aio_mod.run_in_background.call_count == 1
+        (lookups,), kwargs = mock_aio_mod.run_in_background.call_args
+        lookup, = lookups
+        lookup().close()
+        assert mock_aio_mod.get_app_pod_statuses.call_args == call(
+            mock_aio_mod.kubernetes_client.return_value,
+            mock_fw.get_model_name.return_value,
+            mock_fw.get_app_name.return_value
+        )
+        assert mock_fw.set_app_status.call_count == 1
+        # Recorded on the main thread once the LIST is done
+        assert mock_aio_mod.kubernetes_client.return_value.record_requests \
+            .call_count == 1
+
+    @patch('charm.aio', spec_set=True, autospec=True)
+    def test__it_uses_a_lookup_that_is_already_in_flight(
+            self,
+            mock_aio_mod):
+        # Setup
+        mock_fw = create_autospec(framework.FrameworkAdapter,
+                                  spec_set=True).return_value
+        mock_fw.unit_is_leader.return_value = True
+
+        # Exercise
+        charm.update_juju_app_status(mock_fw, create_lookup([{}]))
+
+        # Assert
+        assert mock_aio_mod.run_in_background.call_count == 0
+        assert mock_fw.set_app_status.call_count == 1
+
+    @patch('charm.aio', spec_set=True, autospec=True)
+    def test__it_leaves_the_app_status_to_the_leader(self, mock_aio_mod):
+        # Setup
+        mock_fw = create_autospec(framework.FrameworkAdapter,
+                                  spec_set=True).return_value
+        mock_fw.unit_is_leader.return_value = False
+
+        # Exercise
+        app_pod_statuses = charm.look_up_app_pod_statuses(mock_fw)
+        charm.update_juju_app_status(mock_fw, app_pod_statuses)
+
+        # Assert
+        assert app_pod_statuses is None
+        assert mock_aio_mod.run_in_background.call_count == 0
+        assert mock_fw.set_app_status.call_count == 0
+
+    def test__it_keeps_the_app_status_if_the_lookup_fails(self):
+        # Setup
+        mock_fw = create_autospec(framework.FrameworkAdapter,
+                                  spec_set=True).return_value
+        mock_fw.unit_is_leader.return_value = True
+        app_pod_statuses = create_lookup([KubernetesAPIError(str(uuid4()))])
+
+        # Exercise
+        with self.assertLogs(level='WARNING'):
+            charm.update_juju_app_status(mock_fw, app_pod_statuses)
+
+        # Assert
+        assert mock_fw.set_app_status.call_count == 0
+
+    def test__it_raises_unexpected_lookup_errors(self):
+        # Setup
+        mock_fw = create_autospec(framework.FrameworkAdapter,
+                                  spec_set=True).return_value
+        mock_fw.unit_is_leader.return_value = True
+        app_pod_statuses = create_lookup([ValueError(str(uuid4()))])
+
+        # Exercise
+        with self.assertRaises(ValueError):
+            charm.update_juju_app_status(mock_fw, app_pod_statuses)
+
+        # Assert
+        assert mock_fw.set_app_status.call_count == 0
+
 
 class OnConfigChangedHandlerTest(unittest.TestCase):
+    @patch('charm.look_up_app_pod_statuses', spec_set=True, autospec=True)
+    @patch('charm.update_juju_app_status', spec_set=True, autospec=True)
     @patch('charm.set_juju_pod_spec', spec_set=True, autospec=True)
     @patch('charm.wait_for_pod_readiness', spec_set=True, autospec=True)
     @patch('charm.ensure_config_is_reloaded', spec_set=True, autospec=True)
@@ -173,32 +420,373 @@ class OnConfigChangedHandlerTest(unittest.TestCase):
         self,
         mock_ensure_config_is_reloaded,
         mock_wait_for_pod_readiness_func,
-        mock_set_juju_pod_spec
+        mock_set_juju_pod_spec,
+        mock_update_juju_app_status,
+        mock_look_up_app_pod_statuses
     ):
         # Setup
         mock_fw_adapter_cls = \
             create_autospec(framework.FrameworkAdapter, spec_set=True)
         mock_fw = mock_fw_adapter_cls.return_value
 
-        mock_event_cls = create_autospec(EventBase)
-        mock_event = mock_event_cls.return_value
-
-        mock_state_cls = \
-            create_autospec(charm.StoredState, spec_set=True)
-        mock_state = mock_state_cls.return_value
+        mock_event = create_mock_event()
+        mock_state = create_mock_state()
 
         mock_set_juju_pod_spec.return_value = False
+        mock_state.readiness_deadline = 12345
 
         charm.on_config_changed_handler(mock_event, mock_fw, mock_state)
 
         assert mock_wait_for_pod_readiness_func.call_count == 0
         assert mock_ensure_config_is_reloaded.call_count == 0
+        assert mock_state.readiness_deadline is None
 
         mock_set_juju_pod_spec.return_value = True
+        mock_ensure_config_is_reloaded.return_value = True
         charm.on_config_changed_handler(mock_event, mock_fw, mock_state)
 
         assert mock_wait_for_pod_readiness_func.call_count == 1
         assert mock_ensure_config_is_reloaded.call_count == 1
+        assert mock_event.defer.call_count == 0
+        # The app pod LIST was in flight while the reload was stepped
+        assert mock_update_juju_app_status.call_args == call(
+            mock_fw, mock_look_up_app_pod_statuses.return_value
+        )
+
+        # The reload has yet to converge
+        mock_ensure_config_is_reloaded.return_value = False
+        charm.on_config_changed_handler(mock_event, mock_fw, mock_state)
+
+        assert mock_event.defer.call_count == 1
+
+    @patch('charm.look_up_app_pod_statuses', spec_set=True, autospec=True)
+    @patch('charm.update_juju_app_status', spec_set=True, autospec=True)
+    @patch('charm.set_juju_pod_spec', spec_set=True, autospec=True)
+    @patch('charm.wait_for_pod_readiness', spec_set=True, autospec=True)
+    @patch('charm.ensure_config_is_reloaded', spec_set=True, autospec=True)
+    def test__it_defers_if_the_pod_is_not_ready_within_the_budget(
+        self,
+        mock_ensure_config_is_reloaded,
+        mock_wait_for_pod_readiness_func,
+        mock_set_juju_pod_spec,
+        mock_update_juju_app_status,
+        mock_look_up_app_pod_statuses
+    ):
+        # Setup
+        mock_fw = create_autospec(framework.FrameworkAdapter,
+                                  spec_set=True).return_value
+        mock_event = create_mock_event()
+        mock_state = create_mock_state()
+
+        mock_set_juju_pod_spec.return_value = True
+        mock_wait_for_pod_readiness_func.return_value = False
+
+        # Exercise: budget spent but deadline still ahead
+        mock_state.readiness_deadline = 12345
+        charm.on_config_changed_handler(mock_event, mock_fw, mock_state)
+
+        # Assert
+        assert mock_ensure_config_is_reloaded.call_count == 0
+        assert mock_event.defer.call_count == 1
+
+        # Exercise: deadline passed
+        mock_state.readiness_deadline = None
+        charm.on_config_changed_handler(mock_event, mock_fw, mock_state)
+
+        # Assert
+        assert mock_ensure_config_is_reloaded.call_count == 0
+        assert mock_event.defer.call_count == 1
+
+
+class EventCoalescingTest(unittest.TestCase):
+
+    def test__fresh_events_claim_new_generations(self):
+        # Setup
+        mock_state = create_mock_state()
+
+        # Exercise
+        generations = [
+            charm.claim_generation(create_mock_event(), mock_state)
+            for _ in range(3)
+        ]
+
+        # Assert
+        assert generations == [1, 2, 3]
+        assert mock_state.generation == 3
+
+    def test__a_deferred_event_keeps_its_generation(self):
+        # Setup
+        mock_state = create_mock_state()
+        mock_event = create_mock_event()
+        generation = charm.claim_generation(mock_event, mock_state)
+        charm.defer_generation(mock_event, mock_state, generation)
+
+        # Exercise
+        reclaimed = charm.claim_generation(mock_event, mock_state)
+
+        # Assert
+        assert reclaimed == generation
+        assert mock_state.generation == generation
+        assert mock_event.defer.call_count == 1
+        assert mock_state.deferred_generations == {}
+
+    def test__a_superseded_deferred_event_is_dropped(self):
+        # Setup
+        mock_state = create_mock_state()
+        mock_event = create_mock_event()
+        generation = charm.claim_generation(mock_event, mock_state)
+        charm.defer_generation(mock_event, mock_state, generation)
+        charm.claim_generation(create_mock_event(), mock_state)
+
+        # Exercise
+        with self.assertLogs(level='DEBUG'):
+            reclaimed = charm.claim_generation(mock_event, mock_state)
+
+        # Assert
+        assert reclaimed is None
+        assert mock_state.deferred_generations == {}
+
+    @patch('charm.look_up_app_pod_statuses', spec_set=True, autospec=True)
+    @patch('charm.update_juju_app_status', spec_set=True, autospec=True)
+    @patch('charm.set_juju_pod_spec', spec_set=True, autospec=True)
+    @patch('charm.wait_for_pod_readiness', spec_set=True, autospec=True)
+    @patch('charm.ensure_config_is_reloaded', spec_set=True, autospec=True)
+    def test__a_burst_of_changes_leaves_one_deferred_event(
+        self,
+        mock_ensure_config_is_reloaded,
+        mock_wait_for_pod_readiness_func,
+        mock_set_juju_pod_spec,
+        mock_update_juju_app_status,
+        mock_look_up_app_pod_statuses
+    ):
+        # Setup
+        mock_fw = create_autospec(framework.FrameworkAdapter,
+                                  spec_set=True).return_value
+        mock_state = create_mock_state()
+        mock_set_juju_pod_spec.return_value = True
+        mock_wait_for_pod_readiness_func.return_value = True
+        mock_ensure_config_is_reloaded.return_value = False
+
+        # Exercise: every hook re-emits the deferred events first
+        deferred = []
+        for _ in range(3):
+            for mock_event in list(deferred):
+                mock_event.defer.reset_mock()
+                charm.on_config_changed_handler(mock_event, mock_fw,
+                                                mock_state)
+                if not mock_event.defer.called:
+                    deferred.remove(mock_event)
+
+            mock_event = create_mock_event()
+            charm.on_config_changed_handler(mock_event, mock_fw, mock_state)
+            deferred.append(mock_event)
+
+        mock_set_juju_pod_spec.reset_mock()
+        for mock_event in list(deferred):
+            charm.on_config_changed_handler(mock_event, mock_fw, mock_state)
+
+        # Assert: only the newest of the deferred events did any work
+        assert len(deferred) == 2
+        assert mock_set_juju_pod_spec.call_count == 1
+        assert list(mock_state.deferred_generations.values()) == [3]
+
+
+class EnsureConfigIsReloadedTest(unittest.TestCase):
+
+    def setUp(self):
+        self.mock_fw = create_autospec(framework.FrameworkAdapter,
+                                       spec_set=True).return_value
+        self.mock_fw.get_config.return_value = get_default_charm_config()
+        self.mock_fw.get_model_name.return_value = 'juju-model'
+        self.mock_fw.get_app_name.return_value = 'juju-app'
+        self.mock_state = create_mock_state()
+        self.fingerprint = domain.build_prometheus_config(
+            get_default_charm_config()
+        ).fingerprint
+
+    @patch('charm.ConfigReload.step', spec_set=True, autospec=True)
+    def test__it_adopts_the_config_prometheus_started_with(
+            self, mock_step):
+        # Exercise
+        settled = charm.ensure_config_is_reloaded(self.mock_fw,
+                                                  self.mock_state)
+
+        # Assert
+        assert self.mock_state.config_reload['phase'] == \
+            domain.RELOAD_CONVERGED
+        assert self.mock_state.config_reload['fingerprint'] == \
+            self.fingerprint
+        assert mock_step.call_count == 0
+        assert settled
+
+    @patch('charm.ConfigReload.step', spec_set=True, autospec=True)
+    def test__it_blocks_the_unit_if_the_config_is_invalid(self, mock_step):
+        # Setup
+        self.mock_fw.get_config.return_value = dict(
+            get_default_charm_config(),
+            **{'scrape-interval': str(uuid4())}
+        )
+
+        # Exercise
+        settled = charm.ensure_config_is_reloaded(self.mock_fw,
+                                                  self.mock_state)
+
+        # Assert
+        assert settled
+        assert self.mock_state.config_reload == {}
+        assert mock_step.call_count == 0
+        args, kwargs = self.mock_fw.set_unit_status.call_args
+        assert type(args[0]) == BlockedStatus
+
+    @patch('charm.ConfigReload.step', spec_set=True, autospec=True)
+    def test__it_starts_a_reload_when_the_config_changes(self, mock_step):
+        # Setup
+        self.mock_state.config_reload = {
+            'phase': domain.RELOAD_CONVERGED,
+            'fingerprint': 'stale',
+            'attempts': 0,
+            'not_before': 0,
+        }
+
+        # Exercise
+        settled = charm.ensure_config_is_reloaded(self.mock_fw,
+                                                  self.mock_state)
+
+        # Assert
+        assert self.mock_state.config_reload['phase'] == \
+            domain.RELOAD_PENDING_PROPAGATION
+        assert self.mock_state.config_reload['fingerprint'] == \
+            self.fingerprint
+        assert mock_step.call_count == 0
+        assert not settled
+        args, kwargs = self.mock_fw.set_unit_status.call_args
+        assert type(args[0]) == MaintenanceStatus
+
+    @patch('charm.ConfigReload.step', spec_set=True, autospec=True)
+    def test__it_advances_a_reload_in_progress(self, mock_step):
+        # Setup
+        self.mock_state.config_reload = {
+            'phase': domain.RELOAD_VERIFYING,
+            'fingerprint': self.fingerprint,
+            'attempts': 1,
+            'not_before': 0,
+        }
+
+        def converge(config_reload, *args):
+            config_reload.phase = domain.RELOAD_CONVERGED
+            return config_reload.phase
+        mock_step.side_effect = converge
+
+        # Exercise
+        settled = charm.ensure_config_is_reloaded(self.mock_fw,
+                                                  self.mock_state)
+
+        # Assert
+        assert mock_step.call_count == 1
+        args, kwargs = mock_step.call_args
+        assert args[1:3] == ('juju-model', 'juju-app')
+        assert args[3].fingerprint == self.fingerprint
+        assert self.mock_state.config_reload['phase'] == \
+            domain.RELOAD_CONVERGED
+        assert settled
+        assert self.mock_fw.set_unit_status.call_args == call(ActiveStatus())
+
+    @patch('charm.k8s', spec_set=True, autospec=True)
+    @patch('charm.ConfigReload.step', spec_set=True, autospec=True)
+    def test__it_hands_the_config_map_fingerprint_in_while_pending(
+            self, mock_step, mock_k8s_mod):
+        # Setup
+        self.mock_state.config_reload = {
+            'phase': domain.RELOAD_PENDING_PROPAGATION,
+            'fingerprint': self.fingerprint,
+        }
+        self.mock_state.config_map_name = None
+        mock_k8s_mod.get_config_map_file.return_value = (
+            'prometheus-config',
+            domain.build_prometheus_config(
+                get_default_charm_config()
+            ).yaml_dump()
+        )
+        mock_step.return_value = domain.RELOAD_PENDING_PROPAGATION
+
+        # Exercise
+        settled = charm.ensure_config_is_reloaded(self.mock_fw,
+                                                  self.mock_state)
+
+        # Assert
+        assert mock_k8s_mod.get_config_map_file.call_args == call(
+            juju_model='juju-model',
+            juju_app='juju-app',
+            file_name='prometheus.yml',
+            config_map_name=None
+        )
+        assert not settled
+        args, kwargs = mock_step.call_args
+        assert args[4] == self.fingerprint
+        assert self.mock_state.config_map_name == 'prometheus-config'
+
+    @patch('charm.k8s', spec_set=True, autospec=True)
+    def test__the_config_map_fingerprint_is_unknown_on_api_errors(
+            self, mock_k8s_mod):
+        # Setup
+        self.mock_state.config_map_name = None
+        mock_k8s_mod.get_config_map_file.side_effect = \
+            KubernetesAPIError('Forbidden')
+
+        # Exercise
+        with self.assertLogs(level='WARNING'):
+            fingerprint = charm.get_config_map_fingerprint(self.mock_fw,
+                                                           self.mock_state)
+
+        # Assert
+        assert fingerprint is None
+        assert self.mock_state.config_map_name is None
+
+    @patch('charm.ConfigReload.step', spec_set=True, autospec=True)
+    def test__it_retries_a_failed_reload(self, mock_step):
+        # Setup
+        self.mock_state.config_reload = {
+            'phase': domain.RELOAD_FAILED,
+            'fingerprint': self.fingerprint,
+            'attempts': 6,
+            'not_before': 0,
+        }
+        mock_step.return_value = domain.RELOAD_VERIFYING
+
+        # Exercise
+        settled = charm.ensure_config_is_reloaded(self.mock_fw,
+                                                  self.mock_state)
+
+        # Assert
+        assert not settled
+        assert mock_step.call_count == 1
+        assert self.mock_state.config_reload['phase'] == \
+            domain.RELOAD_RELOADING
+        assert self.mock_state.config_reload['attempts'] == 0
+
+    @patch('charm.ConfigReload.step', spec_set=True, autospec=True)
+    def test__it_blocks_once_the_reload_failed(self, mock_step):
+        # Setup
+        self.mock_state.config_reload = {
+            'phase': domain.RELOAD_VERIFYING,
+            'fingerprint': self.fingerprint,
+            'attempts': 6,
+            'not_before': 0,
+        }
+
+        def fail(config_reload, *args):
+            config_reload.phase = domain.RELOAD_FAILED
+            return config_reload.phase
+        mock_step.side_effect = fail
+
+        # Exercise
+        settled = charm.ensure_config_is_reloaded(self.mock_fw,
+                                                  self.mock_state)
+
+        # Assert
+        assert settled
+        args, kwargs = self.mock_fw.set_unit_status.call_args
+        assert type(args[0]) == BlockedStatus
 
 
 class WaitForPodReadinessTest(unittest.TestCase):
@@ -219,6 +807,9 @@ class WaitForPodReadinessTest(unittest.TestCase):
         mock_fw_adapter_cls = \
             create_autospec(framework.FrameworkAdapter, spec_set=True)
         mock_fw_adapter = mock_fw_adapter_cls.return_value
+        mock_state = create_autospec(charm.StoredState).return_value
+        mock_state.pod_name = None
+        mock_state.readiness_deadline = None
 
         mock_juju_unit_states = [
             MaintenanceStatus(str(uuid4())),
@@ -228,7 +819,7 @@ class WaitForPodReadinessTest(unittest.TestCase):
         mock_build_juju_unit_status_func.side_effect = mock_juju_unit_states
 
         # Exercise
-        charm.wait_for_pod_readiness(mock_fw_adapter)
+        charm.wait_for_pod_readiness(mock_fw_adapter, mock_state)
 
         # Assert
         assert mock_fw_adapter.set_unit_status.call_count == \
@@ -237,6 +828,504 @@ class WaitForPodReadinessTest(unittest.TestCase):
             call(status) for status in mock_juju_unit_states
         ]
 
+    @patch('charm.k8s', spec_set=True, autospec=True)
+    @patch('charm.time', spec_set=True, autospec=True)
+    def test__it_wakes_up_on_the_first_ready_watch_event(
+            self,
+            mock_time,
+            mock_k8s_mod):
+        # Setup
+        mock_fw_adapter_cls = \
+            create_autospec(framework.FrameworkAdapter, spec_set=True)
+        mock_fw_adapter = mock_fw_adapter_cls.return_value
+        mock_state = create_autospec(charm.StoredState).return_value
+        mock_state.pod_name = None
+        mock_state.readiness_deadline = None
+
+        mock_k8s_mod.get_pod_status.return_value = \
+            k8s.PodStatus(status_dict=None)
+        ready_status_dict = {
+            'status': {
+                'phase': 'Running',
+                'conditions': [{
+                    'type': 'ContainersReady',
+                    'status': 'True'
+                }]
+            }
+        }
+        mock_k8s_mod.watch_pod_status.return_value = iter([
+            k8s.PodStatus(status_dict=None),
+            k8s.PodStatus(status_dict=ready_status_dict),
+            k8s.PodStatus(status_dict=None),
+        ])
+
+        # Exercise
+        charm.wait_for_pod_readiness(mock_fw_adapter, mock_state)
+
+        # Assert
+        assert mock_k8s_mod.get_pod_status.call_count == 1
+        assert mock_k8s_mod.watch_pod_status.call_count == 1
+        assert mock_time.sleep.call_count == 0
+        assert mock_fw_adapter.set_unit_status.call_count == 3
+        args, kwargs = mock_fw_adapter.set_unit_status.call_args
+        assert type(args[0]) == ActiveStatus
+
+    @patch('charm.k8s', spec_set=True, autospec=True)
+    @patch('charm.time', spec_set=True, autospec=True)
+    def test__it_falls_back_to_polling_if_the_watch_fails(
+            self,
+            mock_time,
+            mock_k8s_mod):
+        # Setup
+        mock_fw_adapter_cls = \
+            create_autospec(framework.FrameworkAdapter, spec_set=True)
+        mock_fw_adapter = mock_fw_adapter_cls.return_value
+        mock_state = create_autospec(charm.StoredState).return_value
+        mock_state.pod_name = None
+        mock_state.readiness_deadline = None
+
+        ready_status_dict = {
+            'status': {
+                'phase': 'Running',
+                'conditions': [{
+                    'type': 'ContainersReady',
+                    'status': 'True'
+                }]
+            }
+        }
+        mock_k8s_mod.get_pod_status.side_effect = [
+            k8s.PodStatus(status_dict=None),
+            k8s.PodStatus(status_dict=ready_status_dict),
+        ]
+        mock_k8s_mod.watch_pod_status.side_effect = \
+            KubernetesAPIError(str(uuid4()))
+
+        # Exercise
+        charm.wait_for_pod_readiness(mock_fw_adapter, mock_state)
+
+        # Assert
+        assert mock_k8s_mod.get_pod_status.call_count == 2
+        assert mock_time.sleep.call_count == 1
+
+    @patch('charm.k8s', spec_set=True, autospec=True)
+    @patch('charm.time', spec_set=True, autospec=True)
+    def test__it_backs_off_if_the_pod_lookup_fails(
+            self,
+            mock_time,
+            mock_k8s_mod):
+        # Setup
+        mock_fw_adapter_cls = \
+            create_autospec(framework.FrameworkAdapter, spec_set=True)
+        mock_fw_adapter = mock_fw_adapter_cls.return_value
+        mock_state = create_autospec(charm.StoredState).return_value
+        mock_state.pod_name = None
+        mock_state.readiness_deadline = None
+
+        ready_status_dict = {
+            'status': {
+                'phase': 'Running',
+                'conditions': [{
+                    'type': 'ContainersReady',
+                    'status': 'True'
+                }]
+            }
+        }
+        mock_k8s_mod.get_pod_status.side_effect = [
+            KubernetesAPIError(str(uuid4())),
+            k8s.PodStatus(status_dict=ready_status_dict),
+        ]
+
+        # Exercise
+        ready = charm.wait_for_pod_readiness(mock_fw_adapter, mock_state)
+
+        # Assert
+        assert ready
+        assert mock_k8s_mod.get_pod_status.call_count == 2
+        assert mock_time.sleep.call_count == 1
+        assert mock_k8s_mod.watch_pod_status.call_count == 0
+
+    @patch('charm.k8s', spec_set=True, autospec=True)
+    @patch('charm.time', spec_set=True, autospec=True)
+    def test__it_remembers_the_pod_name_for_direct_lookups(
+            self,
+            mock_time,
+            mock_k8s_mod):
+        # Setup
+        mock_fw_adapter_cls = \
+            create_autospec(framework.FrameworkAdapter, spec_set=True)
+        mock_fw_adapter = mock_fw_adapter_cls.return_value
+        mock_state = create_autospec(charm.StoredState).return_value
+        mock_state.pod_name = None
+        mock_state.readiness_deadline = None
+
+        pod_name = str(uuid4())
+        mock_k8s_mod.get_pod_status.return_value = k8s.PodStatus({
+            'metadata': {
+                'name': pod_name
+            },
+            'status': {
+                'phase': 'Running',
+                'conditions': [{
+                    'type': 'ContainersReady',
+                    'status': 'True'
+                }]
+            }
+        })
+
+        # Exercise
+        charm.wait_for_pod_readiness(mock_fw_adapter, mock_state)
+        charm.wait_for_pod_readiness(mock_fw_adapter, mock_state)
+
+        # Assert
+        assert mock_state.pod_name == pod_name
+        args, kwargs = mock_k8s_mod.get_pod_status.call_args_list[0]
+        assert kwargs['pod_name'] is None
+        args, kwargs = mock_k8s_mod.get_pod_status.call_args_list[1]
+        assert kwargs['pod_name'] == pod_name
+
+    @patch('charm.k8s', spec_set=True, autospec=True)
+    @patch('charm.time', spec_set=True, autospec=True)
+    def test__it_stops_waiting_as_soon_as_the_pod_is_failing(
+            self,
+            mock_time,
+            mock_k8s_mod):
+        # Setup
+        mock_fw_adapter = create_autospec(framework.FrameworkAdapter,
+                                          spec_set=True).return_value
+        mock_fw_adapter.get_config.side_effect = {
+            'pod-readiness-timeout': 600,
+            'pod-readiness-hook-budget': 60,
+        }.get
+        mock_state = create_autospec(charm.StoredState).return_value
+        mock_state.pod_name = None
+        mock_state.readiness_deadline = None
+
+        mock_k8s_mod.get_pod_status.return_value = \
+            k8s.PodStatus(status_dict=None)
+        mock_k8s_mod.watch_pod_status.return_value = iter([
+            k8s.PodStatus(status_dict={
+                'status': {
+                    'phase': 'Pending',
+                    'containerStatuses': [{
+                        'name': 'prometheus',
+                        'state': {
+                            'waiting': {
+                                'reason': 'ErrImagePull'
+                            }
+                        }
+                    }]
+                }
+            }),
+        ])
+
+        # Exercise
+        pod_is_ready = charm.wait_for_pod_readiness(mock_fw_adapter,
+                                                    mock_state)
+
+        # Assert
+        assert not pod_is_ready
+        # The pod may still recover, so the handler keeps deferring on it
+        assert mock_state.readiness_deadline is not None
+        assert mock_k8s_mod.get_pod_status.call_count == 1
+        args, kwargs = mock_fw_adapter.set_unit_status.call_args
+        assert type(args[0]) == BlockedStatus
+
+    @patch('charm.ReadinessSchedule', autospec=True)
+    @patch('charm.k8s', spec_set=True, autospec=True)
+    def test__it_gives_up_on_a_failing_pod_once_the_deadline_passed(
+            self,
+            mock_k8s_mod,
+            mock_schedule_cls):
+        # Setup
+        mock_fw_adapter = create_autospec(framework.FrameworkAdapter,
+                                          spec_set=True).return_value
+        mock_state = create_autospec(charm.StoredState).return_value
+        mock_state.pod_name = None
+        mock_state.readiness_deadline = 12345
+
+        mock_schedule = mock_schedule_cls.return_value
+        mock_schedule.deadline = 12345
+        mock_schedule.deadline_exceeded = True
+
+        mock_k8s_mod.get_pod_status.return_value = k8s.PodStatus({
+            'status': {
+                'phase': 'Pending',
+                'containerStatuses': [{
+                    'name': 'prometheus',
+                    'state': {
+                        'waiting': {
+                            'reason': 'ErrImagePull'
+                        }
+                    }
+                }]
+            }
+        })
+
+        # Exercise
+        pod_is_ready = charm.wait_for_pod_readiness(mock_fw_adapter,
+                                                    mock_state)
+
+        # Assert
+        assert not pod_is_ready
+        assert mock_state.readiness_deadline is None
+        assert mock_k8s_mod.watch_pod_status.call_count == 0
+        args, kwargs = mock_fw_adapter.set_unit_status.call_args
+        assert type(args[0]) == BlockedStatus
+
+    @patch('charm.ReadinessSchedule', autospec=True)
+    @patch('charm.k8s', spec_set=True, autospec=True)
+    def test__it_gives_up_once_the_budget_is_spent(
+            self,
+            mock_k8s_mod,
+            mock_schedule_cls):
+        # Setup
+        mock_fw_adapter = create_autospec(framework.FrameworkAdapter,
+                                          spec_set=True).return_value
+        mock_state = create_autospec(charm.StoredState).return_value
+        mock_state.pod_name = None
+        mock_state.readiness_deadline = None
+
+        mock_schedule = mock_schedule_cls.return_value
+        mock_schedule.deadline = 12345
+        mock_schedule.deadline_exceeded = False
+        mock_schedule.budget_spent = True
+
+        mock_k8s_mod.get_pod_status.return_value = \
+            k8s.PodStatus(status_dict=None)
+
+        # Exercise
+        pod_is_ready = charm.wait_for_pod_readiness(mock_fw_adapter,
+                                                    mock_state)
+
+        # Assert
+        assert not pod_is_ready
+        assert mock_state.readiness_deadline == 12345
+        assert mock_k8s_mod.get_pod_status.call_count == 1
+        assert mock_k8s_mod.watch_pod_status.call_count == 0
+
+    @patch('charm.ReadinessSchedule', autospec=True)
+    @patch('charm.k8s', spec_set=True, autospec=True)
+    def test__it_checks_the_pod_before_the_deadline(
+            self,
+            mock_k8s_mod,
+            mock_schedule_cls):
+        # Setup
+        mock_fw_adapter = create_autospec(framework.FrameworkAdapter,
+                                          spec_set=True).return_value
+        mock_state = create_autospec(charm.StoredState).return_value
+        mock_state.pod_name = None
+        mock_state.readiness_deadline = 12345
+
+        mock_schedule = mock_schedule_cls.return_value
+        mock_schedule.deadline = 12345
+        mock_schedule.deadline_exceeded = True
+
+        mock_k8s_mod.get_pod_status.return_value = k8s.PodStatus({
+            'status': {
+                'phase': 'Running',
+                'conditions': [{
+                    'type': 'ContainersReady',
+                    'status': 'True'
+                }]
+            }
+        })
+
+        # Exercise
+        pod_is_ready = charm.wait_for_pod_readiness(mock_fw_adapter,
+                                                    mock_state)
+
+        # Assert
+        assert pod_is_ready
+        assert mock_state.readiness_deadline is None
+        args, kwargs = mock_fw_adapter.set_unit_status.call_args
+        assert type(args[0]) == ActiveStatus
+
+    @patch('charm.k8s', spec_set=True, autospec=True)
+    def test__it_blocks_the_unit_if_the_hook_budget_is_not_positive(
+            self,
+            mock_k8s_mod):
+        # Setup
+        mock_fw_adapter = create_autospec(framework.FrameworkAdapter,
+                                          spec_set=True).return_value
+        mock_fw_adapter.get_config.side_effect = {
+            'pod-readiness-timeout': 600,
+            'pod-readiness-hook-budget': 0,
+        }.get
+        mock_state = create_autospec(charm.StoredState).return_value
+        mock_state.pod_name = None
+        mock_state.readiness_deadline = 12345
+
+        # Exercise
+        pod_is_ready = charm.wait_for_pod_readiness(mock_fw_adapter,
+                                                    mock_state)
+
+        # Assert
+        assert not pod_is_ready
+        assert mock_state.readiness_deadline is None
+        assert mock_k8s_mod.get_pod_status.call_count == 0
+        args, kwargs = mock_fw_adapter.set_unit_status.call_args
+        assert type(args[0]) == BlockedStatus
+
+    @patch('charm.ReadinessSchedule', autospec=True)
+    @patch('charm.k8s', spec_set=True, autospec=True)
+    def test__it_blocks_the_unit_once_the_deadline_passed(
+            self,
+            mock_k8s_mod,
+            mock_schedule_cls):
+        # Setup
+        mock_fw_adapter = create_autospec(framework.FrameworkAdapter,
+                                          spec_set=True).return_value
+        mock_state = create_autospec(charm.StoredState).return_value
+        mock_state.pod_name = None
+        mock_state.readiness_deadline = 12345
+
+        mock_schedule = mock_schedule_cls.return_value
+        mock_schedule.deadline = 12345
+        mock_schedule.deadline_exceeded = True
+
+        # Exercise
+        pod_is_ready = charm.wait_for_pod_readiness(mock_fw_adapter,
+                                                    mock_state)
+
+        # Assert
+        assert not pod_is_ready
+        assert mock_state.readiness_deadline is None
+        args, kwargs = mock_fw_adapter.set_unit_status.call_args
+        assert type(args[0]) == BlockedStatus
+        assert mock_schedule_cls.call_args == call(
+            timeout=float(mock_fw_adapter.get_config.return_value),
+            budget=float(mock_fw_adapter.get_config.return_value),
+            deadline=12345
+        )
+
+
+class SetJujuPodSpecTest(unittest.TestCase):
+
+    def setUp(self):
+        self.mock_fw = create_autospec(framework.FrameworkAdapter,
+                                       spec_set=True).return_value
+        self.mock_fw.unit_is_leader.return_value = True
+        self.mock_fw.get_app_name.return_value = 'prometheus'
+        self.mock_fw.get_config.return_value = {'foo': 'bar'}
+        self.mock_fw.get_image_meta.return_value = \
+            framework.ImageMeta({'registrypath': 'foo/bar:1'})
+        self.mock_state = create_mock_state()
+
+    @patch('charm.build_juju_pod_spec', spec_set=True, autospec=True)
+    def test__it_skips_rendering_when_the_inputs_are_unchanged(
+            self,
+            mock_build_juju_pod_spec_func):
+        # Setup
+        mock_build_juju_pod_spec_func.return_value.to_dict.return_value = \
+            {'containers': []}
+
+        # Exercise
+        first = charm.set_juju_pod_spec(self.mock_fw, self.mock_state)
+        second = charm.set_juju_pod_spec(self.mock_fw, self.mock_state)
+
+        # Assert
+        assert first and second
+        assert mock_build_juju_pod_spec_func.call_count == 1
+        assert self.mock_fw.set_pod_spec.call_count == 1
+        assert self.mock_state.pod_spec_cache_misses == 1
+        assert self.mock_state.pod_spec_cache_hits == 1
+
+    @patch('charm.build_juju_pod_spec', spec_set=True, autospec=True)
+    def test__it_skips_pushing_when_the_rendered_spec_is_unchanged(
+            self,
+            mock_build_juju_pod_spec_func):
+        # Setup
+        mock_build_juju_pod_spec_func.return_value.to_dict.return_value = \
+            {'containers': []}
+
+        # Exercise
+        charm.set_juju_pod_spec(self.mock_fw, self.mock_state)
+        self.mock_fw.get_config.return_value = {'foo': 'baz'}
+        charm.set_juju_pod_spec(self.mock_fw, self.mock_state)
+
+        # Assert
+        assert mock_build_juju_pod_spec_func.call_count == 2
+        assert self.mock_fw.set_pod_spec.call_count == 1
+        assert self.mock_state.pod_spec_cache_hits == 1
+
+    @patch('charm.build_juju_pod_spec', spec_set=True, autospec=True)
+    def test__it_pushes_a_changed_spec(self, mock_build_juju_pod_spec_func):
+        # Setup
+        mock_build_juju_pod_spec_func.return_value.to_dict.side_effect = [
+            {'containers': [1]}, {'containers': [2]}
+        ]
+
+        # Exercise
+        charm.set_juju_pod_spec(self.mock_fw, self.mock_state)
+        self.mock_fw.get_config.return_value = {'foo': 'baz'}
+        charm.set_juju_pod_spec(self.mock_fw, self.mock_state)
+
+        # Assert
+        assert self.mock_fw.set_pod_spec.call_args_list == [
+            call({'containers': [1]}), call({'containers': [2]})
+        ]
+        assert self.mock_state.pod_spec_cache_misses == 2
+        assert self.mock_state.pod_spec_cache_hits == 0
+
+    @patch('charm.build_juju_pod_spec', spec_set=True, autospec=True)
+    def test__a_pushed_spec_gets_a_fresh_readiness_deadline(
+            self,
+            mock_build_juju_pod_spec_func):
+        # Setup
+        mock_build_juju_pod_spec_func.return_value.to_dict.return_value = \
+            {'containers': []}
+        self.mock_state.readiness_deadline = 12345
+
+        # Exercise
+        charm.set_juju_pod_spec(self.mock_fw, self.mock_state)
+
+        # Assert
+        assert self.mock_state.readiness_deadline is None
+
+
+class OnScrapeTargetsChangedHandlerTest(unittest.TestCase):
+
+    @patch('charm.build_juju_pod_spec', spec_set=True, autospec=True)
+    def test__it_updates_the_pod_spec_without_touching_the_unit_status(
+            self,
+            mock_build_juju_pod_spec_func):
+        # Setup
+        mock_fw = create_autospec(framework.FrameworkAdapter,
+                                  spec_set=True).return_value
+        mock_fw.unit_is_leader.return_value = True
+        mock_event = create_autospec(EventBase, spec_set=True).return_value
+        mock_state = create_mock_state()
+
+        # Exercise
+        charm.on_scrape_targets_changed_handler(mock_event, mock_fw,
+                                                mock_state)
+
+        # Assert
+        assert mock_fw.set_pod_spec.call_count == 1
+        assert mock_fw.get_relations.call_args == call('scrape-target')
+        assert mock_fw.set_unit_status.call_count == 0
+
+    @patch('charm.build_juju_pod_spec', spec_set=True, autospec=True)
+    def test__it_keeps_the_alerting_config(
+            self,
+            mock_build_juju_pod_spec_func):
+        # Setup
+        mock_fw = create_autospec(framework.FrameworkAdapter,
+                                  spec_set=True).return_value
+        mock_fw.unit_is_leader.return_value = True
+        mock_event = create_autospec(EventBase, spec_set=True).return_value
+        mock_state = create_mock_state()
+        mock_data = {str(uuid4()): str(uuid4())}
+        mock_state.alerting_config = mock_data
+
+        # Exercise
+        charm.on_scrape_targets_changed_handler(mock_event, mock_fw,
+                                                mock_state)
+
+        # Assert
+        args, kwargs = mock_build_juju_pod_spec_func.call_args
+        assert kwargs['alerting_config'] == mock_data
+
 
 class OnNewAlertManagerRelationHandler(unittest.TestCase):
 
@@ -259,8 +1348,11 @@ class OnNewAlertManagerRelationHandler(unittest.TestCase):
         mock_prom_juju_pod_spec = create_autospec(domain.PrometheusJujuPodSpec)
         mock_build_juju_pod_spec_func.return_value = mock_prom_juju_pod_spec
 
+        mock_state = create_mock_state()
+
         # Exercise
-        charm.on_new_alertmanager_relation_handler(mock_event, mock_fw)
+        charm.on_new_alertmanager_relation_handler(mock_event, mock_fw,
+                                                   mock_state)
 
         # Assert
         assert mock_build_juju_pod_spec_func.call_count == 1
@@ -269,7 +1361,9 @@ class OnNewAlertManagerRelationHandler(unittest.TestCase):
                  charm_config=mock_fw.get_config.return_value,
                  prom_image_meta=mock_fw.get_image_meta.return_value,
                  nginx_image_meta=mock_fw.get_image_meta.return_value,
-                 alerting_config=mock_data)
+                 alerting_config=mock_data,
+                 scrape_targets={})
+        assert mock_state.alerting_config == mock_data
 
         assert mock_fw.set_pod_spec.call_count == 1
         assert mock_fw.set_pod_spec.call_args == \
@@ -291,6 +1385,7 @@ class OnStartHandlerTest(unittest.TestCase):
                             spec_set=True)
         mock_fw = mock_fw_adapter_cls.return_value
         mock_fw.unit_is_leader.return_value = True
+        mock_fw.get_config.return_value = get_default_charm_config()
 
         mock_event_cls = create_autospec(EventBase, spec_set=True)
         mock_event = mock_event_cls.return_value
@@ -298,14 +1393,21 @@ class OnStartHandlerTest(unittest.TestCase):
         mock_prom_juju_pod_spec = create_autospec(domain.PrometheusJujuPodSpec)
         mock_build_juju_pod_spec_func.return_value = mock_prom_juju_pod_spec
 
-        mock_state = create_autospec(charm.StoredState).return_value
+        mock_state = create_mock_state()
+        mock_state.config_reload = {'sync_latency': 12.5}
 
         # Exercise
         charm.on_start_handler(mock_event, mock_fw, mock_state)
 
         # Assert
-        assert mock_state.recently_started
-        assert mock_state.config_propagated
+        assert mock_state.config_reload['phase'] == domain.RELOAD_CONVERGED
+        expected_config = domain.build_prometheus_config(
+            mock_fw.get_config.return_value
+        )
+        assert mock_state.config_reload['fingerprint'] == \
+            expected_config.fingerprint
+        # What was learned about the kubelet outlives the pod
+        assert mock_state.config_reload['sync_latency'] == 12.5
 
         assert mock_build_juju_pod_spec_func.call_count == 1
         assert mock_build_juju_pod_spec_func.call_args == \
@@ -313,7 +1415,8 @@ class OnStartHandlerTest(unittest.TestCase):
                  charm_config=mock_fw.get_config.return_value,
                  prom_image_meta=mock_fw.get_image_meta.return_value,
                  nginx_image_meta=mock_fw.get_image_meta.return_value,
-                 alerting_config={})
+                 alerting_config={},
+                 scrape_targets={})
 
         assert mock_fw.set_pod_spec.call_count == 1
         assert mock_fw.set_pod_spec.call_args == \
@@ -322,3 +1425,106 @@ class OnStartHandlerTest(unittest.TestCase):
         assert mock_fw.set_unit_status.call_count == 1
         args, kwargs = mock_fw.set_unit_status.call_args_list[0]
         assert type(args[0]) == MaintenanceStatus
+
+    @patch('charm.build_prometheus_config', spec_set=True, autospec=True)
+    @patch('charm.set_juju_pod_spec', spec_set=True, autospec=True)
+    def test__it_blocks_the_unit_if_the_config_is_invalid(
+            self,
+            mock_set_juju_pod_spec,
+            mock_build_prometheus_config_func):
+        # Setup
+        mock_fw = create_autospec(framework.FrameworkAdapter,
+                                  spec_set=True).return_value
+        mock_build_prometheus_config_func.side_effect = \
+            CharmError(str(uuid4()))
+        mock_state = create_mock_state()
+
+        # Exercise
+        charm.on_start_handler(create_mock_event(), mock_fw, mock_state)
+
+        # Assert
+        assert mock_state.config_reload == {}
+        args, kwargs = mock_fw.set_unit_status.call_args
+        assert type(args[0]) == BlockedStatus
+
+
+class OnLeaderElectedHandlerTest(unittest.TestCase):
+
+    @patch('charm.build_juju_pod_spec', spec_set=True, autospec=True)
+    def test__it_pushes_the_pod_spec_again_after_regaining_leadership(
+            self,
+            mock_build_juju_pod_spec_func):
+        # Setup
+        mock_build_juju_pod_spec_func.return_value.to_dict.return_value = \
+            {'containers': []}
+        mock_fw = create_autospec(framework.FrameworkAdapter,
+                                  spec_set=True).return_value
+        mock_fw.unit_is_leader.return_value = True
+        mock_fw.get_config.return_value = {'foo': 'bar'}
+        mock_state = create_mock_state()
+        charm.set_juju_pod_spec(mock_fw, mock_state)
+
+        # Exercise
+        charm.on_leader_elected_handler(create_mock_event(), mock_state)
+        charm.set_juju_pod_spec(mock_fw, mock_state)
+
+        # Assert
+        assert mock_state.pod_spec_inputs_digest is not None
+        assert mock_fw.set_pod_spec.call_count == 2
+
+
+class OnPreCommitHandlerTest(unittest.TestCase):
+
+    @patch('charm.instrumentation.registry',
+           new_callable=instrumentation.RequestMetrics)
+    def test__it_folds_the_hook_requests_into_the_stored_totals(
+            self, registry):
+        # Setup
+        stored = instrumentation.RequestMetrics()
+        stored.observe('kubernetes', 'GET', '/a', 200, 0.1, 10)
+        registry.observe(
+            'kubernetes', 'GET', '/a', 200, 0.1, 10
+        )
+
+        mock_event = create_autospec(EventBase, spec_set=True).return_value
+        mock_state = create_autospec(charm.StoredState).return_value
+        mock_state.request_metrics = stored.to_dict()
+
+        # Exercise
+        with self.assertLogs(level='INFO') as logs:
+            charm.on_pre_commit_handler(mock_event, mock_state)
+
+        # Assert
+        series = mock_state.request_metrics['kubernetes\tGET\t/a\t200']
+        assert series['count'] == 2
+        assert series['bytes_received'] == 20
+        assert len(registry) == 0
+        assert 'path="/a"' in logs.output[0]
+
+
+class OnApiMetricsActionHandlerTest(unittest.TestCase):
+
+    @patch('charm.instrumentation.registry',
+           new_callable=instrumentation.RequestMetrics)
+    def test__it_returns_the_stored_and_current_requests_as_text(
+            self, registry):
+        # Setup
+        stored = instrumentation.RequestMetrics()
+        stored.observe('kubernetes', 'GET', '/a', 200, 0.1, 10)
+        registry.observe(
+            'kubernetes', 'GET', '/b', 200, 0.1, 10
+        )
+
+        mock_event = create_autospec(ActionEvent, spec_set=True).return_value
+        mock_state = create_autospec(charm.StoredState).return_value
+        mock_state.request_metrics = stored.to_dict()
+
+        # Exercise
+        charm.on_api_metrics_action_handler(mock_event, mock_state)
+
+        # Assert
+        assert mock_event.set_results.call_count == 1
+        args, kwargs = mock_event.set_results.call_args
+        text = args[0]['metrics']
+        assert 'path="/a"' in text
+        assert 'path="/b"' in text
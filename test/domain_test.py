@@ -1,19 +1,27 @@
+import http.client
+import io
 import json
+import os
+import socket
 import sys
+import tempfile
+import time
 import unittest
 from uuid import uuid4
 import yaml
 import textwrap
 sys.path.append('src')
 import domain
+import instrumentation
+import yaml_codec
 from exceptions import (
     TimeStringParseError, ExternalLabelParseError,
-    PrometheusAPIError, CharmError
+    PrometheusAPIError, CharmError, DuplicateScrapeJobError
 )
 from adapters.framework import (
     ImageMeta,
 )
-from unittest.mock import patch
+from unittest.mock import call, patch
 
 
 def get_default_charm_config():
@@ -143,6 +151,48 @@ class BuildJujuPodSpecTest(unittest.TestCase):
             }
         }""")
 
+        expected_prom_config = {
+            'global': {
+                'scrape_interval': '15s',
+                'scrape_timeout': '10s',
+                'evaluation_interval': '1m',
+                'external_labels': mock_external_labels
+            },
+            'scrape_configs': [
+                {
+                    'metrics_path': '/metrics',
+                    'honor_timestamps': True,
+                    'scheme': 'http',
+                    'job_name': 'prometheus',
+                    'scrape_interval': '5s',
+                    'scrape_timeout': '5s',
+                    'static_configs': [
+                        {
+                            'targets': [
+                                'localhost:9090'
+                            ]
+                        }
+                    ]
+                },
+                {
+                    'job_name': 'scrape-targets',
+                    'file_sd_configs': [{
+                        'files': ['/etc/prometheus-targets/*.json'],
+                        'refresh_interval': '1m',
+                    }]
+                }
+            ],
+            'alerting': {}
+        }
+        expected_fingerprint = \
+            domain.canonical_digest(expected_prom_config)[:16]
+        expected_prom_config['scrape_configs'].insert(0, {
+            'job_name': 'config-fingerprint-' + expected_fingerprint
+        })
+        expected_prom_yaml = '# Fingerprint: {}\n{}'.format(
+            expected_fingerprint, yaml.dump(expected_prom_config)
+        )
+
         # Assertions
         assert isinstance(juju_pod_spec, domain.PrometheusJujuPodSpec)
         self.assertEqual(juju_pod_spec.to_dict(), {'containers': [{
@@ -173,32 +223,13 @@ class BuildJujuPodSpecTest(unittest.TestCase):
                 'name': 'prom-config',
                 'mountPath': '/etc/prometheus',
                 'files': {
-                    'prometheus.yml': yaml.dump({
-                        'global': {
-                            'scrape_interval': '15s',
-                            'scrape_timeout': '10s',
-                            'evaluation_interval': '1m',
-                            'external_labels': mock_external_labels
-                        },
-                        'scrape_configs': [
-                            {
-                                'metrics_path': '/metrics',
-                                'honor_timestamps': True,
-                                'scheme': 'http',
-                                'job_name': 'prometheus',
-                                'scrape_interval': '5s',
-                                'scrape_timeout': '5s',
-                                'static_configs': [
-                                    {
-                                        'targets': [
-                                            'localhost:9090'
-                                        ]
-                                    }
-                                ]
-                            }
-                        ],
-                        'alerting': {}
-                    })
+                    'prometheus.yml': expected_prom_yaml
+                }
+            }, {
+                'name': 'prom-targets',
+                'mountPath': '/etc/prometheus-targets',
+                'files': {
+                    'empty.json': '[]'
                 }
             }]
         }, {
@@ -227,6 +258,472 @@ class BuildJujuPodSpecTest(unittest.TestCase):
         }
         ]})
 
+    def test__tls_files_are_mounted_into_the_nginx_container(self):
+        # Set up
+        mock_config = get_default_charm_config()
+        mock_config['ssl_cert'] = str(uuid4())
+        mock_config['ssl_key'] = str(uuid4())
+        mock_image_meta = ImageMeta({
+            'registrypath': str(uuid4()),
+            'username': str(uuid4()),
+            'password': str(uuid4()),
+        })
+        juju_pod_spec = domain.build_juju_pod_spec(
+            app_name='prometheus', charm_config=mock_config,
+            prom_image_meta=mock_image_meta, nginx_image_meta=mock_image_meta
+        )
+
+        # Exercise
+        first = juju_pod_spec.to_dict()
+        first['containers'][1]['files'].append({'name': 'tampered'})
+        second = juju_pod_spec.to_dict()
+
+        # Assertions
+        prom_container, nginx_container = second['containers']
+        assert [f['name'] for f in prom_container['files']] == \
+            ['prom-config', 'prom-targets']
+        assert [f['name'] for f in nginx_container['files']] == \
+            ['nginx-config', 'prom-ssl']
+        assert nginx_container['files'][1]['files'] == {
+            'prom-tls.pem': mock_config['ssl_cert'],
+            'prom-tls.key': mock_config['ssl_key'],
+        }
+
+    def test__enforced_restarts_only_happen_when_nginx_inputs_change(self):
+        # Set up
+        mock_image_meta = ImageMeta({
+            'registrypath': str(uuid4()),
+            'username': str(uuid4()),
+            'password': str(uuid4()),
+        })
+
+        def build_nginx_files(**config):
+            mock_config = get_default_charm_config()
+            mock_config['enforce-pod-restart'] = True
+            mock_config['ssl_cert'] = 'cert'
+            mock_config['ssl_key'] = 'key'
+            mock_config.update(config)
+            pod_spec = domain.build_juju_pod_spec(
+                app_name='prometheus', charm_config=mock_config,
+                prom_image_meta=mock_image_meta,
+                nginx_image_meta=mock_image_meta
+            ).to_dict()
+            return pod_spec['containers'][1]['files']
+
+        # Exercise
+        baseline = build_nginx_files()
+        same = build_nginx_files()
+        prometheus_only = build_nginx_files(**{'scrape-interval': '30s'})
+        new_cert = build_nginx_files(ssl_cert='new cert')
+
+        # Assertions
+        assert baseline[-1]['name'].startswith('nginx-restart-')
+        assert same == baseline
+        assert prometheus_only == baseline
+        assert new_cert[-1]['name'] != baseline[-1]['name']
+
+
+class PrometheusConfigFileTest(unittest.TestCase):
+
+    def setUp(self):
+        self.config = domain.PrometheusConfigFile(global_opts={})
+        for job_name in ('a', 'b', 'c'):
+            self.config.add_scrape_config({'job_name': job_name})
+
+    def job_names(self):
+        return [
+            scrape_config['job_name']
+            for scrape_config in self.config.to_dict()['scrape_configs']
+        ]
+
+    def test__it_rejects_duplicate_jobs(self):
+        with self.assertRaises(DuplicateScrapeJobError):
+            self.config.add_scrape_config({'job_name': 'b'})
+
+    def test__upserting_a_job_keeps_its_position(self):
+        # Exercise
+        self.config.upsert_scrape_config({'job_name': 'b', 'foo': 'bar'})
+        self.config.upsert_scrape_config({'job_name': 'd'})
+
+        # Assert
+        assert self.job_names() == ['a', 'b', 'c', 'd']
+        assert self.config.get_scrape_config('b') == \
+            {'job_name': 'b', 'foo': 'bar'}
+
+    def test__it_removes_jobs(self):
+        # Exercise
+        removed = self.config.remove_scrape_config('b')
+        missing = self.config.remove_scrape_config('b')
+
+        # Assert
+        assert removed == {'job_name': 'b'}
+        assert missing is None
+        assert 'b' not in self.config
+        assert self.job_names() == ['a', 'c']
+
+    def test__the_fingerprint_follows_changes(self):
+        # Setup
+        fingerprint = self.config.fingerprint
+
+        # Exercise
+        self.config.upsert_scrape_config({'job_name': 'a', 'foo': 'bar'})
+
+        # Assert
+        assert self.config.fingerprint != fingerprint
+
+
+class BuildScrapeTargetFilesTest(unittest.TestCase):
+
+    def test__it_renders_a_file_sd_file_per_relation(self):
+        # Setup
+        scrape_targets = {
+            'scrape-target-1': [
+                {'unit': 'foo/1', 'hostname': '10.0.0.2', 'port': '9100',
+                 'metrics_path': '/stats'},
+                {'unit': 'foo/0', 'hostname': '10.0.0.1', 'port': '9100',
+                 'metrics_path': None},
+            ],
+            'scrape-target-2': [],
+        }
+
+        # Exercise
+        files = domain.build_scrape_target_files(scrape_targets)
+
+        # Assert
+        assert set(files.keys()) == \
+            {'scrape-target-1.json', 'scrape-target-2.json'}
+        assert json.loads(files['scrape-target-1.json']) == [{
+            'targets': ['10.0.0.1:9100'],
+            'labels': {'juju_unit': 'foo/0', 'juju_application': 'foo'},
+        }, {
+            'targets': ['10.0.0.2:9100'],
+            'labels': {'juju_unit': 'foo/1', 'juju_application': 'foo',
+                       '__metrics_path__': '/stats'},
+        }]
+        assert json.loads(files['scrape-target-2.json']) == []
+
+    def test__target_churn_does_not_change_the_prometheus_config(self):
+        # Setup
+        mock_image_meta = ImageMeta({
+            'registrypath': str(uuid4()),
+            'username': str(uuid4()),
+            'password': str(uuid4()),
+        })
+
+        def build_prom_files(scrape_targets):
+            return domain.build_juju_pod_spec(
+                app_name='prometheus', charm_config=get_default_charm_config(),
+                prom_image_meta=mock_image_meta,
+                nginx_image_meta=mock_image_meta,
+                scrape_targets=scrape_targets
+            ).to_dict()['containers'][0]['files']
+
+        # Exercise
+        before = build_prom_files({})
+        after = build_prom_files({'scrape-target-1': [
+            {'unit': 'foo/0', 'hostname': '10.0.0.1', 'port': '9100'},
+        ]})
+
+        # Assert
+        assert before[0] == after[0]
+        assert before[1]['files'] == {'empty.json': '[]'}
+        assert set(after[1]['files'].keys()) == \
+            {'empty.json', 'scrape-target-1.json'}
+
+
+class BuildJujuPodSpecDigestTest(unittest.TestCase):
+
+    def setUp(self):
+        self.image_meta = ImageMeta({
+            'registrypath': str(uuid4()),
+            'username': str(uuid4()),
+            'password': str(uuid4()),
+        })
+
+    def test__it_ignores_key_order(self):
+        # Exercise
+        first = domain.build_juju_pod_spec_digest(
+            'prometheus', {'a': 1, 'b': 2}, self.image_meta, self.image_meta
+        )
+        second = domain.build_juju_pod_spec_digest(
+            'prometheus', {'b': 2, 'a': 1}, self.image_meta, self.image_meta,
+            alerting_config={}
+        )
+
+        # Assert
+        assert first == second
+
+    def test__it_changes_with_any_input(self):
+        # Setup
+        base = domain.build_juju_pod_spec_digest(
+            'prometheus', {'a': 1}, self.image_meta, self.image_meta
+        )
+
+        # Exercise
+        digests = [
+            domain.build_juju_pod_spec_digest(
+                'other', {'a': 1}, self.image_meta, self.image_meta
+            ),
+            domain.build_juju_pod_spec_digest(
+                'prometheus', {'a': 2}, self.image_meta, self.image_meta
+            ),
+            domain.build_juju_pod_spec_digest(
+                'prometheus', {'a': 1}, self.image_meta,
+                ImageMeta({'registrypath': str(uuid4())})
+            ),
+            domain.build_juju_pod_spec_digest(
+                'prometheus', {'a': 1}, self.image_meta, self.image_meta,
+                alerting_config={'alertmanagers': []}
+            ),
+        ]
+
+        # Assert
+        assert base not in digests
+        assert len(set(digests)) == len(digests)
+
+
+class GetTemplateTest(unittest.TestCase):
+
+    def setUp(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.templates_dir = tmp_dir.name
+        self.compiled_dir = os.path.join(tmp_dir.name, 'compiled')
+        self.source_path = os.path.join(tmp_dir.name, 'test.j2')
+        with open(self.source_path, 'w') as source:
+            source.write('source {{ value }}')
+        with open(os.path.join(tmp_dir.name,
+                               'prometheus-k8s.yml'), 'w') as source:
+            source.write('scrape_configs: []')
+
+        for patcher in (
+            patch.object(domain, 'TEMPLATES_DIR', self.templates_dir),
+            patch.object(domain, 'COMPILED_TEMPLATES_DIR', self.compiled_dir),
+            patch.object(domain, '_template_cache', {}),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def compile_as(self, text):
+        with open(self.source_path) as source:
+            original = source.read()
+        with open(self.source_path, 'w') as source:
+            source.write(text)
+        domain.compile_templates()
+        with open(self.source_path, 'w') as source:
+            source.write(original)
+
+    def touch(self, path, offset):
+        mtime = time.time() + offset
+        os.utime(path, (mtime, mtime))
+
+    def test__it_compiles_the_source_once_per_process(self):
+        # Exercise
+        first = domain.get_template('test.j2')
+        second = domain.get_template('test.j2')
+
+        # Assert
+        assert first is second
+        assert first.render(value=1) == 'source 1'
+
+    def test__it_prefers_a_template_precompiled_from_the_same_source(self):
+        # Setup
+        domain.compile_templates()
+        # E.g. a fresh checkout of the source
+        self.touch(self.source_path, offset=60)
+
+        # Exercise
+        with patch('domain.FileSystemLoader', autospec=True) as mock_loader:
+            template = domain.get_template('test.j2')
+
+        # Assert
+        assert mock_loader.call_count == 0
+        assert template.render(value=1) == 'source 1'
+
+    def test__it_ignores_a_template_precompiled_from_another_source(self):
+        # Setup
+        self.compile_as('compiled {{ value }}')
+        for name in os.listdir(self.compiled_dir):
+            self.touch(os.path.join(self.compiled_dir, name), offset=60)
+
+        # Exercise
+        template = domain.get_template('test.j2')
+
+        # Assert
+        assert template.render(value=1) == 'source 1'
+
+    def test__it_ignores_a_broken_precompiled_template(self):
+        # Setup
+        domain.compile_templates()
+        for name in os.listdir(self.compiled_dir):
+            if name.endswith('.py'):
+                with open(os.path.join(self.compiled_dir, name), 'w') as f:
+                    f.write('not python (')
+
+        # Exercise
+        with self.assertLogs(level='WARNING'):
+            template = domain.get_template('test.j2')
+
+        # Assert
+        assert template.render(value=1) == 'source 1'
+
+    def test__it_ignores_a_broken_manifest(self):
+        # Setup
+        domain.compile_templates()
+        with open(os.path.join(self.compiled_dir,
+                               domain.COMPILED_TEMPLATES_MANIFEST), 'w') as f:
+            f.write('[]')
+
+        # Exercise
+        with self.assertLogs(level='WARNING'):
+            template = domain.get_template('test.j2')
+
+        # Assert
+        assert template.render(value=1) == 'source 1'
+
+
+class LoadK8sScrapeConfigsTest(unittest.TestCase):
+
+    def setUp(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.compiled_dir = os.path.join(tmp_dir.name, 'compiled')
+        self.source_path = os.path.join(tmp_dir.name, 'prometheus-k8s.yml')
+        self.write_source([{'job_name': 'a'}])
+
+        for patcher in (
+            patch.object(domain, 'TEMPLATES_DIR', tmp_dir.name),
+            patch.object(domain, 'COMPILED_TEMPLATES_DIR', self.compiled_dir),
+            patch.object(domain, '_k8s_scrape_configs_cache', {}),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def write_source(self, scrape_configs):
+        with open(self.source_path, 'w') as source:
+            source.write('# Comment\n')
+            yaml.safe_dump({'scrape_configs': scrape_configs}, source)
+
+    @patch('domain.yaml_codec.load', side_effect=yaml_codec.load)
+    def test__it_parses_the_file_once_while_it_is_unchanged(
+            self, mock_safe_load):
+        # Exercise
+        first = domain.load_k8s_scrape_configs()
+        second = domain.load_k8s_scrape_configs()
+
+        # Assert
+        assert first == second == [{'job_name': 'a'}]
+        assert first is not second
+        assert mock_safe_load.call_count == 1
+
+    def test__it_parses_the_file_again_once_it_changed(self):
+        # Setup
+        domain.load_k8s_scrape_configs()
+
+        # Exercise
+        self.write_source([{'job_name': 'a'}, {'job_name': 'b'}])
+        scrape_configs = domain.load_k8s_scrape_configs()
+
+        # Assert
+        assert scrape_configs == [{'job_name': 'a'}, {'job_name': 'b'}]
+
+    @patch('domain.yaml_codec.load', side_effect=yaml_codec.load)
+    def test__it_uses_the_pre_parsed_artifact(self, mock_safe_load):
+        # Setup
+        os.makedirs(self.compiled_dir)
+        domain.compile_templates()
+        mock_safe_load.reset_mock()
+
+        # Exercise
+        scrape_configs = domain.load_k8s_scrape_configs()
+
+        # Assert
+        assert scrape_configs == [{'job_name': 'a'}]
+        assert mock_safe_load.call_count == 0
+
+    def test__it_ignores_a_stale_pre_parsed_artifact(self):
+        # Setup
+        os.makedirs(self.compiled_dir)
+        domain.compile_templates()
+
+        # Exercise
+        self.write_source([{'job_name': 'b'}])
+        scrape_configs = domain.load_k8s_scrape_configs()
+
+        # Assert
+        assert scrape_configs == [{'job_name': 'b'}]
+
+
+class ReadinessScheduleTest(unittest.TestCase):
+
+    def test__it_tracks_the_deadline_and_budget(self):
+        # Setup
+        now = [1000.0]
+
+        # Exercise
+        schedule = domain.ReadinessSchedule(timeout=600, budget=60,
+                                            clock=lambda: now[0])
+
+        # Assert
+        assert schedule.deadline == 1600.0
+        assert schedule.time_left() == 60
+        assert not schedule.budget_spent
+
+        now[0] = 1060.0
+        assert schedule.budget_spent
+        assert not schedule.deadline_exceeded
+
+        now[0] = 1600.0
+        assert schedule.deadline_exceeded
+        assert schedule.time_left() == 0
+
+    def test__it_keeps_an_earlier_deadline(self):
+        # Exercise
+        schedule = domain.ReadinessSchedule(timeout=600, budget=60,
+                                            deadline=1030.0,
+                                            clock=lambda: 1000.0)
+
+        # Assert
+        assert schedule.deadline == 1030.0
+        assert schedule.time_left() == 30
+
+    def test__it_backs_off_exponentially_with_jitter(self):
+        # Setup
+        schedule = domain.ReadinessSchedule(timeout=600, budget=600,
+                                            initial_delay=1, max_delay=8,
+                                            clock=lambda: 0.0,
+                                            rng=lambda: 1.0)
+        jittered_schedule = domain.ReadinessSchedule(timeout=600, budget=600,
+                                                     initial_delay=1,
+                                                     max_delay=8,
+                                                     clock=lambda: 0.0,
+                                                     rng=lambda: 0.0)
+
+        # Exercise
+        delays = [schedule.next_delay() for _ in range(6)]
+        jittered_delays = [jittered_schedule.next_delay() for _ in range(6)]
+
+        # Assert
+        assert delays == [1, 2, 4, 8, 8, 8]
+        assert jittered_delays == [0.5, 1, 2, 4, 4, 4]
+
+    def test__it_does_not_back_off_past_the_budget(self):
+        # Setup
+        schedule = domain.ReadinessSchedule(timeout=600, budget=3,
+                                            clock=lambda: 0.0,
+                                            rng=lambda: 1.0)
+
+        # Exercise
+        delays = [schedule.next_delay() for _ in range(4)]
+
+        # Assert
+        assert delays == [1, 2, 3, 3]
+
+    def test__it_rejects_a_budget_that_is_not_positive(self):
+        # Exercise
+        with self.assertRaises(CharmError):
+            domain.ReadinessSchedule(timeout=600, budget=0)
+
 
 class ExternalMetricsParserTest(unittest.TestCase):
     def test__external_metrics_parser(self):
@@ -265,44 +762,541 @@ class TimeValuesParserTest(unittest.TestCase):
 
 class ConfigReloadTest(unittest.TestCase):
 
-    @patch('domain.time', spec_set=True, autospec=True)
-    @patch('domain._prometheus_http_api_call', spec_set=True, autospec=True)
-    def test__reload_configuration(
-            self, prometheus_http_api_call_mock, time_mock):
-        prom_api_response = PromMockConfig()
-
-        # These two are not returned by Prom API in reality (if empty),
-        # but they have to be present - otherwise charm will not be able
-        # to compare expected and given configs.
-
-        charm_config = get_default_charm_config()
-        charm_config['external-labels'] = {}
-        del prom_api_response.config['global']['external_labels']
-
-        # Wrong config comes from Prometheus
-        prometheus_http_api_call_mock.return_value = prom_api_response.render()
-        self.assertFalse(domain.reload_configuration(
-            'juju-app', 'juju-model', charm_config
-        ))
-
-        # After some times it becomes valid
-        prom_api_response.config['global']['scrape_interval'] = '15s'
-        prometheus_http_api_call_mock.return_value = prom_api_response.render()
-        self.assertTrue(domain.reload_configuration(
-            'juju-app', 'juju-model', charm_config
-        ))
-
-        # Prom API returned some error
-        prometheus_http_api_call_mock.side_effect = PrometheusAPIError('test')
-        self.assertFalse(domain.reload_configuration(
-            'juju-app', 'juju-model', charm_config
-        ))
-
     def test_config_propagation_raises_on_wrong_arg(self):
         with self.assertRaises(CharmError):
             for opt in [{}, get_default_charm_config()]:
                 domain.check_config_propagation('juju-app', 'juju-model', opt)
 
+    def serve_config(self, config_yaml):
+        patcher = patch('domain.http.client.HTTPConnection',
+                        spec_set=True, autospec=True)
+        mock_http_connection = patcher.start()
+        self.addCleanup(patcher.stop)
+
+        patcher = patch.dict('domain._prometheus_api_clients', clear=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        body = io.BytesIO(json.dumps({
+            'status': 'success',
+            'data': {'yaml': config_yaml}
+        }).encode())
+        mock_response = mock_http_connection.return_value.getresponse()
+        mock_response.status = 200
+        mock_response.will_close = False
+        mock_response.isclosed.side_effect = \
+            lambda: body.tell() == len(body.getvalue())
+        mock_response.read.side_effect = body.read
+        return mock_http_connection.return_value, body
+
+    def test_config_propagation_only_reads_up_to_the_fingerprint(self):
+        # Setup
+        expected_config = domain.build_prometheus_config(
+            get_default_charm_config()
+        )
+        for i in range(1000):
+            expected_config.add_scrape_config({'job_name': str(i)})
+        conn, body = self.serve_config(expected_config.yaml_dump())
+
+        # Exercise
+        with patch('domain.yaml_codec.load') as mock_load:
+            propagated = domain.check_config_propagation(
+                'juju-model', 'juju-app', expected_config
+            )
+
+        # Assert
+        assert propagated
+        assert mock_load.call_count == 0
+        assert conn.request.call_args == \
+            call(method='GET', url='/api/v1/status/config')
+        assert body.tell() <= domain.PROMETHEUS_API_READ_CHUNK_SIZE
+        assert body.tell() < len(body.getvalue())
+        # The rest of the response is left unread
+        assert conn.close.called
+
+    def test_config_propagation_fails_on_a_stale_fingerprint(self):
+        # Setup
+        charm_config = get_default_charm_config()
+        old_config = domain.build_prometheus_config(charm_config)
+        charm_config['scrape-interval'] = '30s'
+        expected_config = domain.build_prometheus_config(charm_config)
+        conn, body = self.serve_config(old_config.yaml_dump())
+
+        # Exercise
+        with self.assertLogs(level='INFO') as logs:
+            propagated = domain.check_config_propagation(
+                'juju-model', 'juju-app', expected_config
+            )
+
+        # Assert
+        assert not propagated
+        assert body.tell() == len(body.getvalue())
+        assert any('global.scrape_interval' in line for line in logs.output)
+
+
+class ConfigReloadStateMachineTest(unittest.TestCase):
+
+    def setUp(self):
+        patcher = patch('domain.config_reload_api_call',
+                        spec_set=True, autospec=True)
+        self.mock_reload_api_call = patcher.start()
+        self.addCleanup(patcher.stop)
+
+        patcher = patch('domain.get_config_reload_metrics',
+                        spec_set=True, autospec=True)
+        self.mock_get_config_reload_metrics = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.set_reload_metrics(successful=1, timestamp=500)
+
+        patcher = patch('domain.check_config_propagation',
+                        spec_set=True, autospec=True)
+        self.mock_check_config_propagation = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.mock_check_config_propagation.return_value = True
+
+        self.now = 1000
+        self.expected_config = domain.build_prometheus_config(
+            get_default_charm_config()
+        )
+
+    def set_reload_metrics(self, successful, timestamp):
+        self.mock_get_config_reload_metrics.return_value = {
+            domain.RELOAD_SUCCESSFUL_METRIC: successful,
+            domain.RELOAD_TIMESTAMP_METRIC: timestamp,
+        }
+
+    def create_config_reload(self, state=None):
+        return domain.ConfigReload(state, clock=lambda: self.now,
+                                   sync_latency=20, sync_latency_weight=0.5,
+                                   retry_delay=5, max_attempts=2)
+
+    def step(self, config_reload, config_map_fingerprint=None):
+        return config_reload.step('juju-model', 'juju-app',
+                                  self.expected_config,
+                                  config_map_fingerprint)
+
+    def start_reloading(self, config_reload):
+        config_reload.start('abc')
+        self.step(config_reload, 'abc')
+        self.now += 20
+
+    def test__it_advances_one_phase_per_step(self):
+        # Setup
+        config_reload = self.create_config_reload()
+        config_reload.start('abc')
+
+        # Exercise and Assert: Juju has yet to update the ConfigMap
+        assert self.step(config_reload, 'old') == \
+            domain.RELOAD_PENDING_PROPAGATION
+        assert self.step(config_reload, 'abc') == \
+            domain.RELOAD_PENDING_PROPAGATION
+
+        self.now += 5
+        assert self.step(config_reload, 'abc') == domain.RELOAD_RELOADING
+        assert config_reload.config_map_updated_at == 1005
+
+        # The kubelet is given time to sync the ConfigMap
+        assert self.step(config_reload) == domain.RELOAD_RELOADING
+        assert self.mock_reload_api_call.call_count == 0
+
+        self.now += 20
+        assert self.step(config_reload) == domain.RELOAD_VERIFYING
+        assert self.mock_reload_api_call.call_args_list == [
+            call('juju-model', 'juju-app')
+        ]
+        assert config_reload.previous_reload == 500
+
+        self.set_reload_metrics(successful=1, timestamp=1025)
+        assert self.step(config_reload) == domain.RELOAD_CONVERGED
+        assert self.mock_check_config_propagation.call_args_list == [
+            call('juju-model', 'juju-app', self.expected_config)
+        ]
+
+        assert self.step(config_reload) == domain.RELOAD_CONVERGED
+        assert self.mock_reload_api_call.call_count == 1
+        assert self.mock_get_config_reload_metrics.call_count == 2
+
+    def test__it_learns_how_long_the_kubelet_takes_to_sync(self):
+        # Setup
+        config_reload = self.create_config_reload()
+        self.start_reloading(config_reload)
+
+        # Exercise: the first reload still finds the old config
+        self.step(config_reload)
+        self.set_reload_metrics(successful=1, timestamp=1020)
+        self.mock_check_config_propagation.return_value = False
+        self.step(config_reload)
+
+        self.now += 10
+        self.step(config_reload)
+        self.set_reload_metrics(successful=1, timestamp=1030)
+        self.mock_check_config_propagation.return_value = True
+        phase = self.step(config_reload)
+
+        # Assert: the ConfigMap landed after 20s. The retry came 10s later,
+        # but only the first 5s of that are the retry interval, call it 22.5s
+        assert phase == domain.RELOAD_CONVERGED
+        assert config_reload.stale_after == 20
+        assert config_reload.sync_latency == 21.25
+
+        # Exercise: the next reload finds the new config right away
+        config_reload.start('def')
+        self.step(config_reload, 'def')
+        assert config_reload.not_before == self.now + 21.25
+        self.now += 21.25
+        self.step(config_reload)
+        self.set_reload_metrics(successful=1, timestamp=1060)
+        self.step(config_reload)
+
+        # Assert: 21.25s was enough, so probe one retry interval shorter
+        assert config_reload.phase == domain.RELOAD_CONVERGED
+        assert config_reload.sync_latency == 18.75
+
+    def test__it_does_not_learn_how_long_the_next_hook_took(self):
+        # Setup
+        config_reload = self.create_config_reload()
+        self.start_reloading(config_reload)
+
+        # Exercise: the first reload still finds the old config and Juju
+        # only runs the deferred hook five minutes later
+        self.step(config_reload)
+        self.set_reload_metrics(successful=1, timestamp=1020)
+        self.mock_check_config_propagation.return_value = False
+        self.step(config_reload)
+
+        self.now += 300
+        self.step(config_reload)
+        self.set_reload_metrics(successful=1, timestamp=1320)
+        self.mock_check_config_propagation.return_value = True
+        phase = self.step(config_reload)
+
+        # Assert
+        assert phase == domain.RELOAD_CONVERGED
+        assert config_reload.sync_latency == 21.25
+
+    def test__it_does_not_check_the_config_before_the_reload_went_through(
+            self):
+        # Setup
+        config_reload = self.create_config_reload()
+        self.start_reloading(config_reload)
+        self.step(config_reload)
+
+        # Exercise
+        phase = self.step(config_reload)
+
+        # Assert
+        assert phase == domain.RELOAD_RELOADING
+        assert self.mock_check_config_propagation.call_count == 0
+
+    def test__it_fails_once_it_runs_out_of_attempts(self):
+        # Setup
+        config_reload = self.create_config_reload()
+        self.start_reloading(config_reload)
+
+        # Exercise and Assert: the reload metrics never move on
+        assert self.step(config_reload) == domain.RELOAD_VERIFYING
+        assert self.step(config_reload) == domain.RELOAD_RELOADING
+        assert self.step(config_reload) == domain.RELOAD_RELOADING
+
+        self.now += 5
+        assert self.step(config_reload) == domain.RELOAD_VERIFYING
+        with self.assertLogs(level='ERROR'):
+            assert self.step(config_reload) == domain.RELOAD_FAILED
+
+        assert self.step(config_reload) == domain.RELOAD_FAILED
+        assert self.mock_reload_api_call.call_count == 2
+        assert config_reload.attempts == 2
+
+    def test__it_reloads_again_when_retried_after_failing(self):
+        # Setup
+        config_reload = self.create_config_reload()
+        config_reload.start('abc')
+        self.step(config_reload, 'old')
+        self.now += 5
+        with self.assertLogs(level='ERROR'):
+            self.step(config_reload, 'old')
+
+        # Exercise
+        config_reload.retry()
+        phase = self.step(config_reload)
+
+        # Assert
+        assert phase == domain.RELOAD_VERIFYING
+        assert config_reload.fingerprint == 'abc'
+        assert config_reload.attempts == 1
+        assert self.mock_reload_api_call.call_count == 1
+
+    def test__it_fails_if_the_config_map_is_not_updated(self):
+        # Setup
+        config_reload = self.create_config_reload()
+        config_reload.start('abc')
+
+        # Exercise
+        self.step(config_reload, 'old')
+        self.now += 5
+        with self.assertLogs(level='ERROR'):
+            phase = self.step(config_reload, 'old')
+
+        # Assert
+        assert phase == domain.RELOAD_FAILED
+        assert self.mock_reload_api_call.call_count == 0
+
+    def test__it_does_not_accept_a_failed_reload(self):
+        # Setup
+        config_reload = self.create_config_reload()
+        self.start_reloading(config_reload)
+        self.step(config_reload)
+        self.set_reload_metrics(successful=0, timestamp=500)
+
+        # Exercise
+        with self.assertLogs(level='WARNING'):
+            phase = self.step(config_reload)
+
+        # Assert
+        assert phase == domain.RELOAD_RELOADING
+
+    def test__it_compares_the_whole_config_without_reload_metrics(self):
+        # Setup
+        config_reload = self.create_config_reload()
+        self.mock_get_config_reload_metrics.return_value = {}
+        self.start_reloading(config_reload)
+        self.step(config_reload)
+
+        # Exercise
+        phase = self.step(config_reload)
+
+        # Assert
+        assert phase == domain.RELOAD_CONVERGED
+        assert self.mock_check_config_propagation.call_args_list == [
+            call('juju-model', 'juju-app', self.expected_config)
+        ]
+
+    def test__it_retries_a_failed_reload_call(self):
+        # Setup
+        config_reload = self.create_config_reload()
+        self.start_reloading(config_reload)
+        self.mock_reload_api_call.side_effect = [
+            PrometheusAPIError('test'), None
+        ]
+
+        # Exercise and Assert
+        assert self.step(config_reload) == domain.RELOAD_RELOADING
+        assert config_reload.not_before == self.now + 5
+
+        self.now += 5
+        assert self.step(config_reload) == domain.RELOAD_VERIFYING
+
+    def test__its_state_survives_a_round_trip(self):
+        # Setup
+        config_reload = self.create_config_reload()
+        self.start_reloading(config_reload)
+        self.step(config_reload)
+
+        # Exercise
+        restored = self.create_config_reload(config_reload.to_dict())
+
+        # Assert
+        assert restored.to_dict() == {
+            'phase': domain.RELOAD_VERIFYING,
+            'fingerprint': 'abc',
+            'attempts': 1,
+            'not_before': 1020,
+            'previous_reload': 500,
+            'config_map_updated_at': 1000,
+            'reloaded_at': 1020,
+            'stale_after': 0,
+            'sync_latency': 20,
+        }
+        assert not restored.settled
+
+    def test__it_starts_out_settled(self):
+        # Exercise
+        config_reload = self.create_config_reload()
+
+        # Assert
+        assert config_reload.settled
+        assert not config_reload.due
+        assert config_reload.fingerprint is None
+        assert config_reload.sync_latency == 20
+
+
+class ReadConfigFingerprintTest(unittest.TestCase):
+
+    def test__it_reads_the_fingerprint_yaml_dump_put_in(self):
+        # Setup
+        config = domain.build_prometheus_config(get_default_charm_config())
+
+        # Exercise
+        fingerprint = domain.read_config_fingerprint(config.yaml_dump())
+
+        # Assert
+        assert fingerprint == config.fingerprint
+
+    def test__it_returns_none_without_a_fingerprint(self):
+        assert domain.read_config_fingerprint('global: {}\n') is None
+        assert domain.read_config_fingerprint('') is None
+
+
+class GetConfigReloadMetricsTest(unittest.TestCase):
+
+    def setUp(self):
+        patcher = patch('domain.http.client.HTTPConnection',
+                        spec_set=True, autospec=True)
+        self.mock_http_connection = patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.mock_response = \
+            self.mock_http_connection.return_value.getresponse.return_value
+        self.mock_response.status = 200
+        self.mock_response.will_close = False
+        self.mock_response.isclosed.return_value = False
+
+        patcher = patch.dict('domain._prometheus_api_clients', clear=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test__it_stops_reading_once_it_has_seen_both_samples(self):
+        # Setup
+        lines = [
+            b'# HELP go_goroutines Number of goroutines.\n',
+            b'go_goroutines 42\n',
+            b'prometheus_config_last_reload_success_timestamp_seconds '
+            b'1.5e+09\n',
+            b'prometheus_config_last_reload_successful 1\n',
+            b'prometheus_engine_queries 0\n',
+        ]
+        self.mock_response.readline.side_effect = lines
+
+        # Exercise
+        samples = domain.get_config_reload_metrics('juju-model', 'juju-app')
+
+        # Assert
+        assert samples == {
+            domain.RELOAD_SUCCESSFUL_METRIC: 1,
+            domain.RELOAD_TIMESTAMP_METRIC: 1.5e9,
+        }
+        assert self.mock_response.readline.call_count == 4
+        assert self.mock_http_connection.return_value.request.call_args == \
+            call(method='GET', url='/metrics')
+        # The rest of the response is left unread
+        assert self.mock_http_connection.return_value.close.called
+
+    def test__it_leaves_out_what_prometheus_does_not_expose(self):
+        # Setup
+        self.mock_response.readline.side_effect = [
+            b'prometheus_config_last_reload_successful 0\n', b''
+        ]
+
+        # Exercise
+        samples = domain.get_config_reload_metrics('juju-model', 'juju-app')
+
+        # Assert
+        assert samples == {domain.RELOAD_SUCCESSFUL_METRIC: 0}
+
+    def test__it_raises_on_malformed_metrics(self):
+        # Setup
+        self.mock_response.readline.side_effect = [b'foo bar\n', b'']
+
+        # Exercise
+        with self.assertRaises(PrometheusAPIError):
+            domain.get_config_reload_metrics('juju-model', 'juju-app')
+
+
+class NormalizePrometheusConfigTest(unittest.TestCase):
+
+    def test__it_fills_in_the_defaults_of_prometheus(self):
+        # Setup
+        expected_config = domain.PrometheusConfigFile(
+            global_opts={'scrape_interval': '60s'}
+        )
+        expected_config.add_scrape_config({
+            'job_name': 'foo',
+            'static_configs': [{'targets': ['foo:9100']}],
+            'relabel_configs': [{'target_label': 'bar', 'replacement': 'x'}]
+        })
+
+        prom_api_response = PromMockConfig()
+        prom_api_response.config = {
+            'global': {
+                'scrape_interval': '1m',
+                'scrape_timeout': '10s',
+                'evaluation_interval': '1m',
+            },
+            'scrape_configs': [{
+                'job_name': 'foo',
+                'honor_timestamps': True,
+                'scrape_interval': '1m',
+                'scrape_timeout': '10s',
+                'metrics_path': '/metrics',
+                'scheme': 'http',
+                'static_configs': [{'targets': ['foo:9100']}],
+                'relabel_configs': [{
+                    'separator': ';',
+                    'regex': '(.*)',
+                    'target_label': 'bar',
+                    'replacement': 'x',
+                    'action': 'replace',
+                }]
+            }]
+        }
+
+        # Exercise
+        expected = domain.normalize_prometheus_config(
+            expected_config.to_dict()
+        )
+        actual = domain.normalize_prometheus_config(prom_api_response.config)
+
+        # Assert
+        assert expected == actual
+
+    def test__canonical_duration(self):
+        for duration, canonical in [
+            ('60s', '1m'),
+            ('90m', '1h30m'),
+            ('1500ms', '1s500ms'),
+            ('14d', '2w'),
+            ('10d', '10d'),
+            ('0s', '0s'),
+            ('5x', '5x'),
+        ]:
+            assert domain.canonical_duration(duration) == canonical
+
+    def test__it_does_not_modify_its_argument(self):
+        # Setup
+        config_dict = {'scrape_configs': [{'job_name': 'foo'}]}
+
+        # Exercise
+        domain.normalize_prometheus_config(config_dict)
+
+        # Assert
+        assert config_dict == {'scrape_configs': [{'job_name': 'foo'}]}
+
+    def test__diff_names_the_paths_that_did_not_converge(self):
+        # Setup
+        expected = domain.normalize_prometheus_config({'scrape_configs': [
+            {'job_name': 'foo', 'scrape_interval': '5s'},
+            {'job_name': 'bar'},
+        ]})
+        actual = domain.normalize_prometheus_config({'scrape_configs': [
+            {'job_name': 'foo', 'scrape_interval': '10s'},
+        ]})
+
+        # Exercise
+        differences = list(
+            domain.diff_prometheus_configs(expected, actual)
+        )
+
+        # Assert
+        assert differences == [
+            domain.ConfigDifference(
+                'scrape_configs[foo].scrape_interval', '5s', '10s'
+            ),
+            domain.ConfigDifference(
+                'scrape_configs[bar]', expected['scrape_configs'][1],
+                domain.MISSING
+            ),
+        ]
+
 
 class HTTPCallTest(unittest.TestCase):
     @patch('domain.http.client.HTTPConnection', spec_set=True, autospec=True)
@@ -346,6 +1340,151 @@ class HTTPCallTest(unittest.TestCase):
             )
 
 
+class PrometheusAPIClientTest(unittest.TestCase):
+
+    def setUp(self):
+        patcher = patch('domain.http.client.HTTPConnection',
+                        spec_set=True, autospec=True)
+        self.mock_http_connection = patcher.start()
+        self.addCleanup(patcher.stop)
+
+        patcher = patch('domain.time.sleep', spec_set=True, autospec=True)
+        self.mock_sleep = patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.mock_response = \
+            self.mock_http_connection.return_value.getresponse.return_value
+        self.mock_response.status = 200
+        self.mock_response.read.return_value = b'{}'
+        self.mock_response.will_close = False
+        self.mock_response.isclosed.return_value = True
+
+        self.metrics = instrumentation.RequestMetrics()
+
+    def test__it_keeps_the_connection_alive_between_calls(self):
+        # Setup
+        client = domain.PrometheusAPIClient('app.model.svc',
+                                            metrics=self.metrics)
+
+        # Exercise
+        client.request('POST', '/-/reload')
+        client.request('GET', '/api/v1/status/config')
+
+        # Assert
+        assert self.mock_http_connection.call_args_list == [
+            call('app.model.svc',
+                 timeout=domain.PROMETHEUS_API_CONNECT_TIMEOUT)
+        ]
+        assert client.stats == {
+            'connections_opened': 1,
+            'connections_reused': 1,
+        }
+
+    def test__it_closes_the_connection_if_the_server_will(self):
+        # Setup
+        self.mock_response.will_close = True
+        client = domain.PrometheusAPIClient('app.model.svc',
+                                            metrics=self.metrics)
+
+        # Exercise
+        client.request('GET', '/-/ready')
+        client.request('GET', '/-/ready')
+
+        # Assert
+        assert self.mock_http_connection.call_count == 2
+        assert self.mock_http_connection.return_value.close.call_count == 2
+
+    def test__it_retries_with_backoff_until_it_gives_up(self):
+        # Setup
+        self.mock_http_connection.return_value.connect.side_effect = \
+            ConnectionRefusedError()
+        client = domain.PrometheusAPIClient('app.model.svc', retries=2,
+                                            retry_delay=0.5,
+                                            metrics=self.metrics)
+
+        # Exercise
+        with self.assertRaises(PrometheusAPIError):
+            client.request('GET', '/-/ready')
+
+        # Assert
+        assert self.mock_sleep.call_args_list == [call(0.5), call(1.0)]
+        assert self.mock_http_connection.call_count == 3
+        series = self.metrics.to_dict()['prometheus\tGET\t/-/ready\terror']
+        assert series['count'] == 1
+        assert series['retries'] == 2
+
+    def test__it_recovers_from_a_timeout(self):
+        # Setup
+        self.mock_http_connection.return_value.getresponse.side_effect = [
+            socket.timeout(),
+            self.mock_response,
+        ]
+        client = domain.PrometheusAPIClient('app.model.svc',
+                                            metrics=self.metrics)
+
+        # Exercise
+        status, body = client.request('GET', '/-/ready')
+
+        # Assert
+        assert (status, body) == (200, b'{}')
+        assert self.mock_sleep.call_count == 1
+        assert self.metrics.to_dict()[
+            'prometheus\tGET\t/-/ready\t200'
+        ]['retries'] == 1
+
+    def test__it_reconnects_a_stale_connection_without_a_retry(self):
+        # Setup
+        client = domain.PrometheusAPIClient('app.model.svc',
+                                            metrics=self.metrics)
+        client.request('GET', '/-/ready')
+        self.mock_http_connection.return_value.getresponse.side_effect = [
+            http.client.RemoteDisconnected(),
+            self.mock_response,
+        ]
+
+        # Exercise
+        client.request('GET', '/-/ready')
+
+        # Assert
+        assert self.mock_http_connection.call_count == 2
+        assert not self.mock_sleep.called
+        assert self.metrics.to_dict()[
+            'prometheus\tGET\t/-/ready\t200'
+        ]['retries'] == 0
+
+    def test__it_refuses_oversized_responses(self):
+        # Setup
+        self.mock_response.read.return_value = b'x' * 11
+        client = domain.PrometheusAPIClient('app.model.svc',
+                                            max_response_size=10,
+                                            metrics=self.metrics)
+
+        # Exercise
+        with self.assertRaises(PrometheusAPIError):
+            client.request('GET', '/api/v1/status/config')
+
+        # Assert
+        self.mock_response.read.assert_called_once_with(11)
+        assert self.mock_http_connection.return_value.close.called
+        assert not self.mock_sleep.called
+
+    def test__it_records_the_calls(self):
+        # Setup
+        self.mock_response.read.return_value = b'{"status": "success"}'
+        client = domain.PrometheusAPIClient('app.model.svc',
+                                            metrics=self.metrics)
+
+        # Exercise
+        client.request('GET', '/api/v1/query?query=up')
+
+        # Assert
+        series = self.metrics.to_dict()[
+            'prometheus\tGET\t/api/v1/query\t200'
+        ]
+        assert series['count'] == 1
+        assert series['bytes_received'] == 21
+
+
 class BuildPrometheusConfig(unittest.TestCase):
 
     def test__it_does_not_add_the_kube_metrics_scrape_config(self):
@@ -378,10 +1517,20 @@ class BuildPrometheusConfig(unittest.TestCase):
                             ]
                         }
                     ]
+                },
+                {
+                    'job_name': 'scrape-targets',
+                    'file_sd_configs': [{
+                        'files': ['/etc/prometheus-targets/*.json'],
+                        'refresh_interval': '1m',
+                    }]
                 }
             ],
             'alerting': {}
         }
+        expected_config['scrape_configs'].insert(0, {
+            'job_name': prometheus_config.fingerprint_job_name
+        })
 
         self.assertEqual(
             expected_config, yaml.safe_load(prometheus_config.yaml_dump())
@@ -416,6 +1565,13 @@ class BuildPrometheusConfig(unittest.TestCase):
                             ]
                         }
                     ]
+                },
+                {
+                    'job_name': 'scrape-targets',
+                    'file_sd_configs': [{
+                        'files': ['/etc/prometheus-targets/*.json'],
+                        'refresh_interval': '1m',
+                    }]
                 }
             ],
             'alerting': {}
@@ -426,6 +1582,9 @@ class BuildPrometheusConfig(unittest.TestCase):
 
         for scrape_config in k8s_scrape_configs:
             expected_config['scrape_configs'].append(scrape_config)
+        expected_config['scrape_configs'].insert(0, {
+            'job_name': prometheus_config.fingerprint_job_name
+        })
 
         self.assertEqual(
             expected_config, yaml.safe_load(prometheus_config.yaml_dump())
@@ -0,0 +1,146 @@
+import sys
+import unittest
+sys.path.append('src')
+from instrumentation import (
+    LATENCY_BUCKETS,
+    parse_text_exposition,
+    RequestMetrics,
+    Sample,
+)
+
+
+class RequestMetricsTest(unittest.TestCase):
+
+    def test__it_aggregates_requests_by_labels(self):
+        # Setup
+        metrics = RequestMetrics()
+
+        # Exercise
+        metrics.observe('kubernetes', 'GET', '/a', 200, 0.02, 100)
+        metrics.observe('kubernetes', 'GET', '/a', 200, 0.3, 50, retries=1)
+        metrics.observe('kubernetes', 'GET', '/a', 404, 0.001, 10)
+
+        # Assert
+        recorded = metrics.to_dict()
+        assert len(recorded) == 2
+        series = recorded['kubernetes\tGET\t/a\t200']
+        assert series['count'] == 2
+        assert series['latency_sum'] == 0.32
+        assert series['bytes_received'] == 150
+        assert series['retries'] == 1
+        # Buckets are cumulative
+        assert series['buckets'][LATENCY_BUCKETS.index(0.01)] == 0
+        assert series['buckets'][LATENCY_BUCKETS.index(0.025)] == 1
+        assert series['buckets'][LATENCY_BUCKETS.index(0.5)] == 2
+
+    def test__it_merges_a_round_tripped_registry(self):
+        # Setup
+        stored = RequestMetrics()
+        stored.observe('kubernetes', 'GET', '/a', 200, 0.02, 100)
+        current = RequestMetrics()
+        current.observe('kubernetes', 'GET', '/a', 200, 0.02, 100)
+        current.observe('kubernetes', 'GET', '/b', 200, 0.02, 100)
+
+        # Exercise
+        metrics = RequestMetrics.from_dict(stored.to_dict())
+        metrics.merge(current)
+
+        # Assert
+        recorded = metrics.to_dict()
+        assert recorded['kubernetes\tGET\t/a\t200']['count'] == 2
+        assert recorded['kubernetes\tGET\t/a\t200']['bytes_received'] == 200
+        assert recorded['kubernetes\tGET\t/b\t200']['count'] == 1
+
+    def test__it_renders_the_prometheus_text_format(self):
+        # Setup
+        metrics = RequestMetrics()
+        metrics.observe('kubernetes', 'GET', '/a/"b"', 200, 0.02, 100,
+                        retries=2)
+
+        # Exercise
+        text = metrics.render()
+
+        # Assert
+        labels = 'client="kubernetes",method="GET",path="/a/\\"b\\"",' \
+                 'status="200"'
+        lines = text.splitlines()
+        assert '# TYPE charm_http_request_duration_seconds histogram' \
+            in lines
+        assert 'charm_http_request_duration_seconds_bucket{' + labels + \
+            ',le="0.01"} 0' in lines
+        assert 'charm_http_request_duration_seconds_bucket{' + labels + \
+            ',le="0.025"} 1' in lines
+        assert 'charm_http_request_duration_seconds_bucket{' + labels + \
+            ',le="+Inf"} 1' in lines
+        assert 'charm_http_request_duration_seconds_sum{' + labels + \
+            '} 0.02' in lines
+        assert 'charm_http_request_duration_seconds_count{' + labels + \
+            '} 1' in lines
+        assert 'charm_http_response_bytes_total{' + labels + '} 100' \
+            in lines
+        assert 'charm_http_request_retries_total{' + labels + '} 2' \
+            in lines
+        assert text.endswith('\n')
+
+
+class ParseTextExpositionTest(unittest.TestCase):
+
+    def test__it_parses_what_the_registry_renders(self):
+        # Setup
+        metrics = RequestMetrics()
+        metrics.observe('kubernetes', 'GET', '/a/"b"', 200, 0.02, 100)
+
+        # Exercise
+        samples = list(parse_text_exposition(
+            metrics.render().splitlines()
+        ))
+
+        # Assert
+        assert len(samples) == len(LATENCY_BUCKETS) + 5
+        assert samples[-1] == Sample(
+            'charm_http_request_retries_total',
+            {
+                'client': 'kubernetes',
+                'method': 'GET',
+                'path': '/a/"b"',
+                'status': '200',
+            },
+            0,
+            None
+        )
+
+    def test__it_parses_special_values_and_timestamps(self):
+        # Exercise
+        samples = list(parse_text_exposition([
+            b'# TYPE up gauge\n',
+            b'up{job="a,b}c"} 1 1500000000000\n',
+            b'\n',
+            b'nan_gauge NaN\n',
+            b'inf_gauge{} +Inf\n',
+            b'escaped{a="\\\\",b="\\n"} -1.5e-3\n',
+        ]))
+
+        # Assert
+        assert samples[0] == Sample('up', {'job': 'a,b}c'}, 1,
+                                    1500000000000)
+        assert samples[1].name == 'nan_gauge'
+        assert samples[1].value != samples[1].value
+        assert samples[2] == Sample('inf_gauge', {}, float('inf'), None)
+        assert samples[3] == Sample('escaped', {'a': '\\', 'b': '\n'},
+                                    -0.0015, None)
+
+    def test__it_is_lazy(self):
+        # Setup
+        def lines():
+            yield 'first 1'
+            raise AssertionError("Read past the first sample")
+
+        # Exercise
+        sample = next(parse_text_exposition(lines()))
+
+        # Assert
+        assert sample.name == 'first'
+
+    def test__it_raises_on_malformed_lines(self):
+        with self.assertRaises(ValueError):
+            list(parse_text_exposition(['foo bar']))
@@ -0,0 +1,67 @@
+import sys
+from unittest.mock import MagicMock
+import unittest
+
+sys.path.append('lib')
+sys.path.append('src')
+from interface_scrape_target import get_scrape_targets
+
+
+def create_mock_relation(relation_id, units_data):
+    relation = MagicMock()
+    relation.name = 'scrape-target'
+    relation.id = relation_id
+    relation.units = set()
+    relation.data = {}
+    for unit_name, data in units_data.items():
+        unit = MagicMock()
+        unit.name = unit_name
+        relation.units.add(unit)
+        relation.data[unit] = data
+    return relation
+
+
+class GetScrapeTargetsTest(unittest.TestCase):
+
+    def test__it_collects_the_targets_of_each_relation(self):
+        # Setup
+        relations = [
+            create_mock_relation(1, {
+                'foo/0': {'hostname': '10.0.0.1', 'port': '9100'},
+                'foo/1': {'ingress-address': '10.0.0.2', 'port': '9100',
+                          'metrics_path': '/stats'},
+            }),
+            create_mock_relation(2, {
+                'bar/0': {'private-address': '10.0.1.1', 'port': '8080'},
+            }),
+        ]
+
+        # Exercise
+        scrape_targets = get_scrape_targets(relations)
+
+        # Assert
+        assert set(scrape_targets.keys()) == \
+            {'scrape-target-1', 'scrape-target-2'}
+        assert sorted(scrape_targets['scrape-target-1'],
+                      key=lambda t: t['unit']) == [
+            {'unit': 'foo/0', 'hostname': '10.0.0.1', 'port': '9100',
+             'metrics_path': None},
+            {'unit': 'foo/1', 'hostname': '10.0.0.2', 'port': '9100',
+             'metrics_path': '/stats'},
+        ]
+        assert scrape_targets['scrape-target-2'] == [
+            {'unit': 'bar/0', 'hostname': '10.0.1.1', 'port': '8080',
+             'metrics_path': None},
+        ]
+
+    def test__it_skips_units_that_have_not_advertised_an_endpoint(self):
+        # Setup
+        relations = [create_mock_relation(1, {
+            'foo/0': {'hostname': '10.0.0.1'},
+        })]
+
+        # Exercise
+        scrape_targets = get_scrape_targets(relations)
+
+        # Assert
+        assert scrape_targets == {'scrape-target-1': []}
@@ -0,0 +1,63 @@
+import sys
+import unittest
+sys.path.append('src')
+import yaml
+import domain
+import yaml_codec
+from domain_test import get_default_charm_config
+
+
+class YAMLCodecTest(unittest.TestCase):
+
+    def setUp(self):
+        charm_config = get_default_charm_config()
+        charm_config['monitor-k8s'] = True
+        self.config_dict = \
+            domain.build_prometheus_config(charm_config).to_dict()
+
+    def test__it_round_trips_the_prometheus_config(self):
+        # Exercise
+        loaded = yaml_codec.load(yaml_codec.dump(self.config_dict))
+
+        # Assert
+        assert loaded == self.config_dict
+
+    def test__it_dumps_dicts_in_key_order(self):
+        # Exercise
+        dumped = yaml_codec.dump({'b': 1, 'a': {'d': 2, 'c': 3}})
+
+        # Assert
+        assert dumped == 'a:\n  c: 3\n  d: 2\nb: 1\n'
+
+    @unittest.skipUnless(yaml_codec.LIBYAML, "PyYAML built without libyaml")
+    def test__libyaml_and_pure_python_dump_the_same_bytes(self):
+        # Setup
+        tricky = {
+            'long': 'a' * 100 + ' b' * 50,
+            'multiline': 'line1\nline2',
+            'quoted': "it's: here",
+            'unicode': 'h\u00e9llo',
+            'boolish': 'yes',
+            'empty': '',
+            'none': None,
+        }
+
+        for data in (self.config_dict, tricky):
+            # Exercise
+            fast = yaml_codec.dump(data, dumper=yaml.CSafeDumper)
+            slow = yaml_codec.dump(data, dumper=yaml.SafeDumper)
+
+            # Assert
+            assert fast == slow
+
+    @unittest.skipUnless(yaml_codec.LIBYAML, "PyYAML built without libyaml")
+    def test__libyaml_and_pure_python_load_the_same_data(self):
+        # Setup
+        dumped = yaml_codec.dump(self.config_dict)
+
+        # Exercise
+        fast = yaml_codec.load(dumped, loader=yaml.CSafeLoader)
+        slow = yaml_codec.load(dumped, loader=yaml.SafeLoader)
+
+        # Assert
+        assert fast == slow